@@ -0,0 +1,191 @@
+import asyncio
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta, timezone
+
+# Precios en USD por unidad: token de entrada/salida, segundo de audio o carácter sintetizado.
+# Los modelos con fecha (gpt-4o-2024-08-06) usan el precio del prefijo más largo.
+PRICES = {
+    "gpt-4o-mini": {"prompt": 0.15 / 1e6, "completion": 0.60 / 1e6},
+    "gpt-4o": {"prompt": 2.50 / 1e6, "completion": 10.00 / 1e6},
+    "gpt-4-turbo": {"prompt": 10.00 / 1e6, "completion": 30.00 / 1e6},
+    "gpt-3.5-turbo": {"prompt": 0.50 / 1e6, "completion": 1.50 / 1e6},
+    "whisper-1": {"audio_second": 0.006 / 60},
+    "tts-1-hd": {"character": 30.00 / 1e6},
+    "tts-1": {"character": 15.00 / 1e6},
+}
+
+_COUNTERS = ("events", "prompt_tokens", "completion_tokens", "audio_seconds", "characters", "cost_usd")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    day TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    model TEXT NOT NULL,
+    events INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    audio_seconds REAL NOT NULL DEFAULT 0,
+    characters INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, user_id, kind, stage, model)
+)
+"""
+
+_UPSERT = f"""
+INSERT INTO usage (day, user_id, kind, stage, model, {", ".join(_COUNTERS)})
+VALUES (?, ?, ?, ?, ?, {", ".join("?" for _ in _COUNTERS)})
+ON CONFLICT (day, user_id, kind, stage, model) DO UPDATE SET
+{", ".join(f"{name} = {name} + excluded.{name}" for name in _COUNTERS)}
+"""
+
+
+def price(model):
+    """Precios del modelo, buscando por el prefijo más largo; {} si no se conoce."""
+    model = model or ""
+    matches = [name for name in PRICES if model.startswith(name)]
+    return PRICES[max(matches, key=len)] if matches else {}
+
+
+def cost(model, prompt_tokens=0, completion_tokens=0, audio_seconds=0, characters=0):
+    prices = price(model)
+    return (
+        prompt_tokens * prices.get("prompt", 0)
+        + completion_tokens * prices.get("completion", 0)
+        + audio_seconds * prices.get("audio_second", 0)
+        + characters * prices.get("character", 0)
+    )
+
+
+def _today():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+class UsageLedger:
+    """Consumo de OpenAI por usuario, tipo de respuesta, etapa y modelo.
+
+    Cada llamada se suma en memoria con `record`; `flush` escribe los totales
+    acumulados en SQLite en una sola transacción (en el executor). El gasto del
+    día por usuario se mantiene en memoria para aplicar los presupuestos sin
+    consultar la base.
+    """
+
+    def __init__(self, path, executor, daily_budget=0.0):
+        self.path = path
+        self.executor = executor
+        self.daily_budget = daily_budget
+        # (día, user_id, kind, stage, model) -> contadores de _COUNTERS
+        self._pending = {}
+        # (día, user_id) -> USD gastados
+        self._spent = {}
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    @contextmanager
+    def _connect(self):
+        """Conexión en una transacción: confirma o revierte al salir y luego cierra la conexión
+        (el `with` de sqlite3 solo maneja la transacción)."""
+        with closing(sqlite3.connect(self.path, timeout=30)) as db, db:
+            yield db
+
+    def _load(self, day):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute(_SCHEMA)
+            return db.execute(
+                "SELECT user_id, SUM(cost_usd) FROM usage WHERE day = ? GROUP BY user_id", (day,)
+            ).fetchall()
+
+    async def load(self):
+        """Crear la tabla si falta y recuperar el gasto de hoy (los presupuestos sobreviven a un reinicio)."""
+        day = _today()
+        for user_id, spent in await self._run(self._load, day):
+            self._spent[(day, user_id)] = self._spent.get((day, user_id), 0.0) + spent
+
+    def record(self, user_id, kind, stage, model, prompt_tokens=0, completion_tokens=0,
+               audio_seconds=0.0, characters=0):
+        """Sumar una llamada a OpenAI y devolver su costo en USD."""
+        day = _today()
+        amount = cost(model, prompt_tokens, completion_tokens, audio_seconds, characters)
+        key = (day, user_id or 0, kind, stage, model or "")
+        counters = self._pending.setdefault(key, [0, 0, 0, 0.0, 0, 0.0])
+        for index, value in enumerate((1, prompt_tokens, completion_tokens, audio_seconds, characters, amount)):
+            counters[index] += value
+        self._spent[(day, user_id or 0)] = self._spent.get((day, user_id or 0), 0.0) + amount
+        return amount
+
+    def spent_today(self, user_id):
+        return self._spent.get((_today(), user_id or 0), 0.0)
+
+    def over_budget(self, user_id):
+        """True si el usuario ya gastó su presupuesto diario (0 = sin límite)."""
+        return bool(self.daily_budget) and self.spent_today(user_id) >= self.daily_budget
+
+    def _write(self, rows):
+        with self._connect() as db:
+            db.execute(_SCHEMA)
+            db.executemany(_UPSERT, rows)
+
+    async def flush(self):
+        """Escribir en SQLite lo acumulado desde el último flush y devolver cuántas filas fueron."""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        rows = [key + tuple(counters) for key, counters in pending.items()]
+        try:
+            await self._run(self._write, rows)
+        except Exception:
+            # Devolver lo no escrito para el próximo intento
+            for key, counters in pending.items():
+                merged = self._pending.setdefault(key, [0, 0, 0, 0.0, 0, 0.0])
+                for index, value in enumerate(counters):
+                    merged[index] += value
+            raise
+        # El gasto de días anteriores ya no se consulta
+        today = _today()
+        self._spent = {key: value for key, value in self._spent.items() if key[0] == today}
+        return len(rows)
+
+    # Consultas
+
+    def _query(self, sql, params):
+        with self._connect() as db:
+            db.execute(_SCHEMA)
+            return db.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _since(days):
+        return (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+
+    async def top_users(self, days=1, limit=10):
+        """Usuarios que más gastaron en los últimos `days` días: [(user_id, USD, respuestas)]."""
+        await self.flush()
+        return await self._run(self._query, """
+            SELECT user_id, SUM(cost_usd) AS spent, SUM(CASE WHEN stage = 'run' THEN events ELSE 0 END)
+            FROM usage WHERE day >= ? GROUP BY user_id ORDER BY spent DESC LIMIT ?
+        """, (self._since(days), limit))
+
+    async def cost_by_kind(self, days=30):
+        """Costo por tipo de respuesta: [(kind, respuestas, USD, USD por respuesta)]."""
+        await self.flush()
+        rows = await self._run(self._query, """
+            SELECT kind, SUM(CASE WHEN stage = 'run' THEN events ELSE 0 END) AS answers, SUM(cost_usd)
+            FROM usage WHERE day >= ? GROUP BY kind ORDER BY SUM(cost_usd) DESC
+        """, (self._since(days),))
+        return [(kind, answers, spent, spent / answers if answers else spent) for kind, answers, spent in rows]
+
+    async def usage_by_model(self, days=30):
+        """Consumo por etapa y modelo: [(stage, model, tokens entrada, tokens salida, segundos, caracteres, USD)]."""
+        await self.flush()
+        return await self._run(self._query, """
+            SELECT stage, model, SUM(prompt_tokens), SUM(completion_tokens), SUM(audio_seconds),
+                   SUM(characters), SUM(cost_usd)
+            FROM usage WHERE day >= ? GROUP BY stage, model ORDER BY SUM(cost_usd) DESC
+        """, (self._since(days),))
@@ -0,0 +1,240 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Prioridades de admisión: menor número, antes
+INTERACTIVE = 0
+BULK = 1
+BACKGROUND = 2
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """Duración de las cabeceras de OpenAI (`"6m0s"`, `"1.5s"`, `"20ms"`, `"30"`) en segundos."""
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        return sum(float(amount) * _UNITS[unit] for amount, unit in _DURATION.findall(value))
+
+
+class TokenBucket:
+    """Cupo de peticiones o tokens de un modelo, ajustado con cada respuesta de OpenAI.
+
+    Hasta la primera respuesta no se conoce el límite y todo pasa. Después, el
+    nivel es el `remaining` informado menos lo admitido desde entonces, y se
+    rellena linealmente para llegar a `limit` en el tiempo de `reset`.
+    """
+
+    def __init__(self):
+        self.capacity = None
+        self.level = 0.0
+        self.rate = 0.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Segundos hasta que haya `amount` disponible (0 = ya)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.capacity is None or not amount:
+            return 0.0
+        self._refill(now)
+        # Una petición más grande que el cupo entero pasa con el balde lleno
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate if self.rate else 1.0
+
+    def take(self, amount, now):
+        self._refill(now)
+        if self.capacity is not None:
+            self.level -= amount
+
+    def update(self, limit, remaining, reset, now):
+        if remaining < limit and reset > 0:
+            self.rate = (limit - remaining) / reset
+        else:
+            self.rate = max(self.rate, limit / 60)
+        self.capacity = limit
+        self.level = remaining
+        self.updated = now
+
+    def block(self, seconds, now):
+        """Tras un 429: nada pasa hasta `seconds` y el cupo se da por agotado."""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.level = 0.0
+        self.updated = now
+
+
+class _Model:
+    def __init__(self):
+        self.requests = TokenBucket()
+        self.tokens = TokenBucket()
+        # (prioridad, orden de llegada, future, tokens)
+        self.queue = []
+        self.timer = None
+
+
+class AdmissionController:
+    """Admisión compartida para todas las llamadas a OpenAI, por modelo y con prioridades.
+
+    Cada llamada espera turno en la cola de su modelo hasta que los baldes de
+    peticiones y de tokens (alimentados por las cabeceras `x-ratelimit-*`)
+    tienen cupo; se atiende primero la prioridad más baja y, a igual
+    prioridad, por orden de llegada. Un 429 bloquea el modelo hasta el
+    `retry-after` y la llamada vuelve a la cola en vez de fallar. Los errores
+    para los que `is_transient(error)` es verdadero (p. ej. un 5xx o una
+    conexión cortada) se reintentan hasta `transient_retries` veces con
+    espera exponencial desde `transient_backoff` segundos.
+    """
+
+    def __init__(self, executor, metrics=None, max_retries=5, backoff=1.0, is_transient=None, transient_retries=2,
+                 transient_backoff=0.5):
+        self.executor = executor
+        self.metrics = metrics
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.is_transient = is_transient or (lambda error: False)
+        self.transient_retries = transient_retries
+        self.transient_backoff = transient_backoff
+        self.models = {}
+        self._order = itertools.count()
+        self.stats = {"admitted": 0, "rate_limited": 0, "transient_retries": 0}
+
+    def _model(self, model):
+        if model not in self.models:
+            self.models[model] = _Model()
+        return self.models[model]
+
+    def queued(self, model=None):
+        """Llamadas esperando admisión, de un modelo o de todos."""
+        if model is None:
+            states = self.models.values()
+        else:
+            states = [self.models[model]] if model in self.models else []
+        return sum(1 for state in states for entry in state.queue if not entry[2].done())
+
+    def busy(self, model):
+        """Si `model` está en pausa tras un 429 o tiene llamadas esperando cupo."""
+        state = self.models.get(model)
+        if state is None:
+            return False
+        return state.requests.blocked_until > time.monotonic() or self.queued(model) > 0
+
+    def _dispatch(self, state):
+        if state.timer:
+            state.timer.cancel()
+            state.timer = None
+        now = time.monotonic()
+        while state.queue:
+            _, _, future, tokens = state.queue[0]
+            if future.done():
+                # La llamada se canceló mientras esperaba
+                heapq.heappop(state.queue)
+                continue
+            wait = max(state.requests.wait_time(1, now), state.tokens.wait_time(tokens, now))
+            if wait > 0:
+                state.timer = asyncio.get_running_loop().call_later(wait, self._dispatch, state)
+                return
+            heapq.heappop(state.queue)
+            state.requests.take(1, now)
+            state.tokens.take(tokens, now)
+            self.stats["admitted"] += 1
+            future.set_result(None)
+
+    async def acquire(self, model, tokens=0, priority=INTERACTIVE):
+        """Esperar hasta que `model` tenga cupo para una petición de `tokens` tokens."""
+        state = self._model(model)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(state.queue, (priority, next(self._order), future, tokens))
+        self._dispatch(state)
+        await future
+
+    def observe(self, model, headers):
+        """Actualizar los baldes de `model` con las cabeceras de una respuesta."""
+        state = self._model(model)
+        now = time.monotonic()
+        for kind, bucket in (("requests", state.requests), ("tokens", state.tokens)):
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if limit is None or remaining is None:
+                continue
+            try:
+                bucket.update(int(limit), int(remaining), parse_duration(headers.get(f"x-ratelimit-reset-{kind}")), now)
+            except ValueError:
+                continue
+        self._dispatch(state)
+
+    def _retry_after(self, headers, attempt):
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        for name in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+            seconds = parse_duration(headers.get(name))
+            if seconds:
+                return seconds
+        return self.backoff * 2 ** attempt
+
+    async def call(self, model, request, tokens=0, priority=INTERACTIVE, lane=None, guard=None):
+        """Ejecutar `request()` cuando haya cupo y devolver la respuesta ya parseada.
+
+        `request` debe hacer la llamada con `with_raw_response` para que las
+        cabeceras de límite lleguen hasta aquí. Corre en los hilos de `lane`
+        si se indica, o en el executor compartido. `guard(corrutina)`, si se
+        indica, envuelve cada intento pero no la espera de cupo (p. ej. el
+        circuito y el tope de la etapa): esperar un 429 no es una caída.
+        """
+        loop = asyncio.get_running_loop()
+
+        async def send():
+            return await loop.run_in_executor(lane.executor if lane else self.executor, request)
+
+        failures = 0
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            await self.acquire(model, tokens, priority)
+            if self.metrics:
+                self.metrics.observe("openai_admission_wait", time.perf_counter() - started, model)
+            try:
+                raw = await (guard(send()) if guard else send())
+            except Exception as e:
+                response = getattr(e, "response", None)
+                if response is not None:
+                    self.observe(model, response.headers)
+                if getattr(e, "status_code", None) != 429:
+                    if failures >= self.transient_retries or not self.is_transient(e):
+                        raise
+                    failures += 1
+                    self.stats["transient_retries"] += 1
+                    delay = self.transient_backoff * 2 ** (failures - 1) * random.uniform(0.75, 1.25)
+                    logger.warning(f"Error pasajero de OpenAI en {model} ({e!r}); reintento {failures} en {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                if attempt == self.max_retries or getattr(e, "code", None) == "insufficient_quota":
+                    # Sin reintentos, o sin saldo: esperar no sirve
+                    raise
+                self.stats["rate_limited"] += 1
+                delay = self._retry_after(response.headers, attempt)
+                logger.warning(f"OpenAI limitó {model} (429); reintento {attempt + 1} en {delay:.1f}s")
+                state = self._model(model)
+                state.requests.block(delay, time.monotonic())
+                self._dispatch(state)
+                attempt += 1
+                continue
+            self.observe(model, raw.headers)
+            return raw.parse()
@@ -0,0 +1,68 @@
+"""Verificar que ningún handler bloquea el bucle de eventos, con Telegram y OpenAI falsos.
+
+Uso (desde la raíz del repositorio):
+
+    python -m bench.blocking --max-block-ms 50
+
+Corre el bot en este mismo proceso con LOOP_WATCHDOG_MS activo, le envía
+mensajes de texto, voz y fotos de varios usuarios a la vez y termina con
+código 1 si el bucle estuvo bloqueado más de `--max-block-ms`, mostrando los
+puntos del código responsables.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from bench.fakes import FakeBotAPI, FakeOpenAI, Latency
+from bench.load import KINDS, LoadTest
+from bench.replay import run
+from bench.startup import bot_env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-block-ms", type=float, default=50.0)
+    parser.add_argument("--users", type=int, default=6)
+    parser.add_argument("--rounds", type=int, default=2, help="mensajes de cada tipo por usuario")
+    args = parser.parse_args()
+
+    telegram = FakeBotAPI().start()
+    openai = FakeOpenAI(latencies={"run_in_progress": Latency(0.5, 0.3)}).start()
+    load = LoadTest(telegram, args.users, dict.fromkeys(KINDS, 1))
+    # Mensajes de todos los usuarios intercalados, cada 50 ms
+    records = []
+    for round_index in range(args.rounds):
+        for kind in KINDS:
+            for index in range(args.users):
+                records.append((len(records) * 0.05, load.make_message(kind, load.user_id(index))))
+
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            os.environ.update(bot_env(telegram, openai, cache_dir))
+            os.environ.update({"METRICS_PORT": "0", "TRAFFIC_RECORD_PATH": "",
+                               "LOOP_WATCHDOG_MS": str(args.max_block_ms),
+                               "USAGE_DB_PATH": os.path.join(cache_dir, "usage.sqlite3")})
+            # Que las importaciones diferidas no cuenten como bloqueo de un handler
+            import custom
+            custom.get_openai_client()
+            started = time.perf_counter()
+            application, sent, _ = asyncio.run(run(records, 1.0, telegram))
+    finally:
+        telegram.stop()
+        openai.stop()
+
+    watchdog = application.bot_data['loop_watchdog']
+    print(f"{len(records)} updates en {time.perf_counter() - started:.1f} s, "
+          f"{sent['replies']} mensajes enviados, {sent['errors']} con error")
+    print(watchdog.report())
+    if watchdog.max_lag * 1000 > args.max_block_ms:
+        print(f"FALLA: el bucle estuvo bloqueado {watchdog.max_lag * 1000:.0f} ms (máximo {args.max_block_ms:.0f} ms)")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,641 @@
+"""Servidores falsos locales para medir el bot sin salir a la red.
+
+`FakeBotAPI` imita lo que el bot usa del Bot API de Telegram, `FakeOpenAI`
+lo que usa de la API de OpenAI, con latencias configurables, y `FakeS3` un
+almacén S3/MinIO. Corren en un hilo con `ThreadingHTTPServer`
+y registran cada llamada con su instante (`time.perf_counter`).
+"""
+import base64
+import hashlib
+import hmac
+import json
+import math
+import random
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta, timezone
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, parse_qsl, quote, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "RetieBot", "username": "retie_bot"}
+
+
+def parse_body(content_type, body):
+    """Parámetros de una petición del bot: JSON, formulario o multipart (con archivos)."""
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+        params = {}
+        for part in message.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True)
+            params[name] = payload if part.get_filename() else payload.decode()
+        return params
+    return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+
+class FakeServer:
+    """Servidor HTTP en un hilo; las subclases implementan `route`."""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                try:
+                    status, payload, content_type, *extra = server.route(self.command, self.path, self.headers, body)
+                except Exception as e:
+                    status, payload, content_type = 500, json.dumps({"error": repr(e)}).encode(), "application/json"
+                    extra = []
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", content_type)
+                    for name, value in (extra[0] if extra else {}).items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    if self.command != "HEAD":
+                        self.wfile.write(payload)
+                except ConnectionError:
+                    # El cliente se fue (p. ej. el bot se detuvo durante un long-poll)
+                    self.close_connection = True
+
+            do_GET = do_POST = do_DELETE = do_PUT = do_HEAD = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.calls = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, name, params=None):
+        with self.lock:
+            self.calls.append((time.perf_counter(), name, params or {}))
+
+    def route(self, method, path, headers, body):
+        raise NotImplementedError
+
+    @staticmethod
+    def json_response(payload, status=200):
+        return status, json.dumps(payload).encode(), "application/json"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeBotAPI(FakeServer):
+    """Bot API de Telegram falso: getMe, getUpdates, envío de mensajes y archivos."""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__(host, port)
+        self.updates = []
+        self.files = {}
+        self.condition = threading.Condition()
+        self.next_message_id = 1000
+        self.next_update_id = 1
+        self.on_send = None
+
+    def push_update(self, update):
+        """Encolar un Update (dict) para el próximo getUpdates."""
+        with self.condition:
+            if "update_id" not in update:
+                update["update_id"] = self.next_update_id
+            self.next_update_id = max(self.next_update_id, update["update_id"]) + 1
+            self.updates.append(update)
+            self.condition.notify_all()
+
+    def add_file(self, file_id, file_unique_id, content):
+        """Registrar un archivo que el bot podrá pedir con getFile y descargar."""
+        self.files[file_id] = {"file_unique_id": file_unique_id, "content": content,
+                               "file_path": f"files/{file_unique_id}"}
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = min(float(params.get("timeout") or 0), 1.0)
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                pending = [update for update in self.updates if update["update_id"] >= offset]
+                remaining = deadline - time.monotonic()
+                if pending or remaining <= 0:
+                    return pending[:int(params.get("limit") or 100)]
+                self.condition.wait(remaining)
+
+    def _message(self, params, **extra):
+        with self.lock:
+            self.next_message_id += 1
+            message_id = self.next_message_id
+        chat_id = int(params.get("chat_id", 0))
+        message = {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                   "from": BOT_USER}
+        message.update(extra)
+        return message
+
+    def route(self, method, path, headers, body):
+        path = urlsplit(path).path
+        if path.startswith("/file/bot"):
+            file_path = path.split("/", 3)[3]
+            for file in self.files.values():
+                if file["file_path"] == file_path:
+                    self.record("download", {"file_path": file_path})
+                    return 200, file["content"], "application/octet-stream"
+            return 404, b"", "text/plain"
+
+        api_method = path.rsplit("/", 1)[-1]
+        params = parse_body(headers.get("Content-Type", ""), body)
+        if api_method != "getUpdates":
+            self.record(api_method, params)
+
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method == "getUpdates":
+            result = self._get_updates(params)
+        elif api_method == "getFile":
+            file = self.files.get(params.get("file_id"))
+            if file is None:
+                return self.json_response({"ok": False, "error_code": 400, "description": "file not found"}, 400)
+            result = {"file_id": params["file_id"], "file_unique_id": file["file_unique_id"],
+                      "file_size": len(file["content"]), "file_path": file["file_path"]}
+        elif api_method == "sendMessage":
+            result = self._message(params, text=params.get("text", ""))
+        elif api_method == "sendVoice":
+            result = self._message(params, voice={"file_id": f"voice-{time.perf_counter_ns()}",
+                                                  "file_unique_id": f"v{time.perf_counter_ns()}", "duration": 1})
+        elif api_method in ("editMessageText", "editMessageReplyMarkup"):
+            result = self._message(params, text=params.get("text", ""))
+        else:
+            result = True
+
+        if self.on_send and api_method.startswith("send"):
+            self.on_send(api_method, params)
+        return self.json_response({"ok": True, "result": result})
+
+
+class Latency:
+    """Distribución log-normal de latencias, dada por su mediana y su sigma."""
+
+    def __init__(self, median, sigma=0.0):
+        self.median = median
+        self.sigma = sigma
+
+    @classmethod
+    def parse(cls, spec):
+        """`"2.0"` o `"2.0:0.5"` (mediana en segundos y sigma)."""
+        median, _, sigma = spec.partition(":")
+        return cls(float(median), float(sigma or 0))
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.median), self.sigma)
+
+
+DEFAULT_LATENCIES = {
+    "run_queued": Latency(0.3, 0.5),
+    "run_in_progress": Latency(2.0, 0.5),
+    "transcription": Latency(0.8, 0.4),
+    "speech": Latency(0.6, 0.4),
+    "file_upload": Latency(0.3, 0.4),
+    "request": Latency(0.05, 0.3),
+}
+
+
+class FakeOpenAI(FakeServer):
+    """API de OpenAI falsa: asistentes, hilos, mensajes, ejecuciones, audio y archivos.
+
+    Las ejecuciones pasan por `queued` e `in_progress` durante tiempos sacados
+    de `latencies` y al completarse agregan un mensaje del asistente al hilo.
+    Con `requests_per_minute` cada respuesta lleva cabeceras `x-ratelimit-*`
+    y lo que excede el límite recibe un 429 con `retry-after-ms`. `outages`
+    simula caídas: {"assistants" | "audio": (desde, hasta)} en segundos desde
+    que se creó el servidor, durante los que esa parte de la API responde 503
+    ("assistants" es todo salvo el audio, como en los circuitos del bot).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latencies=None, model="gpt-4o", requests_per_minute=None,
+                 outages=None):
+        super().__init__(host, port)
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.model = model
+        self.threads = {}
+        self.runs = {}
+        self.counter = 0
+        self.requests_per_minute = requests_per_minute
+        self.allowance = float(requests_per_minute or 0)
+        self.allowance_at = time.monotonic()
+        self.rate_limited = 0
+        self.outages = outages or {}
+        self.created = time.monotonic()
+        self.unavailable = 0
+        # Archivos subidos y aún no borrados
+        self.files = set()
+
+    def _id(self, prefix):
+        with self.lock:
+            self.counter += 1
+            return f"{prefix}_{self.counter}"
+
+    def _wait(self, name):
+        time.sleep(self.latencies[name].sample())
+
+    def _message(self, thread_id, role, content, run_id=None):
+        blocks = []
+        for block in content if isinstance(content, list) else [{"type": "text", "text": content}]:
+            if block.get("type") == "text":
+                blocks.append({"type": "text", "text": {"value": block["text"], "annotations": []}})
+            else:
+                blocks.append(block)
+        message = {"id": self._id("msg"), "object": "thread.message", "created_at": int(time.time()),
+                   "thread_id": thread_id, "role": role, "content": blocks, "status": "completed",
+                   "assistant_id": None, "run_id": run_id, "attachments": [], "metadata": {}}
+        self.threads[thread_id].append(message)
+        return message
+
+    def _run_status(self, run):
+        """Estado de la ejecución según el tiempo transcurrido desde que se creó."""
+        if run.get("cancelled"):
+            return "cancelled"
+        elapsed = time.monotonic() - run["created"]
+        if elapsed < run["queued"]:
+            return "queued"
+        if elapsed < run["queued"] + run["in_progress"]:
+            return "in_progress"
+        with self.lock:
+            answered, run["answered"] = run["answered"], True
+        if not answered:
+            self._message(run["thread_id"], "assistant", f"Respuesta simulada ({run['id']}).", run["id"])
+        return "completed"
+
+    def _run_object(self, run):
+        status = self._run_status(run)
+        usage = None
+        if status == "completed":
+            usage = {"prompt_tokens": run["prompt_tokens"], "completion_tokens": run["completion_tokens"],
+                     "total_tokens": run["prompt_tokens"] + run["completion_tokens"]}
+        return {"id": run["id"], "object": "thread.run", "created_at": run["created_at"],
+                "thread_id": run["thread_id"], "assistant_id": run["assistant_id"], "status": status,
+                "model": run["model"], "instructions": "", "tools": [], "metadata": {}, "usage": usage}
+
+    def _admit(self):
+        """(admitida, cabeceras de límite) según un balde de `requests_per_minute`."""
+        limit = self.requests_per_minute
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(limit, self.allowance + (now - self.allowance_at) * limit / 60)
+            self.allowance_at = now
+            admitted = self.allowance >= 1
+            if admitted:
+                self.allowance -= 1
+            else:
+                self.rate_limited += 1
+            full_in = (limit - self.allowance) * 60 / limit
+            headers = {"x-ratelimit-limit-requests": str(limit),
+                       "x-ratelimit-remaining-requests": str(int(self.allowance)),
+                       "x-ratelimit-reset-requests": f"{full_in:.3f}s"}
+            if not admitted:
+                headers["retry-after-ms"] = str(int((1 - self.allowance) * 60_000 / limit) + 1)
+        return admitted, headers
+
+    def _down(self, path):
+        """Si la parte de la API de `path` está en una caída simulada."""
+        parts = urlsplit(path).path.strip("/").split("/")[1:]
+        service = "audio" if parts[:1] == ["audio"] else "assistants"
+        if service not in self.outages:
+            return False
+        start, end = self.outages[service]
+        return start <= time.monotonic() - self.created < end
+
+    def route(self, method, path, headers, body):
+        if self.outages and self._down(path):
+            with self.lock:
+                self.unavailable += 1
+            self.record(f"503 {method} {urlsplit(path).path}")
+            return self.json_response({"error": {"message": "Service unavailable", "type": "server_error"}}, 503)
+        if not self.requests_per_minute:
+            return self._route(method, path, headers, body)
+        admitted, limit_headers = self._admit()
+        if not admitted:
+            self.record(f"429 {method} {urlsplit(path).path}")
+            payload = {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+            return 429, json.dumps(payload).encode(), "application/json", limit_headers
+        return *self._route(method, path, headers, body), limit_headers
+
+    def _route(self, method, path, headers, body):
+        url = urlsplit(path)
+        path, query = url.path, dict(parse_qsl(url.query))
+        self.record(f"{method} {path}")
+        parts = path.strip("/").split("/")[1:]
+        params = parse_body(headers.get("Content-Type", ""), body)
+        self._wait("request")
+
+        if parts[:1] == ["assistants"] and len(parts) == 2:
+            return self.json_response({"id": parts[1], "object": "assistant", "created_at": int(time.time()),
+                                       "model": self.model, "tools": [], "name": "RETIE"})
+        if parts == ["threads"] and method == "POST":
+            thread_id = self._id("thread")
+            self.threads[thread_id] = []
+            return self.json_response({"id": thread_id, "object": "thread", "created_at": int(time.time()),
+                                       "metadata": {}})
+        if parts[:1] == ["threads"] and len(parts) >= 3 and parts[1] not in self.threads:
+            return self.json_response({"error": {"message": f"No thread found with id '{parts[1]}'."}}, 404)
+        if parts[:1] == ["threads"] and parts[2:] == ["messages"]:
+            thread_id = parts[1]
+            if method == "POST":
+                return self.json_response(self._message(thread_id, params.get("role", "user"), params["content"]))
+            data = [message for message in self.threads[thread_id]
+                    if query.get("run_id") in (None, message["run_id"])]
+            # Los mensajes ya están en orden de creación; por defecto la API los da del más nuevo al más viejo
+            if query.get("order", "desc") == "desc":
+                data.reverse()
+            return self.json_response({"object": "list", "data": data, "has_more": False,
+                                       "first_id": data[0]["id"] if data else None,
+                                       "last_id": data[-1]["id"] if data else None})
+        if parts[:1] == ["threads"] and parts[2:] == ["runs"] and method == "POST":
+            run = {"id": self._id("run"), "thread_id": parts[1], "assistant_id": params.get("assistant_id"),
+                   "created": time.monotonic(), "created_at": int(time.time()), "answered": False,
+                   "model": params.get("model") or self.model,
+                   "prompt_tokens": random.randint(800, 4000), "completion_tokens": random.randint(50, 400),
+                   "queued": self.latencies["run_queued"].sample(),
+                   "in_progress": self.latencies["run_in_progress"].sample()}
+            self.runs[run["id"]] = run
+            return self.json_response(self._run_object(run))
+        if parts[:1] == ["threads"] and parts[2:3] == ["runs"] and parts[4:] == ["cancel"] and method == "POST":
+            run = self.runs.get(parts[3])
+            if run is None:
+                return self.json_response({"error": {"message": f"No run found with id '{parts[3]}'."}}, 404)
+            run["cancelled"] = True
+            return self.json_response(self._run_object(run))
+        if parts[:1] == ["threads"] and parts[2:3] == ["runs"] and len(parts) == 4:
+            run = self.runs.get(parts[3])
+            if run is None:
+                return self.json_response({"error": {"message": f"No run found with id '{parts[3]}'."}}, 404)
+            return self.json_response(self._run_object(run))
+        if parts == ["audio", "transcriptions"]:
+            self._wait("transcription")
+            return self.json_response({"text": "¿Cuál es la distancia mínima de seguridad?"})
+        if parts == ["audio", "speech"]:
+            self._wait("speech")
+            return 200, b"OggS" + bytes(2048), "audio/ogg"
+        if parts == ["files"] and method == "POST":
+            self._wait("file_upload")
+            upload = params.get("file", b"")
+            file_id = self._id("file")
+            with self.lock:
+                self.files.add(file_id)
+            return self.json_response({"id": file_id, "object": "file", "bytes": len(upload),
+                                       "created_at": int(time.time()), "filename": "image.jpg",
+                                       "purpose": params.get("purpose", "vision"), "status": "processed"})
+        if parts[:1] == ["files"] and len(parts) == 2 and method == "DELETE":
+            with self.lock:
+                if parts[1] not in self.files:
+                    return self.json_response({"error": {"message": f"No such File object: {parts[1]}"}}, 404)
+                self.files.discard(parts[1])
+            return self.json_response({"id": parts[1], "object": "file", "deleted": True})
+        return self.json_response({"error": {"message": f"{method} {path} no implementado"}}, 404)
+
+
+# Partes mínimas de una subida multiparte (salvo la última), como en S3
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+_S3_AUTHORIZATION = re.compile(r"AWS4-HMAC-SHA256 Credential=([^/]+)/([^,]+), SignedHeaders=([^,]+), Signature=(\w+)")
+
+
+def _xml(root, children):
+    return f'<?xml version="1.0" encoding="UTF-8"?><{root}>{children}</{root}>'.encode()
+
+
+def _http_date(moment):
+    return moment.strftime("%a, %d %b %Y %H:%M:%S GMT")
+
+
+class FakeS3(FakeServer):
+    """Almacén S3 falso (como MinIO) con un solo bucket en memoria.
+
+    Verifica las firmas SigV4, tanto en la cabecera Authorization como en las
+    URLs prefirmadas (incluida su expiración), con un cálculo propio e
+    independiente de `s3.py`: una firma mal hecha recibe 403
+    SignatureDoesNotMatch como en el servidor real. Implementa lo que usa
+    `s3.S3Client`: objetos (PUT, GET, HEAD, DELETE y copia), borrado en lote,
+    listado v2, regla de ciclo de vida y subida multiparte, que exige partes
+    de al menos 5 MiB salvo la última.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, access_key="bench", secret_key="bench-secret", bucket="bench",
+                 region="us-east-1"):
+        super().__init__(host, port)
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.bucket = bucket
+        self.region = region
+        # clave -> {"data", "content_type", "etag", "modified"}
+        self.objects = {}
+        # id de subida -> {"key", "content_type", "parts": {número: (etag, datos)}}
+        self.uploads = {}
+        self.lifecycle = None
+        self.counter = 0
+
+    @staticmethod
+    def _error(status, code, message=""):
+        body = _xml("Error", f"<Code>{code}</Code><Message>{escape(message)}</Message>")
+        return status, body, "application/xml"
+
+    # Firma SigV4
+
+    @staticmethod
+    def _canonical_query(query):
+        return "&".join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in sorted(query))
+
+    def _signature(self, timestamp, canonical_request):
+        date = timestamp[:8]
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", timestamp, f"{date}/{self.region}/s3/aws4_request",
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        key = f"AWS4{self.secret_key}".encode()
+        for part in (date, self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    def _check_presigned(self, method, path, query, headers):
+        params = dict(query)
+        if not params.get("X-Amz-Credential", "").startswith(f"{self.access_key}/"):
+            return self._error(403, "InvalidAccessKeyId")
+        signed_at = datetime.strptime(params.get("X-Amz-Date", ""), "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+        if datetime.now(timezone.utc) > signed_at + timedelta(seconds=int(params.get("X-Amz-Expires", 0))):
+            return self._error(403, "AccessDenied", "Request has expired")
+        canonical_request = "\n".join([
+            method, path, self._canonical_query([(k, v) for k, v in query if k != "X-Amz-Signature"]),
+            f"host:{headers.get('Host', '')}\n", "host", "UNSIGNED-PAYLOAD",
+        ])
+        if not hmac.compare_digest(self._signature(params["X-Amz-Date"], canonical_request),
+                                   params["X-Amz-Signature"]):
+            return self._error(403, "SignatureDoesNotMatch")
+        return None
+
+    def _check_signature(self, method, path, query, headers, body):
+        """Respuesta de error si la petición no está bien firmada, o None."""
+        if any(name == "X-Amz-Signature" for name, _ in query):
+            return self._check_presigned(method, path, query, headers)
+        match = _S3_AUTHORIZATION.fullmatch(headers.get("Authorization", ""))
+        if match is None:
+            return self._error(403, "AccessDenied", "Missing or malformed Authorization")
+        access_key, _, signed, signature = match.groups()
+        if access_key != self.access_key:
+            return self._error(403, "InvalidAccessKeyId")
+        payload_hash = headers.get("x-amz-content-sha256", "")
+        if payload_hash != hashlib.sha256(body).hexdigest():
+            return self._error(400, "XAmzContentSHA256Mismatch")
+        content_md5 = headers.get("Content-MD5")
+        if content_md5 and content_md5 != base64.b64encode(hashlib.md5(body).digest()).decode():
+            return self._error(400, "BadDigest")
+        names = signed.split(";")
+        canonical_request = "\n".join([
+            method, path, self._canonical_query(query),
+            "".join(f"{name}:{' '.join(headers.get(name, '').split())}\n" for name in names),
+            signed, payload_hash,
+        ])
+        if not hmac.compare_digest(self._signature(headers.get("x-amz-date", ""), canonical_request), signature):
+            return self._error(403, "SignatureDoesNotMatch")
+        return None
+
+    # Operaciones
+
+    def _store(self, key, data, content_type, etag):
+        self.objects[key] = {"data": data, "content_type": content_type, "etag": etag,
+                             "modified": datetime.now(timezone.utc)}
+        return self.objects[key]
+
+    def route(self, method, path, headers, body):
+        url = urlsplit(path)
+        query = parse_qsl(url.query, keep_blank_values=True)
+        params = dict(query)
+        self.record(f"{method} {url.path}", params)
+        error = self._check_signature(method, url.path, query, headers, body)
+        if error:
+            return error
+        bucket, _, key = url.path.lstrip("/").partition("/")
+        if bucket != self.bucket:
+            return self._error(404, "NoSuchBucket")
+        key = unquote(key)
+        with self.lock:
+            if key:
+                return self._object(method, key, params, headers, body)
+            return self._bucket(method, params, body)
+
+    def _bucket(self, method, params, body):
+        if method in ("HEAD", "PUT") and not params:
+            return 200, b"", "application/xml"
+        if method == "PUT" and "lifecycle" in params:
+            self.lifecycle = body.decode()
+            return 200, b"", "application/xml"
+        if method == "GET" and params.get("list-type") == "2":
+            keys = sorted(key for key in self.objects
+                          if key.startswith(params.get("prefix", "")) and key > params.get("start-after", ""))
+            max_keys = int(params.get("max-keys", 1000))
+            contents = "".join(
+                f"<Contents><Key>{escape(key)}</Key>"
+                f"<LastModified>{self.objects[key]['modified']:%Y-%m-%dT%H:%M:%S.000Z}</LastModified>"
+                f"<ETag>{escape(self.objects[key]['etag'])}</ETag><Size>{len(self.objects[key]['data'])}</Size>"
+                "</Contents>" for key in keys[:max_keys]
+            )
+            truncated = "true" if len(keys) > max_keys else "false"
+            return 200, _xml("ListBucketResult", f"<Name>{self.bucket}</Name><KeyCount>{min(len(keys), max_keys)}"
+                                                 f"</KeyCount><IsTruncated>{truncated}</IsTruncated>{contents}"), \
+                "application/xml"
+        if method == "POST" and "delete" in params:
+            request = ET.fromstring(body)
+            quiet = (request.findtext("Quiet") or "").lower() == "true"
+            deleted = ""
+            for element in request.iter("Object"):
+                key = element.findtext("Key")
+                # S3 da por borrada también una clave que no existe
+                self.objects.pop(key, None)
+                if not quiet:
+                    deleted += f"<Deleted><Key>{escape(key)}</Key></Deleted>"
+            return 200, _xml("DeleteResult", deleted), "application/xml"
+        return self._error(405, "MethodNotAllowed")
+
+    def _object(self, method, key, params, headers, body):
+        if "uploadId" in params:
+            return self._multipart(method, key, params, body)
+        if method == "POST" and "uploads" in params:
+            self.counter += 1
+            upload_id = f"upload-{self.counter}"
+            self.uploads[upload_id] = {"key": key, "content_type": headers.get("Content-Type", ""), "parts": {}}
+            return 200, _xml("InitiateMultipartUploadResult", f"<Bucket>{self.bucket}</Bucket>"
+                                                              f"<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>"), \
+                "application/xml"
+        if method == "PUT" and headers.get("x-amz-copy-source"):
+            source_bucket, _, source_key = unquote(headers["x-amz-copy-source"]).lstrip("/").partition("/")
+            source = self.objects.get(source_key) if source_bucket == self.bucket else None
+            if source is None:
+                return self._error(404, "NoSuchKey")
+            copy = self._store(key, source["data"], source["content_type"], source["etag"])
+            return 200, _xml("CopyObjectResult", f"<LastModified>{copy['modified']:%Y-%m-%dT%H:%M:%S.000Z}"
+                                                 f"</LastModified><ETag>{escape(copy['etag'])}</ETag>"), \
+                "application/xml"
+        if method == "PUT":
+            stored = self._store(key, body, headers.get("Content-Type", "application/octet-stream"),
+                                 f'"{hashlib.md5(body).hexdigest()}"')
+            return 200, b"", "application/xml", {"ETag": stored["etag"]}
+        if method in ("GET", "HEAD"):
+            stored = self.objects.get(key)
+            if stored is None:
+                return self._error(404, "NoSuchKey")
+            return 200, stored["data"], stored["content_type"], {"ETag": stored["etag"],
+                                                                 "Last-Modified": _http_date(stored["modified"])}
+        if method == "DELETE":
+            self.objects.pop(key, None)
+            return 204, b"", "application/xml"
+        return self._error(405, "MethodNotAllowed")
+
+    def _multipart(self, method, key, params, body):
+        upload = self.uploads.get(params["uploadId"])
+        if upload is None or upload["key"] != key:
+            return self._error(404, "NoSuchUpload")
+        if method == "PUT":
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            upload["parts"][int(params["partNumber"])] = (etag, body)
+            return 200, b"", "application/xml", {"ETag": etag}
+        if method == "DELETE":
+            del self.uploads[params["uploadId"]]
+            return 204, b"", "application/xml"
+        if method != "POST":
+            return self._error(405, "MethodNotAllowed")
+        requested = [(int(part.findtext("PartNumber")), part.findtext("ETag"))
+                     for part in ET.fromstring(body).iter("Part")]
+        numbers = [number for number, _ in requested]
+        if not requested or numbers != sorted(set(numbers)):
+            return self._error(400, "InvalidPartOrder")
+        if any(upload["parts"].get(number, (None,))[0] != etag for number, etag in requested):
+            return self._error(400, "InvalidPart")
+        chunks = [upload["parts"][number][1] for number in numbers]
+        if any(len(chunk) < S3_MIN_PART_SIZE for chunk in chunks[:-1]):
+            return self._error(400, "EntityTooSmall")
+        digest = hashlib.md5(b"".join(hashlib.md5(chunk).digest() for chunk in chunks)).hexdigest()
+        stored = self._store(key, b"".join(chunks), upload["content_type"], f'"{digest}-{len(chunks)}"')
+        del self.uploads[params["uploadId"]]
+        return 200, _xml("CompleteMultipartUploadResult", f"<Bucket>{self.bucket}</Bucket><Key>{escape(key)}</Key>"
+                                                          f"<ETag>{escape(stored['etag'])}</ETag>"), "application/xml"
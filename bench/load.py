@@ -0,0 +1,278 @@
+"""Prueba de carga: usuarios sintéticos contra el bot real, con Telegram y OpenAI falsos.
+
+Uso (desde la raíz del repositorio):
+
+    python -m bench.load --users 20 --duration 60 --mix text=6,voice=2,photo=2
+    python -m bench.load --latency run_in_progress=4:0.6 --metrics
+    python -m bench.load --openai-rpm 300
+    python -m bench.load --outage audio=10:40 --outage assistants=20:30
+
+Lanza `custom.py` como proceso aparte apuntando a `bench.fakes`. Cada usuario
+envía un mensaje (texto, nota de voz o foto), espera la respuesta completa y
+envía el siguiente. Los usuarios escriben desde un grupo, donde el bot cita el
+mensaje al que responde: cada respuesta se atribuye a su mensaje y una tardía
+o repetida no descuadra las siguientes. Al final informa el throughput, los
+percentiles de latencia y las tasas de error y de timeouts por tipo de mensaje.
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from bench.fakes import FakeBotAPI, FakeOpenAI, Latency
+from bench.startup import ROOT, bot_env
+
+KINDS = ("text", "voice", "photo")
+# Mensajes que envía el bot por cada tipo; el último es la respuesta del asistente
+EXPECTED_REPLIES = {"text": 1, "voice": 2, "photo": 1}
+# Respuestas del bot que indican que algo falló
+ERROR_REPLIES = ("Error", "Hubo un error", "No pude", "No se detectó")
+# Respuestas sin el asistente: "alta demanda", mensaje vencido en la cola, plazo vencido en una etapa
+# o una dependencia caída
+SHED_REPLIES = ("Estamos con alta demanda", "Tu mensaje esperó demasiado", "La respuesta está tardando demasiado",
+                "El asistente no está disponible", "El servicio de voz no está disponible",
+                "No puedo descargar archivos")
+QUESTIONS = (
+    "¿Cuál es la distancia mínima de seguridad para líneas de 13,2 kV?",
+    "¿Qué dice el RETIE sobre la puesta a tierra en viviendas?",
+    "¿Cada cuánto se debe inspeccionar una subestación?",
+)
+PHOTO_SIZES = ((90, 90, 2_000), (320, 320, 20_000), (1280, 1280, 180_000))
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def parse_mix(spec):
+    """`"text=6,voice=2,photo=2"` -> pesos por tipo de mensaje."""
+    mix = {}
+    for item in spec.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"Tipo de mensaje desconocido: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+class LoadTest:
+    """Usuarios que envían mensajes en bucle cerrado y registran cada resultado."""
+
+    def __init__(self, telegram, users, mix, think_time=0.0, timeout=60.0):
+        self.telegram = telegram
+        self.users = users
+        self.mix = mix
+        self.think_time = think_time
+        self.timeout = timeout
+        # message_id del mensaje en espera -> cola de textos con que el bot le respondió
+        self.replies = {}
+        # Respuestas a mensajes que ya no se esperan (tardías o repetidas) o que no citan ninguno
+        self.unmatched = 0
+        self.results = []
+        self.lock = threading.Lock()
+        self.counter = 0
+        telegram.on_send = self.on_send
+
+    @staticmethod
+    def user_id(index):
+        return 10_000 + index
+
+    def on_send(self, api_method, params):
+        reply_to = params.get("reply_parameters") or {}
+        if isinstance(reply_to, str):
+            reply_to = json.loads(reply_to)
+        message_id = reply_to.get("message_id") or params.get("reply_to_message_id")
+        with self.lock:
+            replies = self.replies.get(int(message_id)) if message_id else None
+            if replies is None:
+                self.unmatched += 1
+                return
+        replies.put(params.get("text") or params.get("caption") or "")
+
+    def _unique(self, prefix):
+        with self.lock:
+            self.counter += 1
+            return f"{prefix}{self.counter}"
+
+    def make_message(self, kind, user_id):
+        """Mensaje de `user_id` desde su propio grupo, para que el bot lo cite al responder."""
+        user = {"id": user_id, "is_bot": False, "first_name": f"Usuario {user_id}"}
+        message = {"message_id": int(self._unique("")), "date": int(time.time()),
+                   "chat": {"id": -user_id, "type": "group", "title": f"Grupo {user_id}"}, "from": user}
+        if kind == "text":
+            message["text"] = random.choice(QUESTIONS)
+        elif kind == "voice":
+            file_id, unique_id = self._unique("voice-"), self._unique("v")
+            content = os.urandom(6_000)
+            self.telegram.add_file(file_id, unique_id, content)
+            message["voice"] = {"file_id": file_id, "file_unique_id": unique_id, "duration": 3,
+                                "mime_type": "audio/ogg", "file_size": len(content)}
+        else:
+            message["photo"] = []
+            for width, height, size in PHOTO_SIZES:
+                file_id, unique_id = self._unique("photo-"), self._unique("p")
+                self.telegram.add_file(file_id, unique_id, os.urandom(size))
+                message["photo"].append({"file_id": file_id, "file_unique_id": unique_id,
+                                         "width": width, "height": height, "file_size": size})
+            message["caption"] = random.choice(QUESTIONS)
+        return {"message": message}
+
+    def user_loop(self, index, stop_at):
+        user_id = self.user_id(index)
+        kinds, weights = zip(*self.mix.items())
+        while time.monotonic() < stop_at:
+            kind = random.choices(kinds, weights)[0]
+            update = self.make_message(kind, user_id)
+            message_id = update["message"]["message_id"]
+            replies = queue.Queue()
+            with self.lock:
+                self.replies[message_id] = replies
+            sent = time.perf_counter()
+            self.telegram.push_update(update)
+            outcome, texts = "ok", []
+            try:
+                for _ in range(EXPECTED_REPLIES[kind]):
+                    texts.append(replies.get(timeout=self.timeout))
+                    if texts[-1].startswith(SHED_REPLIES + ERROR_REPLIES):
+                        break
+            except queue.Empty:
+                outcome = "timeout"
+            if any(text.startswith(ERROR_REPLIES) for text in texts):
+                outcome = "error"
+            if any(text.startswith(SHED_REPLIES) for text in texts):
+                outcome = "shed"
+            with self.lock:
+                self.results.append((kind, outcome, time.perf_counter() - sent))
+                # Lo que llegue después para este mensaje cuenta como sobrante
+                del self.replies[message_id]
+                self.unmatched += replies.qsize()
+            if self.think_time:
+                time.sleep(random.expovariate(1 / self.think_time))
+
+    def run(self, duration):
+        stop_at = time.monotonic() + duration
+        threads = [threading.Thread(target=self.user_loop, args=(index, stop_at), daemon=True)
+                   for index in range(self.users)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def percentile(values, quantile):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(quantile * len(ordered)) - 1))]
+
+
+def report(results, elapsed):
+    lines = [f"{'tipo':<8}{'enviados':>10}{'ok':>8}{'errores':>9}{'timeouts':>10}{'descartes':>11}"
+             f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"]
+    for kind in KINDS + ("total",):
+        rows = [row for row in results if kind in ("total", row[0])]
+        if not rows:
+            continue
+        ok = [seconds for _, outcome, seconds in rows if outcome == "ok"]
+        errors = sum(1 for _, outcome, _ in rows if outcome == "error")
+        timeouts = sum(1 for _, outcome, _ in rows if outcome == "timeout")
+        shed = sum(1 for _, outcome, _ in rows if outcome == "shed")
+        latencies = [f"{percentile(ok, q) * 1000:>10.0f}" if ok else f"{'-':>10}" for q in (0.5, 0.95, 0.99)]
+        lines.append(f"{kind:<8}{len(rows):>10}{len(ok):>8}{errors / len(rows):>9.1%}{timeouts / len(rows):>10.1%}"
+                     f"{shed / len(rows):>11.1%}" + "".join(latencies))
+    completed = sum(1 for _, outcome, _ in results if outcome == "ok")
+    lines.append(f"Throughput: {completed / elapsed:.2f} respuestas/s en {elapsed:.1f} s")
+    return "\n".join(lines)
+
+
+def wait_until_polling(telegram, process, timeout=60):
+    """El bot hace deleteWebhook justo antes de empezar a leer updates, tras post_init."""
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if any(name == "deleteWebhook" for _, name, _ in telegram.calls):
+            return
+        if process.poll() is not None:
+            raise RuntimeError(f"El bot terminó con código {process.returncode}")
+        time.sleep(0.05)
+    raise TimeoutError("El bot no empezó a leer updates")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10, help="usuarios simultáneos")
+    parser.add_argument("--duration", type=float, default=30, help="segundos de carga")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("text=6,voice=2,photo=2"))
+    parser.add_argument("--think", type=float, default=0.0, help="pausa media entre mensajes de un usuario (s)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="espera máxima por respuesta (s)")
+    parser.add_argument("--latency", action="append", default=[], metavar="OPERACIÓN=MEDIANA[:SIGMA]",
+                        help="latencia de OpenAI: run_queued, run_in_progress, transcription, speech, "
+                             "file_upload o request")
+    parser.add_argument("--openai-rpm", type=int, help="límite de peticiones por minuto del OpenAI falso (429 al pasarlo)")
+    parser.add_argument("--outage", action="append", default=[], metavar="PARTE=DESDE:HASTA",
+                        help="caída simulada de OpenAI (503) para assistants o audio, en segundos "
+                             "desde el arranque")
+    parser.add_argument("--metrics", action="store_true", help="imprimir el /metrics del bot al terminar")
+    parser.add_argument("--bot-log", help="archivo donde guardar la salida del bot")
+    args = parser.parse_args()
+
+    latencies = {}
+    for item in args.latency:
+        name, _, spec = item.partition("=")
+        latencies[name] = Latency.parse(spec)
+
+    outages = {}
+    for item in args.outage:
+        name, _, window = item.partition("=")
+        start, _, end = window.partition(":")
+        outages[name] = (float(start), float(end))
+
+    telegram = FakeBotAPI().start()
+    openai = FakeOpenAI(latencies=latencies, requests_per_minute=args.openai_rpm, outages=outages).start()
+    metrics_port = free_port()
+    bot_log = open(args.bot_log, "w") if args.bot_log else subprocess.DEVNULL
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = bot_env(telegram, openai, cache_dir)
+            env["METRICS_PORT"] = str(metrics_port)
+            process = subprocess.Popen([sys.executable, "custom.py"], cwd=ROOT, env=env,
+                                       stdout=bot_log, stderr=bot_log)
+            try:
+                wait_until_polling(telegram, process)
+                load = LoadTest(telegram, args.users, args.mix, args.think, args.timeout)
+                elapsed = load.run(args.duration)
+                print(report(load.results, elapsed))
+                print(f"Respuestas tardías, repetidas o sin mensaje citado: {load.unmatched}")
+                if args.openai_rpm:
+                    print(f"429 de OpenAI: {openai.rate_limited}")
+                if args.outage:
+                    print(f"503 de OpenAI: {openai.unavailable}")
+                if args.metrics:
+                    print(urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics").read().decode())
+            finally:
+                process.send_signal(signal.SIGINT)
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            if "photo" in args.mix:
+                print(f"Archivos de visión que quedaron en OpenAI: {len(openai.files)}")
+    finally:
+        telegram.stop()
+        openai.stop()
+        if args.bot_log:
+            bot_log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Costo del logging: throughput de los handlers con los logs apagados, normales y en DEBUG.
+
+Uso (desde la raíz del repositorio):
+
+    python -m bench.logs --users 8 --duration 20
+    python -m bench.logs --modes off,info,debug
+
+Lanza `custom.py` una vez por modo, con Telegram y OpenAI falsos de latencia
+mínima para que el tiempo de CPU del bot domine, y guarda su salida en un
+archivo como en producción. Informa respuestas por segundo, latencia de punta
+a punta, p50 de cada handler, cuántas líneas de log se escribieron y cuántas
+respuestas llegaron de más (tardías o repetidas), que invalidarían la comparación.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import urllib.request
+
+from bench.fakes import FakeBotAPI, FakeOpenAI, Latency
+from bench.load import LoadTest, free_port, parse_mix, percentile, wait_until_polling
+from bench.startup import ROOT, bot_env
+
+# Variables de entorno de cada modo
+MODES = {
+    "off": {"LOG_LEVEL": "CRITICAL"},
+    "info": {},
+    "debug": {"LOG_LEVEL": "DEBUG", "LOG_LEVELS": "", "LOG_SAMPLE_BURST": "0"},
+    "debug-sampled": {"LOG_LEVEL": "DEBUG", "LOG_LEVELS": ""},
+}
+FAST = {name: Latency(0.01, 0.2) for name in
+        ("run_queued", "run_in_progress", "transcription", "speech", "file_upload", "request")}
+
+
+def handler_p50(metrics_text):
+    """{handler: p50 en ms} leído del /metrics del bot."""
+    result = {}
+    for line in metrics_text.splitlines():
+        if 'stage="handler_' in line and 'quantile="0.5"' in line:
+            stage = line.split('stage="', 1)[1].split('"', 1)[0]
+            result[stage] = float(line.rsplit(" ", 1)[1]) * 1000
+    return result
+
+
+def run_mode(mode, args):
+    telegram = FakeBotAPI().start()
+    openai = FakeOpenAI(latencies=FAST).start()
+    metrics_port = free_port()
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = bot_env(telegram, openai, cache_dir)
+            env.update(MODES[mode], METRICS_PORT=str(metrics_port), TRAFFIC_RECORD_PATH="",
+                       USAGE_DB_PATH=os.path.join(cache_dir, "usage.sqlite3"))
+            log_path = os.path.join(cache_dir, "bot.log")
+            with open(log_path, "w") as bot_log:
+                process = subprocess.Popen([sys.executable, "custom.py"], cwd=ROOT, env=env,
+                                           stdout=bot_log, stderr=bot_log)
+                try:
+                    wait_until_polling(telegram, process)
+                    load = LoadTest(telegram, args.users, args.mix)
+                    elapsed = load.run(args.duration)
+                    metrics_text = urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics").read().decode()
+                finally:
+                    process.send_signal(signal.SIGINT)
+                    try:
+                        process.wait(10)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+            with open(log_path, "rb") as bot_log:
+                log_lines = sum(1 for _ in bot_log)
+    finally:
+        telegram.stop()
+        openai.stop()
+    ok = [seconds for _, outcome, seconds in load.results if outcome == "ok"]
+    return {
+        "throughput": len(ok) / elapsed,
+        "p50": percentile(ok, 0.5) * 1000 if ok else 0,
+        "p95": percentile(ok, 0.95) * 1000 if ok else 0,
+        "handlers": handler_p50(metrics_text),
+        "log_lines": log_lines,
+        "failed": len(load.results) - len(ok),
+        "unmatched": load.unmatched,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("text=6,voice=2,photo=2"))
+    parser.add_argument("--modes", default="off,info,debug-sampled,debug",
+                        help=f"modos separados por comas: {', '.join(MODES)}")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes.split(","):
+        print(f"Modo {mode}…", file=sys.stderr)
+        results[mode] = run_mode(mode, args)
+
+    handlers = sorted({stage for result in results.values() for stage in result["handlers"]})
+    print(f"{'modo':<15}{'resp/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'fallas':>8}{'sobrantes':>11}{'líneas log':>12}"
+          + "".join(f"{stage.removeprefix('handler_') + ' p50':>14}" for stage in handlers))
+    for mode, result in results.items():
+        print(f"{mode:<15}{result['throughput']:>8.2f}{result['p50']:>9.0f}{result['p95']:>9.0f}"
+              f"{result['failed']:>8}{result['unmatched']:>11}{result['log_lines']:>12}"
+              + "".join(f"{result['handlers'].get(stage, 0):>14.0f}" for stage in handlers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Reproducir una grabación de tráfico contra el bot real, con Telegram y OpenAI falsos.
+
+Uso (desde la raíz del repositorio):
+
+    python -m bench.replay traffic.jsonl.gz --speed 1
+    python -m bench.replay traffic.jsonl.gz --speed 10 --metrics-out v2.prom
+    python -m bench.replay traffic.jsonl.gz --speed max
+
+La grabación la genera el bot con TRAFFIC_RECORD_PATH. Los updates se
+encolan en `Application.update_queue` al ritmo grabado (multiplicado por
+`--speed`), así que el bot procesa el mismo mix de voz, fotos y ráfagas que en
+producción. Guardar `--metrics-out` de dos versiones permite compararlas.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from bench.fakes import FakeBotAPI, FakeOpenAI, Latency
+from bench.load import ERROR_REPLIES
+from bench.startup import bot_env
+from traffic import read_recording, replay
+
+
+def register_files(telegram, data):
+    """Registrar en el Bot API falso cada archivo mencionado en la grabación."""
+    if isinstance(data, list):
+        for item in data:
+            register_files(telegram, item)
+    elif isinstance(data, dict):
+        if "file_id" in data and "file_unique_id" in data:
+            telegram.add_file(data["file_id"], data["file_unique_id"], os.urandom(data.get("file_size") or 4096))
+        for value in data.values():
+            register_files(telegram, value)
+
+
+def parse_speed(value):
+    return 0.0 if value == "max" else float(value)
+
+
+async def run(records, speed, telegram):
+    # La configuración de custom.py se lee al importarlo
+    import custom
+
+    sent = {'replies': 0, 'errors': 0}
+
+    def on_send(api_method, params):
+        sent['replies'] += 1
+        if (params.get("text") or "").startswith(ERROR_REPLIES):
+            sent['errors'] += 1
+
+    telegram.on_send = on_send
+    application = custom.build_application()
+    await application.initialize()
+    await custom.post_init(application)
+    await application.start()
+    try:
+        started = time.perf_counter()
+        await replay(application, records, speed)
+        await application.update_queue.join()
+        # Los álbumes se responden cuando vence su ventana de espera
+        while application.bot_data.get('albums'):
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await custom.post_shutdown(application)
+    return application, sent, elapsed
+
+
+def report(metrics, sent, elapsed, count):
+    lines = [
+        f"Updates: {count} en {elapsed:.1f} s ({count / elapsed:.2f}/s)",
+        f"Mensajes enviados por el bot: {sent['replies']}, con error: {sent['errors']}",
+        f"{'etapa':<20}{'n':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+    ]
+    for (stage, model), histogram in sorted(metrics.histograms.items()):
+        if stage.startswith("handler_") or stage in ("run_queued", "run_in_progress", "reply_send"):
+            lines.append(f"{stage:<20}{histogram.count:>8}" + "".join(
+                f"{histogram.percentile(quantile) / 1000:>10.0f}" for quantile in (0.5, 0.95, 0.99)
+            ))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recording", help="archivo .jsonl.gz grabado con TRAFFIC_RECORD_PATH")
+    parser.add_argument("--speed", type=parse_speed, default=1.0, help="1, 10, … o max")
+    parser.add_argument("--latency", action="append", default=[], metavar="OPERACIÓN=MEDIANA[:SIGMA]",
+                        help="latencia de OpenAI, como en bench.load")
+    parser.add_argument("--metrics-out", help="guardar las métricas del bot en formato Prometheus")
+    args = parser.parse_args()
+
+    records = read_recording(args.recording)
+    latencies = {name: Latency.parse(spec) for name, _, spec in (item.partition("=") for item in args.latency)}
+    telegram = FakeBotAPI().start()
+    openai = FakeOpenAI(latencies=latencies).start()
+    for _, data in records:
+        register_files(telegram, data)
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            os.environ.update(bot_env(telegram, openai, cache_dir))
+            os.environ.update({"METRICS_PORT": "0", "TRAFFIC_RECORD_PATH": ""})
+            _, sent, elapsed = asyncio.run(run(records, args.speed, telegram))
+    finally:
+        telegram.stop()
+        openai.stop()
+
+    from custom import metrics
+    print(report(metrics, sent, elapsed, len(records)))
+    if args.metrics_out:
+        with open(args.metrics_out, "w") as output:
+            output.write(metrics.render())
+
+
+if __name__ == "__main__":
+    main()
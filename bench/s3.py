@@ -0,0 +1,182 @@
+"""Verificar `s3.S3Client` contra un almacén S3 falso que comprueba las firmas.
+
+Uso (desde la raíz del repositorio):
+
+    python -m bench.s3
+
+Recorre las operaciones que usa el bot (put, get, stat, copy, delete_objects,
+listado, regla de ciclo de vida, `upload_stream` en un PUT y en multiparte,
+también abortada, y GET prefirmado) contra `FakeS3`, que rechaza toda firma
+SigV4 incorrecta. Muestra el resultado de cada comprobación y termina con
+código 1 si alguna falló.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from bench.fakes import S3_MIN_PART_SIZE, FakeS3
+from s3 import ObjectStorageError, S3Client
+
+
+async def chunked(data, size=256 * 1024):
+    """Flujo asíncrono de `data` en trozos, como una descarga de Telegram."""
+    for start in range(0, len(data), size):
+        await asyncio.sleep(0)
+        yield data[start:start + size]
+
+
+async def failing(data, fail_after):
+    """Flujo que se corta con un error tras `fail_after` bytes."""
+    async for chunk in chunked(data):
+        if fail_after <= 0:
+            raise ConnectionError("descarga cortada")
+        fail_after -= len(chunk)
+        yield chunk
+
+
+async def check_objects(client, store):
+    etag = await client.put_object("images/a.jpg", b"foto a", "image/jpeg")
+    assert etag == f'"{hashlib.md5(b"foto a").hexdigest()}"', etag
+    assert await client.get_object("images/a.jpg") == b"foto a"
+    headers = await client.stat_object("images/a.jpg")
+    assert headers["content-length"] == "6" and headers["content-type"] == "image/jpeg", dict(headers)
+    assert await client.stat_object("images/nada.jpg") is None
+    try:
+        await client.get_object("images/nada.jpg")
+        raise AssertionError("GET de una clave inexistente no falló")
+    except ObjectStorageError as e:
+        assert (e.status_code, e.code) == (404, "NoSuchKey"), e
+    # Claves con caracteres que hay que codificar en la firma
+    await client.put_object("images/con espacio+ñ.jpg", b"x")
+    assert await client.get_object("images/con espacio+ñ.jpg") == b"x"
+
+
+async def check_copy_and_delete(client, store):
+    await client.copy_object("images/a.jpg", "archive/a.jpg")
+    assert await client.get_object("archive/a.jpg") == b"foto a"
+    assert store.objects["archive/a.jpg"]["content_type"] == "image/jpeg"
+    listed = await client.list_objects(prefix="images/")
+    assert [key for key, _ in listed] == ["images/a.jpg", "images/con espacio+ñ.jpg"], listed
+    assert all(abs(datetime.now(timezone.utc) - modified) < timedelta(minutes=1) for _, modified in listed)
+    assert [key for key, _ in await client.list_objects(prefix="images/", start_after="images/a.jpg")] == \
+        ["images/con espacio+ñ.jpg"]
+    failed = await client.delete_objects(["images/a.jpg", "archive/a.jpg", "images/nada.jpg", "images/<&>.jpg"])
+    assert failed == [], failed
+    assert set(store.objects) == {"images/con espacio+ñ.jpg"}, set(store.objects)
+    await client.delete_object("images/con espacio+ñ.jpg")
+    assert not store.objects
+
+
+async def check_lifecycle(client, store):
+    await client.put_expiration_rule("images/", 30)
+    assert "<Prefix>images/</Prefix>" in store.lifecycle and "<Days>30</Days>" in store.lifecycle, store.lifecycle
+
+
+async def check_small_stream(client, store):
+    data = os.urandom(300 * 1024)
+    assert await client.upload_stream("images/small.jpg", chunked(data), "image/jpeg") == len(data)
+    assert await client.get_object("images/small.jpg") == data
+    assert not any("uploads" in params for _, _, params in store.calls), "un flujo chico no debe ser multiparte"
+
+
+async def check_multipart_stream(client, store):
+    data = os.urandom(2 * S3_MIN_PART_SIZE + 123_457)
+    assert await client.upload_stream("images/big.jpg", chunked(data), "image/jpeg") == len(data)
+    stored = store.objects["images/big.jpg"]
+    assert stored["data"] == data and stored["content_type"] == "image/jpeg"
+    assert stored["etag"].endswith('-3"'), stored["etag"]
+    parts = [params for _, name, params in store.calls if name.startswith("PUT") and "partNumber" in params]
+    assert sorted(int(params["partNumber"]) for params in parts) == [1, 2, 3], parts
+    assert not store.uploads, store.uploads
+
+
+async def check_aborted_stream(client, store):
+    data = os.urandom(2 * S3_MIN_PART_SIZE)
+    try:
+        await client.upload_stream("images/cut.jpg", failing(data, S3_MIN_PART_SIZE + 1))
+        raise AssertionError("la subida no propagó el error del flujo")
+    except ConnectionError:
+        pass
+    assert "images/cut.jpg" not in store.objects
+    assert not store.uploads, f"subida multiparte sin abortar: {store.uploads}"
+
+
+async def check_presigned(client, store):
+    await client.put_object("images/url.jpg", b"presignada", "image/jpeg")
+    async with httpx.AsyncClient() as http:
+        response = await http.get(client.presigned_get_object("images/url.jpg", expires=timedelta(minutes=5)))
+        assert response.status_code == 200 and response.content == b"presignada", response
+        assert response.headers["content-type"] == "image/jpeg"
+
+        other = client.presigned_get_object("images/url.jpg").replace("/images/url.jpg", "/images/otra.jpg")
+        assert (await http.get(other)).status_code == 403, "una URL alterada no debe servir"
+
+        past = datetime.now(timezone.utc) - timedelta(hours=1)
+        expired = client.presigned_get_object("images/url.jpg", expires=timedelta(minutes=5), now=past)
+        response = await http.get(expired)
+        assert response.status_code == 403 and b"AccessDenied" in response.content, response
+
+
+async def check_bad_secret(client, store):
+    wrong = S3Client(client.endpoint_url, client.access_key, "otra", client.bucket, http_client=client.http)
+    try:
+        await wrong.get_object("images/url.jpg")
+        raise AssertionError("una firma con otra clave secreta no falló")
+    except ObjectStorageError as e:
+        assert (e.status_code, e.code) == (403, "SignatureDoesNotMatch"), e
+
+
+CHECKS = [
+    ("put, get y stat", check_objects),
+    ("copy, list y delete_objects", check_copy_and_delete),
+    ("regla de ciclo de vida", check_lifecycle),
+    ("upload_stream en un PUT", check_small_stream),
+    ("upload_stream multiparte", check_multipart_stream),
+    ("upload_stream abortada", check_aborted_stream),
+    ("GET prefirmado", check_presigned),
+    ("firma con otra clave", check_bad_secret),
+]
+
+
+async def run_checks(store, max_concurrency):
+    client = S3Client(store.url, store.access_key, store.secret_key, store.bucket,
+                      part_size=S3_MIN_PART_SIZE, max_concurrency=max_concurrency)
+    failures = 0
+    try:
+        assert await client.bucket_exists()
+        for name, check in CHECKS:
+            started = time.perf_counter()
+            try:
+                await check(client, store)
+            except Exception as e:
+                failures += 1
+                print(f"FALLO {name}: {e!r}")
+            else:
+                print(f"ok    {name} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+    finally:
+        await client.aclose()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-concurrency", type=int, default=4, help="partes en vuelo de la subida multiparte")
+    args = parser.parse_args()
+
+    store = FakeS3().start()
+    try:
+        failures = asyncio.run(run_checks(store, args.max_concurrency))
+    finally:
+        store.stop()
+    print(f"{len(CHECKS) - failures}/{len(CHECKS)} comprobaciones correctas, {len(store.calls)} peticiones")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Benchmark de arranque: importación en frío y tiempo hasta atender el primer update.
+
+Uso (desde la raíz del repositorio):
+
+    python -m bench.startup --runs 5
+
+Cada corrida lanza un proceso nuevo de Python. La importación en frío se mide
+con `import custom` descontando el arranque del intérprete. El tiempo al primer
+update es desde que se lanza `custom.py` hasta que el Bot API falso recibe la
+respuesta a un /start que ya estaba en cola, con OpenAI también falso.
+"""
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.fakes import FakeBotAPI, FakeOpenAI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def bot_env(telegram, openai, cache_dir):
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": "1:bench",
+        "TELEGRAM_BASE_URL": telegram.url,
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": f"{openai.url}/v1",
+        "OPENAI_ASSISTANT_ID": "asst_bench",
+        "BLOB_STORE": env.get("BLOB_STORE", "memory"),
+        "MEDIA_CACHE_DIR": cache_dir,
+    })
+    return env
+
+
+def time_process(args, env):
+    started = time.perf_counter()
+    subprocess.run(args, cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def cold_import(env):
+    """Segundos de `import custom` en un intérprete nuevo, sin contar el intérprete."""
+    interpreter = time_process([sys.executable, "-c", "pass"], env)
+    return time_process([sys.executable, "-c", "import custom"], env) - interpreter
+
+
+def first_update(env, telegram, timeout=60):
+    """Segundos desde lanzar el bot hasta que responde al primer /start."""
+    telegram.calls.clear()
+    telegram.push_update({
+        "message": {"message_id": 1, "date": int(time.time()), "text": "/start",
+                    "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+                    "chat": {"id": 42, "type": "private"},
+                    "from": {"id": 42, "is_bot": False, "first_name": "Bench"}},
+    })
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "custom.py"], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            sent = [at for at, name, _ in telegram.calls if name == "sendMessage"]
+            if sent:
+                return sent[0] - started
+            if process.poll() is not None:
+                raise RuntimeError(f"El bot terminó con código {process.returncode}")
+            time.sleep(0.005)
+        raise TimeoutError("El bot no respondió al primer update")
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        # Descartar el update ya atendido
+        telegram.updates.clear()
+
+
+def summary(name, values):
+    return (f"{name:<22} mediana {statistics.median(values) * 1000:8.1f} ms   "
+            f"mín {min(values) * 1000:8.1f} ms   máx {max(values) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    telegram = FakeBotAPI().start()
+    openai = FakeOpenAI().start()
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = bot_env(telegram, openai, cache_dir)
+            imports = [cold_import(env) for _ in range(args.runs)]
+            first = [first_update(env, telegram) for _ in range(args.runs)]
+    finally:
+        telegram.stop()
+        openai.stop()
+
+    print(summary("Importación en frío", imports))
+    print(summary("Primer update", first))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """La dependencia está marcada como caída; se responde sin esperarla."""
+
+    def __init__(self, name):
+        super().__init__(f"Circuito abierto: {name}")
+        self.name = name
+        self.circuit = name
+
+
+class CircuitBreaker:
+    """Circuito por dependencia externa: tras `failure_threshold` fallos seguidos se abre.
+
+    Abierto, cada llamada falla al instante con CircuitOpen. Pasados
+    `reset_timeout` segundos queda medio abierto y deja pasar hasta
+    `half_open_max` llamadas de prueba: si una sale bien se cierra, si falla
+    vuelve a abrirse por otro `reset_timeout`. Se usa como `async with breaker:`
+    alrededor de la llamada; cuenta como fallo toda excepción para la que
+    `is_failure(error)` es verdadero (por defecto, todas; una cancelación nunca).
+    Con circuitos anidados, el error cuenta solo para el más interior por el
+    que pasó: una caída de Telegram dentro de una subida al almacén no abre
+    el circuito del almacén.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, half_open_max=1, is_failure=None,
+                 metrics=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self.is_failure = is_failure or (lambda error: True)
+        self.metrics = metrics
+        self._state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        if metrics:
+            metrics.gauge("circuit_state", "Estado del circuito de cada dependencia: 0 cerrado, 1 medio abierto, 2 abierto.",
+                          lambda: _STATE_VALUES[self.state], dependency=name)
+
+    @property
+    def state(self):
+        if self._state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self.probes = 0
+            logger.info(f"Circuito {self.name}: medio abierto, probando la dependencia")
+        return self._state
+
+    @property
+    def available(self):
+        """False mientras está abierto: quien llama puede ir directo a su alternativa."""
+        return self.state != OPEN
+
+    def _open(self):
+        self._state = OPEN
+        self.opened_at = time.monotonic()
+        logger.warning(f"Circuito {self.name}: abierto tras {self.failures} fallos; "
+                       f"se reintenta en {self.reset_timeout:.0f}s")
+
+    def _reject(self):
+        if self.metrics:
+            self.metrics.increment("circuit_rejected_total", "Llamadas rechazadas al instante por un circuito abierto.",
+                                   dependency=self.name)
+        raise CircuitOpen(self.name)
+
+    def _owns(self, error):
+        """Si el error es de esta dependencia: lo es salvo que ya haya salido por otro circuito."""
+        owner = getattr(error, "circuit", None)
+        if owner is None:
+            error.circuit = self.name
+            return True
+        return owner == self.name
+
+    async def __aenter__(self):
+        state = self.state
+        if state == OPEN:
+            self._reject()
+        if state == HALF_OPEN:
+            if self.probes >= self.half_open_max:
+                self._reject()
+            self.probes += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        probing = self._state == HALF_OPEN
+        if probing:
+            self.probes -= 1
+        if exc_type is None:
+            self.failures = 0
+            if probing:
+                self._state = CLOSED
+                logger.info(f"Circuito {self.name}: cerrado, la dependencia respondió")
+        elif isinstance(exc, Exception) and self._owns(exc) and self.is_failure(exc):
+            self.failures += 1
+            if probing or (self._state == CLOSED and self.failures >= self.failure_threshold):
+                self._open()
+        return False
@@ -1,287 +1,1030 @@
 import os
+import io
+import time
 import asyncio
-import requests
-import tempfile
+import logging
+import httpx
+from collections import OrderedDict
+from contextlib import aclosing
+from functools import lru_cache, partial, wraps
 from dotenv import load_dotenv
-from openai import OpenAI
-from rich.console import Console
-from telegram import Update, InputFile
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, InvalidCallbackData, filters, CallbackContext
+from telegram.request import HTTPXRequest
 from concurrent.futures import ThreadPoolExecutor
-from openai.types.beta.threads.text_content_block import TextContentBlock
 import re
-from minio import Minio
-from datetime import timedelta
+import signal
+from datetime import datetime, timedelta
+from tts import segment_text, synthesize_segments, MAX_TTS_CHARS
+from vision import choose_detail, select_photo
+from storage import ImageArchive, LifecycleSweeper, LocalBlobStore, MemoryBlobStore, MinioBlobStore, S3BlobStore
+from s3 import S3Client
+from media_cache import MediaCache
+from metrics import Metrics, serve_metrics
+from traffic import RecordingQueue, TrafficRecorder
+from accounting import UsageLedger
+from loop_watchdog import LoopWatchdog
+from profiler import SamplingProfiler, top_functions
+from log_pipeline import parse_levels, setup_logging
+from admission import AdmissionController, BACKGROUND, BULK, INTERACTIVE
+from fair_queue import FairScheduler, parse_costs
+from lanes import Lane, parse_sizes
+from deadline import Deadline, DeadlineExceeded, parse_timeouts
+from circuit_breaker import CircuitBreaker, CircuitOpen
 
 # Cargar variables de entorno
 load_dotenv()
 
 
-console = Console()
-client = OpenAI()
+
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    """Cliente de OpenAI, creado en el primer uso: importar openai tarda casi medio segundo.
+
+    Sin reintentos propios: los hace `admission`, los 429 cuando hay cupo y los
+    errores pasajeros (ver `is_transient_error`) con espera exponencial.
+    """
+    from openai import OpenAI, DefaultHttpxClient
+    return OpenAI(max_retries=0, http_client=DefaultHttpxClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=KEEPALIVE_EXPIRY)
+    ))
+
+
+def is_transient_error(error):
+    """Errores de OpenAI que se reintentan, como lo haría el SDK: 408, 409, 5xx y conexiones cortadas.
+
+    No un timeout: la petición ya usó el tiempo de su etapa.
+    """
+    from openai import APIConnectionError, APITimeoutError
+    if isinstance(error, APIConnectionError):
+        return not isinstance(error, APITimeoutError)
+    status = getattr(error, "status_code", None)
+    return status in (408, 409) or (status is not None and status >= 500)
+
+
+def openai_client(deadline=None, stage="request"):
+    """Cliente de OpenAI cuyas peticiones se abortan al acabarse el tiempo de la etapa.
+
+    Se llama dentro del hilo, justo antes de la petición, para usar el tiempo que queda entonces.
+    """
+    timeout = deadline.timeout(stage) if deadline else STAGE_TIMEOUTS.get(stage)
+    return get_openai_client().with_options(timeout=timeout) if timeout else get_openai_client()
+
 
 # Claves API
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+# Bot API alternativo (servidor propio o de pruebas); por defecto api.telegram.org
+TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL')
 ASSISTANT_ID = os.getenv('OPENAI_ASSISTANT_ID')
 
-executor = ThreadPoolExecutor()
-async def transcribe_audio(audio_path):
-    """Convierte audio a texto usando OpenAI Whisper."""
-=======
+# Configuración de voz
+TTS_MODEL = os.getenv("TTS_MODEL", "tts-1")
+TTS_VOICE = os.getenv("TTS_VOICE", "alloy")
+# Modo por frases: los segmentos se sintetizan en paralelo y se envían apenas están listos
+TTS_PIPELINE = os.getenv("TTS_PIPELINE", "1") == "1"
+TTS_MAX_CONCURRENCY = int(os.getenv("TTS_MAX_CONCURRENCY", "3"))
+TTS_SEGMENT_CHARS = int(os.getenv("TTS_SEGMENT_CHARS", "400"))
+# "button": la voz se genera solo al pulsar "🔊 Escuchar"; "always": en cada respuesta
+VOICE_REPLY_MODE = os.getenv("VOICE_REPLY_MODE", "button")
+# Respuestas recordadas para el botón de voz (las más antiguas se descartan)
+VOICE_ANSWERS_MAX = int(os.getenv("VOICE_ANSWERS_MAX", "1024"))
+LISTEN_CALLBACK = "listen"
+
+# Cómo llega la imagen al asistente: "file" la sube a OpenAI (purpose="vision")
+# desde memoria; "url" la archiva y envía una URL firmada (si el almacén da URLs)
+IMAGE_TRANSPORT = os.getenv("IMAGE_TRANSPORT", "file")
+# Archivar las imágenes en segundo plano, fuera del camino de la respuesta
+ARCHIVE_IMAGES = os.getenv("ARCHIVE_IMAGES", "1") == "1"
+# Nivel de detalle de visión: "auto" lo decide según el pie de foto, o fijo "low"/"high"
+VISION_DETAIL = os.getenv("VISION_DETAIL", "auto")
+# Segundos que se esperan fotos del mismo álbum (media_group_id) antes de responder
+MEDIA_GROUP_WINDOW = float(os.getenv("MEDIA_GROUP_WINDOW", "1.5"))
+# Las imágenes subidas a OpenAI para visión se borran tras estos segundos sin usarse (mientras tanto
+# una foto reenviada reutiliza su archivo); el barrido corre cada VISION_FILE_SWEEP_SECONDS
+VISION_FILE_TTL_SECONDS = int(os.getenv("VISION_FILE_TTL_SECONDS", "3600"))
+VISION_FILE_SWEEP_SECONDS = int(os.getenv("VISION_FILE_SWEEP_SECONDS", "300"))
+
 # Configuración de MinIO en Railway
 MINIO_ENDPOINT = "bucket-production-fabf.up.railway.app"
 MINIO_ACCESS_KEY = os.getenv("MINIO_ROOT_USER")
 MINIO_SECRET_KEY = os.getenv("MINIO_ROOT_PASSWORD")
 BUCKET_NAME = "telegram-bot-images"
 MINIO_PORT = 443
+MINIO_REGION = os.getenv("MINIO_REGION", "us-east-1")
+
+# Almacén de imágenes: "s3" (MinIO con cliente asíncrono), "minio" (cliente síncrono
+# de minio), "local" (disco, para un solo nodo) o "memory" (pruebas y mediciones)
+BLOB_STORE = os.getenv("BLOB_STORE", "s3")
+LOCAL_BLOB_DIR = os.getenv("LOCAL_BLOB_DIR", "blobs")
+# Las imágenes archivadas solo se leen durante la ejecución; las URLs firmadas duran 7 días
+IMAGE_RETENTION_DAYS = int(os.getenv("IMAGE_RETENTION_DAYS", "7"))
+LIFECYCLE_SWEEP_SECONDS = int(os.getenv("LIFECYCLE_SWEEP_SECONDS", "3600"))
+LIFECYCLE_BATCH_SIZE = int(os.getenv("LIFECYCLE_BATCH_SIZE", "1000"))
+
+# Caché en disco de lo descargado de Telegram (fotos y notas de voz)
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "downloads")
+MEDIA_CACHE_MAX_MB = int(os.getenv("MEDIA_CACHE_MAX_MB", "512"))
+MEDIA_CACHE_SWEEP_SECONDS = int(os.getenv("MEDIA_CACHE_SWEEP_SECONDS", "300"))
+
+# Tiempo máximo de cada verificación de dependencias al arrancar
+STARTUP_CHECK_TIMEOUT = float(os.getenv("STARTUP_CHECK_TIMEOUT", "10"))
+
+# Conexiones que se abren por dependencia al arrancar (0 desactiva el precalentamiento)
+WARM_CONNECTIONS = int(os.getenv("WARM_CONNECTIONS", "4"))
+# Segundos que los pools conservan una conexión inactiva (httpx las cierra a los 5 s por defecto)
+KEEPALIVE_EXPIRY = float(os.getenv("KEEPALIVE_EXPIRY", "120"))
+# Intervalo del ping que reutiliza las conexiones; menor que KEEPALIVE_EXPIRY y que
+# el cierre por inactividad de los servidores (~60 s en muchos balanceadores)
+KEEPALIVE_PING_SECONDS = float(os.getenv("KEEPALIVE_PING_SECONDS", "45"))
+
+# Endpoint de Prometheus con las latencias por etapa (0 lo desactiva)
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+# Grabación anonimizada de los updates entrantes (JSONL con gzip) para reproducirlos
+# con bench/replay.py; vacío la desactiva
+TRAFFIC_RECORD_PATH = os.getenv("TRAFFIC_RECORD_PATH", "")
+TRAFFIC_FLUSH_SECONDS = int(os.getenv("TRAFFIC_FLUSH_SECONDS", "10"))
+
+# Contabilidad de tokens, segundos de audio y caracteres de voz por usuario (SQLite)
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", "usage.sqlite3")
+USAGE_FLUSH_SECONDS = int(os.getenv("USAGE_FLUSH_SECONDS", "30"))
+# Gasto diario por usuario en USD (0 = sin límite); al superarlo se pasa a modos más
+# baratos: sin voz, visión en detalle "low" y el modelo BUDGET_MODEL en las ejecuciones
+USER_DAILY_BUDGET_USD = float(os.getenv("USER_DAILY_BUDGET_USD", "0"))
+BUDGET_MODEL = os.getenv("BUDGET_MODEL", "gpt-4o-mini")
+# Usuarios de Telegram (ids separados por comas) que pueden usar los comandos de administración
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+
+# Modo de depuración: avisar cuando algo bloquea el bucle de eventos más de estos
+# milisegundos, con el punto del código que lo bloqueó (0 lo desactiva)
+LOOP_WATCHDOG_MS = float(os.getenv("LOOP_WATCHDOG_MS", "0"))
+
+# Perfilador bajo demanda (/perfil o SIGUSR1): muestras por segundo, duración y destino
+PROFILE_HZ = int(os.getenv("PROFILE_HZ", "100"))
+PROFILE_SECONDS = int(os.getenv("PROFILE_SECONDS", "30"))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Logs: nivel general, niveles por logger ("httpx=WARNING,telegram=INFO"), formato json o text,
+# y muestreo de líneas DEBUG repetidas: a lo sumo LOG_SAMPLE_BURST por línea cada LOG_SAMPLE_WINDOW s
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_LEVELS = parse_levels(os.getenv("LOG_LEVELS", "httpx=WARNING,httpcore=WARNING,openai=WARNING,telegram=INFO"))
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "10"))
+LOG_SAMPLE_WINDOW = float(os.getenv("LOG_SAMPLE_WINDOW", "60"))
+
+# Admisión a OpenAI: reintentos tras un 429 y tokens que se reservan por ejecución del asistente
+# (instrucciones e historial del hilo incluidos), más ~4 caracteres por token del mensaje y cada imagen
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+# Reintentos de errores pasajeros de OpenAI (5xx, conexión cortada), con espera exponencial
+OPENAI_TRANSIENT_RETRIES = int(os.getenv("OPENAI_TRANSIENT_RETRIES", "2"))
+RUN_TOKENS_ESTIMATE = int(os.getenv("RUN_TOKENS_ESTIMATE", "2000"))
+IMAGE_TOKENS_ESTIMATE = {"low": 85, "high": 765, "auto": 765}
+
+# Reparto justo entre usuarios: updates atendidos a la vez, lugares de trabajo, máximo por usuario
+# y costo estimado de cada tipo de petición (una foto de un álbum cuenta por separado)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "256"))
+WORKER_SLOTS = int(os.getenv("WORKER_SLOTS", "8"))
+USER_MAX_CONCURRENCY = int(os.getenv("USER_MAX_CONCURRENCY", "1"))
+REQUEST_COSTS = parse_costs(os.getenv("REQUEST_COSTS", "text=1,voice=2,photo=4"))
+
+# Carriles aislados: hilos de cada carril y etapas simultáneas en cada uno
+LANE_WORKERS = parse_sizes(os.getenv("LANE_WORKERS", "text=8,vision=4,transcription=4,tts=4,storage=8"))
+LANE_CONCURRENCY = parse_sizes(os.getenv("LANE_CONCURRENCY", "text=16,vision=4,transcription=4,tts=6,storage=16"))
+
+# Descarte de carga: plazo para responder cada mensaje desde su `date` (0 = sin plazo), mensajes
+# en espera a partir de los cuales se contesta "alta demanda" (0 = nunca) y respuestas recientes guardadas
+# por usuario (cada una salió de su propio hilo, con su contexto)
+MESSAGE_DEADLINE_SECONDS = float(os.getenv("MESSAGE_DEADLINE_SECONDS", "120"))
+SHED_QUEUE_DEPTH = int(os.getenv("SHED_QUEUE_DEPTH", "50"))
+ANSWER_CACHE_MAX = int(os.getenv("ANSWER_CACHE_MAX", "32"))
+
+# Tope en segundos de cada etapa; el plazo del mensaje los recorta. "request" es cada petición a OpenAI
+# y "run" la ejecución completa del asistente. El botón de voz tiene su propio plazo desde que se pulsa.
+STAGE_TIMEOUTS = parse_timeouts(os.getenv(
+    "STAGE_TIMEOUTS", "download=30,upload=60,transcription=60,request=30,run=120,tts=45"
+))
+LISTEN_DEADLINE_SECONDS = float(os.getenv("LISTEN_DEADLINE_SECONDS", "60"))
+
+# Circuitos por dependencia: fallos seguidos que lo abren y segundos abierto antes de volver a probar
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+ASSISTANT_ERROR_REPLY = "Error al obtener respuesta del asistente."
+# Estados en que una ejecución ya no va a completarse; "requires_action" esperaría herramientas que el bot no tiene
+RUN_FAILED_STATUSES = ("failed", "cancelled", "expired", "incomplete", "requires_action")
+TIMEOUT_REPLY = "La respuesta está tardando demasiado. Intenta de nuevo en unos minutos, por favor."
+HIGH_DEMAND_REPLY = "Estamos con alta demanda en este momento. Intenta de nuevo en unos minutos, por favor."
+EXPIRED_REPLY = ("Tu mensaje esperó demasiado por la alta demanda y ya no alcanzo a responderlo a tiempo. "
+                 "Envíalo de nuevo si aún necesitas la respuesta.")
+VOICE_UNAVAILABLE_REPLY = "El audio de esta respuesta no está disponible en este momento. Pulsa de nuevo en un rato."
+# Avisos cuando una dependencia está caída; el almacén no tiene: sin él no se archiva y las fotos van a OpenAI
+UNAVAILABLE_REPLIES = {
+    "assistants": "El asistente no está disponible en este momento. Intenta de nuevo en unos minutos, por favor.",
+    "audio": "El servicio de voz no está disponible en este momento. Puedes escribir tu pregunta, por favor.",
+    "telegram_download": "No puedo descargar archivos de Telegram en este momento. Intenta de nuevo en unos minutos.",
+}
+
+# Tareas de fondo (consumo, grabación de tráfico, verificaciones); el trabajo de cada mensaje va por `lanes`
+executor = ThreadPoolExecutor()
 
-minio_client = Minio(
-    MINIO_ENDPOINT,
-    access_key=MINIO_ACCESS_KEY,
-    secret_key=MINIO_SECRET_KEY,
-    secure=True  # Railway usa HTTPS
+# Latencias por etapa y modelo
+metrics = Metrics()
+
+# Una pregunta de texto no espera detrás de imágenes, audios largos o subidas lentas
+lanes = {
+    name: Lane(name, LANE_WORKERS.get(name, 4), LANE_CONCURRENCY.get(name), metrics)
+    for name in ("text", "vision", "transcription", "tts", "storage")
+}
+
+
+
+def is_dependency_failure(error):
+    """Si el error indica que la dependencia está caída y debe contar para su circuito.
+
+    No cuentan los errores de la petición (4xx, incluido el 429 de cupo
+    agotado) ni un plazo que cortó lo que quedaba del mensaje y no el tope
+    de la etapa. La espera de admisión tras un 429 queda fuera del circuito
+    (ver `call_openai`).
+    """
+    if isinstance(error, DeadlineExceeded):
+        return error.stage_limit
+    if isinstance(error, BadRequest):
+        return False
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status is None or status >= 500
+
+
+# Una dependencia caída se detecta por sus fallos seguidos y mientras tanto se responde sin esperarla:
+# "assistants" es toda la API de OpenAI salvo el audio, que va en "audio"
+breakers = {
+    name: CircuitBreaker(name, CIRCUIT_FAILURES, CIRCUIT_RESET_SECONDS, is_failure=is_dependency_failure,
+                         metrics=metrics)
+    for name in ("assistants", "audio", "storage", "telegram_download")
+}
+
+# Pool de conexiones HTTP compartido por el almacenamiento y las descargas de Telegram
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=KEEPALIVE_EXPIRY),
+    timeout=httpx.Timeout(30.0, connect=5.0)
 )
 
-# Verificar conexión
-print("Conectado a MinIO en Railway.")
-
-# Asegurar que el bucket existe
-if not minio_client.bucket_exists(BUCKET_NAME):
-    minio_client.make_bucket(BUCKET_NAME)
-    print(f"Bucket {BUCKET_NAME} creado.")
-else:
-    print(f"El bucket {BUCKET_NAME} ya existe.")
 
-# Crear un nuevo thread
-executor = ThreadPoolExecutor()
 
-async def create_thread():
-    """Crear un nuevo hilo de OpenAI de forma asíncrona"""
-    loop = asyncio.get_running_loop()
-    try:
-        with open(audio_path, "rb") as audio_file:
-            response = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language="es"
+def create_blob_store(kind):
+    """Crear el almacén de imágenes configurado en BLOB_STORE."""
+    if kind == "s3":
+        # Cliente S3 asíncrono para MinIO: no bloquea el bucle de eventos durante las subidas
+        return S3BlobStore(S3Client(
+            f"https://{MINIO_ENDPOINT}:{MINIO_PORT}",
+            MINIO_ACCESS_KEY,
+            MINIO_SECRET_KEY,
+            BUCKET_NAME,
+            region=MINIO_REGION,
+            http_client=http_client
+        ))
+    if kind == "minio":
+        import certifi
+        import urllib3
+        from minio import Minio
+
+        minio_client = Minio(
+            MINIO_ENDPOINT,
+            access_key=MINIO_ACCESS_KEY,
+            secret_key=MINIO_SECRET_KEY,
+            secure=True,  # Railway usa HTTPS
+            # Como el pool predeterminado de minio, pero sin esperar 5 minutos a un servidor colgado
+            http_client=urllib3.PoolManager(
+                timeout=urllib3.Timeout(connect=5, read=STAGE_TIMEOUTS.get("upload", 60)),
+                maxsize=10,
+                cert_reqs="CERT_REQUIRED",
+                ca_certs=certifi.where(),
+                retries=urllib3.Retry(total=3, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
             )
-        return response.text  # Accede directamente a la propiedad `text`
-    except Exception as e:
-        console.print(f"Error transcribiendo audio: {e}", style="bold red")
-        return None
-
+        )
+        return MinioBlobStore(minio_client, BUCKET_NAME, lanes["storage"].executor)
+    if kind == "local":
+        return LocalBlobStore(LOCAL_BLOB_DIR, lanes["storage"].executor)
+    if kind == "memory":
+        return MemoryBlobStore()
+    raise ValueError(f"BLOB_STORE desconocido: {kind}")
 
 
-async def handle_audio_message(update: Update, context: CallbackContext):
-    """Maneja mensajes de voz en Telegram: los transcribe y responde en texto."""
-    voice = update.message.voice
-    file = await context.bot.get_file(voice.file_id)
+blob_store = create_blob_store(BLOB_STORE)
 
-    # Obtener la URL del archivo
-    file_url = file.file_path
+# Archivo de imágenes sin duplicados y con caché de URLs firmadas
+archive = ImageArchive(
+    blob_store,
+    url_expiry=min(timedelta(days=7), timedelta(days=IMAGE_RETENTION_DAYS)),
+    retention=timedelta(days=IMAGE_RETENTION_DAYS)
+)
 
-    # Crear un archivo temporal para almacenar el audio descargado
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".ogg") as temp_audio:
-        file_path = temp_audio.name
+# Borrado incremental de las imágenes que superan la retención
+lifecycle = LifecycleSweeper(
+    blob_store,
+    "images/",
+    timedelta(days=IMAGE_RETENTION_DAYS),
+    batch_size=LIFECYCLE_BATCH_SIZE,
+    on_delete=archive.forget
+)
 
-    # Descargar el archivo manualmente
-    response = requests.get(file_url)
-    with open(file_path, "wb") as audio_file:
-        audio_file.write(response.content)
+media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_MB * 1024 * 1024, lanes["storage"].executor)
 
-    console.print(f"Audio descargado: {file_path}", style="bold green")
+profiler = SamplingProfiler(hz=PROFILE_HZ)
 
-    # Transcribir el audio
-    transcript = await transcribe_audio(file_path)
+# Toda llamada a OpenAI pasa por aquí, con una clave por cupo: el modelo para el audio, "files" para
+# las subidas y "assistants" para toda la API de asistentes (hilos, mensajes y ejecuciones con
+# cualquier modelo), que comparte los mismos límites y la misma pausa tras un 429
+admission = AdmissionController(executor, metrics, max_retries=OPENAI_MAX_RETRIES, is_transient=is_transient_error,
+                                transient_retries=OPENAI_TRANSIENT_RETRIES)
 
-    # Eliminar el archivo temporal después de usarlo
-    os.remove(file_path)
+scheduler = FairScheduler(WORKER_SLOTS, per_user=USER_MAX_CONCURRENCY, metrics=metrics)
 
-    if transcript:
-        await update.message.reply_text(f"Texto transcrito: {transcript}")
+usage = UsageLedger(USAGE_DB_PATH, executor, daily_budget=USER_DAILY_BUDGET_USD)
 
-        # Obtener respuesta del asistente
-        response_text = await get_assistant_response(transcript)
+traffic_recorder = TrafficRecorder(TRAFFIC_RECORD_PATH, executor) if TRAFFIC_RECORD_PATH else None
 
-async def get_assistant_response(thread_id, user_message=None, image_url=None):
-    """Enviar un mensaje (texto + imagen) al asistente de OpenAI y devolver la respuesta"""
-    loop = asyncio.get_running_loop()
-    try:
-        content = []
+# thread_id de OpenAI -> candado que serializa los turnos de ese hilo
+thread_locks = {}
 
-        # Agregar el texto si el usuario lo proporciona
-        if user_message:
-            content.append({"type": "text", "text": user_message})
+# file_id de las imágenes subidas a OpenAI -> último uso (monotónico), para borrarlas al quedar sin uso
+vision_files = OrderedDict()
 
-        # Agregar la imagen si existe
-        if image_url:
-            content.append({"type": "image_url", "image_url": {"url": image_url}})
 
-        # Asegurarse de que hay contenido antes de enviar
-        if not content:
-            console.print("No hay contenido para enviar al asistente.", style="bold red")
-            return ["No se detectó texto ni imagen para procesar."]
+def timed(stage):
+    """Medir la duración total de un handler como la etapa `stage`."""
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(*args, **kwargs):
+            with metrics.timer(stage):
+                return await handler(*args, **kwargs)
+        return wrapper
+    return decorator
 
-        # Enviar mensaje al asistente
-        await loop.run_in_executor(executor, lambda: client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=content
-        ))
 
-        # Ejecutar el asistente con instrucciones para que solo responda la pregunta
-        my_run = await loop.run_in_executor(executor, lambda: client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=assistant_id,
-            instructions="Responde únicamente la pregunta presente en la imagen o en el texto, sin agregar información extra."
-        ))
+async def guarded(dependency, stage, deadline, awaitable):
+    """Esperar `awaitable` con el tiempo de la etapa `stage`, a través del circuito de `dependency`.
 
-        # Esperar respuesta
-        while True:
-            run_status = await loop.run_in_executor(executor, lambda: client.beta.threads.runs.retrieve(
-                thread_id=thread_id,
-                run_id=my_run.id
-            ))
-            if run_status.status == "completed":
-                break
-            await asyncio.sleep(1)
-
-        # Obtener la respuesta
-        all_messages = await loop.run_in_executor(executor, lambda: client.beta.threads.messages.list(thread_id=thread_id))
-        responses = []
-
-        latest_message_time = max(
-            msg.created_at for msg in all_messages.data if msg.role == 'assistant')
-
-        for message in all_messages.data:
-            if message.role == 'assistant' and message.created_at == latest_message_time:
-                for content_block in message.content:
-                    if isinstance(content_block, TextContentBlock):
-                        responses.append(content_block.text.value)
-
-        return responses
+    Con el circuito abierto lanza CircuitOpen al instante, sin llegar a la dependencia.
+    """
+    try:
+        async with breakers[dependency]:
+            return await deadline.run(stage, awaitable)
+    except CircuitOpen:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+
+
+async def call_openai(dependency, stage, deadline, model, request, **kwargs):
+    """Llamar a OpenAI a través de `admission` con el circuito de `dependency`.
+
+    La espera de cupo solo la corta el plazo del mensaje; el tope de `stage` y
+    el circuito rigen cada petición. Así un 429 largo hace esperar, pero no
+    abre el circuito.
+    """
+    if not breakers[dependency].available:
+        # Sin esperar cupo para una petición que el circuito va a rechazar
+        raise CircuitOpen(dependency)
+    guard = partial(guarded, dependency, stage, deadline)
+    return await deadline.run("admission", admission.call(model, request, guard=guard, **kwargs))
+
+
+def normalize_question(text):
+    return " ".join(re.sub(r"[¿?¡!.,;:]", " ", text.lower()).split())
+
+
+def remember_text_answer(context: CallbackContext, question, response):
+    """Guardar la respuesta a una pregunta de texto para responderla sin el asistente si llega vencida.
+
+    Se guarda en los datos del usuario: el asistente respondió con el contexto de su hilo y
+    no debe llegarle a otro usuario.
+    """
+    answers = context.user_data.setdefault('recent_answers', OrderedDict())
+    key = normalize_question(question)
+    answers[key] = response
+    answers.move_to_end(key)
+    while len(answers) > ANSWER_CACHE_MAX:
+        answers.popitem(last=False)
+
+
+def update_deadline(update: Update):
+    """Plazo del update: MESSAGE_DEADLINE_SECONDS desde que se envió el mensaje, o
+    LISTEN_DEADLINE_SECONDS desde ahora para un botón."""
+    if update.message is None:
+        return Deadline.after(LISTEN_DEADLINE_SECONDS, STAGE_TIMEOUTS)
+    return Deadline.from_message(update.message, MESSAGE_DEADLINE_SECONDS, STAGE_TIMEOUTS)
+
+
+async def shed(update: Update, context: CallbackContext, kind, reason, dependency=None, answered=False):
+    """Responder sin pasar por el asistente: "alta demanda" si hay demasiada cola; si el mensaje
+    ya venció o el asistente está caído, la respuesta que ya recibió el mismo usuario a esa
+    pregunta o un aviso corto. Con una dependencia caída (`reason="unavailable"`) el aviso es el de `dependency`.
+    Si el handler ya respondió el botón (`answered`), el aviso va como mensaje."""
+    if reason == "overload":
+        reply = HIGH_DEMAND_REPLY
+    elif reason == "expired":
+        reply = EXPIRED_REPLY
+    else:
+        reason, reply = f"{dependency}_unavailable", UNAVAILABLE_REPLIES[dependency]
+    if dependency in (None, "assistants") and reason != "overload" and update.message and update.message.text:
+        cached = context.user_data.get('recent_answers', {}).get(normalize_question(update.message.text))
+        if cached:
+            reason, reply = "cached", "\n".join(cached)
+    metrics.increment("shed_total", "Mensajes respondidos sin el asistente por carga o una dependencia caída.",
+                      kind=kind, reason=reason)
+    logger.info(f"Mensaje de tipo {kind} descartado ({reason})")
+    if update.callback_query and not answered:
+        await update.callback_query.answer(reply)
+    else:
+        await update.effective_message.reply_text(reply)
+
+
+def fair_share(kind, count=None, needs=()):
+    """Esperar turno en el planificador justo antes de ejecutar el handler.
+
+    El costo es el de `kind` por `count(update, context, *args)` unidades
+    (p. ej. las fotos de un álbum); el tiempo en la cola se mide como
+    `queue_wait_{kind}`. Con más de SHED_QUEUE_DEPTH mensajes en espera se
+    contesta "alta demanda" sin encolar, y un mensaje cuyo plazo vence en la
+    cola no llega al asistente. El handler recibe el plazo como `deadline`;
+    si se vence en alguna etapa se avisa al usuario. Si una de las
+    dependencias de `needs` está caída, o su circuito corta al handler a
+    mitad de camino, se responde con su aviso sin esperarla.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(update, context, *args, **kwargs):
+            deadline = update_deadline(update)
+            if SHED_QUEUE_DEPTH and scheduler.queued() >= SHED_QUEUE_DEPTH:
+                await shed(update, context, kind, "overload")
+                return
+            down = next((name for name in needs if not breakers[name].available), None)
+            if down:
+                await shed(update, context, kind, "unavailable", down)
+                return
+            cost = REQUEST_COSTS.get(kind, 1) * (count(update, context, *args) if count else 1)
+            async with scheduler.slot(update.effective_user.id, cost, kind):
+                if deadline.expired:
+                    await shed(update, context, kind, "expired")
+                    return
+                try:
+                    return await handler(update, context, *args, deadline=deadline, **kwargs)
+                except DeadlineExceeded as e:
+                    metrics.increment("deadline_exceeded_total", "Mensajes cortados por vencer su plazo en una etapa.",
+                                      kind=kind, stage=e.stage)
+                    logger.warning(f"Plazo vencido en la etapa {e.stage} de un mensaje de tipo {kind}")
+                    await update.effective_message.reply_text(TIMEOUT_REPLY)
+                except CircuitOpen as e:
+                    await shed(update, context, kind, "unavailable", e.name, answered=True)
+        return wrapper
+    return decorator
+
+
+async def create_thread(deadline=None):
+    """Crear un nuevo hilo de OpenAI de forma asíncrona"""
+    deadline = deadline or Deadline(stage_timeouts=STAGE_TIMEOUTS)
+    try:
+        thread = await call_openai("assistants", "request", deadline, "assistants", lambda: openai_client(
+            deadline
+        ).beta.threads.with_raw_response.create(), lane=lanes["text"])
+        return thread.id
+    except (DeadlineExceeded, CircuitOpen):
+        raise
     except Exception as e:
-        console.print(f"Failed to get response: {e}", style="bold red")
-        return ["Error al obtener respuesta del asistente."]
+        logger.error(f"Error creando el hilo: {e}")
+        return None
 
 
+async def get_thread_id(update: Update, context: CallbackContext, deadline=None):
+    """Obtener el hilo del usuario, creándolo si aún no existe (dentro del plazo del mensaje)."""
+    thread_id = context.user_data.get('thread_id')
+    if not thread_id:
+        thread_id = await create_thread(deadline)
+        if thread_id:
+            context.user_data['thread_id'] = thread_id
+        else:
+            await update.message.reply_text('Error iniciando la conversación con el asistente.')
+    return thread_id
 
-        # Enviar respuesta en texto
-        await update.message.reply_text(response_text)
-    else:
-        await update.message.reply_text("No pude transcribir el audio.")
+
+async def transcribe_audio(audio_bytes, deadline):
+    """Convierte audio a texto usando OpenAI Whisper."""
+    try:
+        async with lanes["transcription"].slot():
+            with metrics.timer("transcription", "whisper-1"):
+                response = await call_openai("audio", "transcription", deadline, "whisper-1", lambda: openai_client(
+                    deadline, "transcription"
+                ).audio.transcriptions.with_raw_response.create(
+                    model="whisper-1",
+                    file=("audio.ogg", audio_bytes),
+                    language="es"
+                ), lane=lanes["transcription"])
+        return response.text  # Accede directamente a la propiedad `text`
+    except (DeadlineExceeded, CircuitOpen):
+        raise
+    except Exception as e:
+        logger.error(f"Error transcribiendo audio: {e}")
+        return None
 
 
+async def generate_voice(text, deadline):
+    """Convierte texto a voz (Ogg/Opus, el formato de las notas de voz de Telegram).
 
-async def get_assistant_response(user_message):
-    """Envía mensaje a OpenAI y obtiene respuesta del asistente."""
+    Si se vence el plazo devuelve None como en cualquier otro fallo: se entregan los segmentos ya listos.
+    Con el circuito de audio abierto lanza CircuitOpen para que el usuario sepa que la voz no está disponible.
+    """
     try:
-        # Crear un nuevo thread en OpenAI si no existe
-        thread = client.beta.threads.create()
-
-        # Agregar el mensaje del usuario al thread
-        client.beta.threads.messages.create(
-            thread_id=thread.id,
-            role="user",
-            content=user_message
-        )
+        async with lanes["tts"].slot():
+            with metrics.timer("tts", TTS_MODEL):
+                response = await call_openai("audio", "tts", deadline, TTS_MODEL, lambda: openai_client(
+                    deadline, "tts"
+                ).audio.speech.with_raw_response.create(
+                    model=TTS_MODEL,
+                    voice=TTS_VOICE,
+                    input=text,
+                    response_format="opus"
+                ), priority=BULK, lane=lanes["tts"])
+        return response.content
+    except CircuitOpen:
+        raise
+    except Exception as e:
+        logger.error(f"Error generando voz: {e}")
+        return None
 
-        # Ejecutar el asistente con el thread recién creado
-        run = client.beta.threads.runs.create(
-            thread_id=thread.id,
-            assistant_id=ASSISTANT_ID
-        )
 
-        # Esperar a que la ejecución se complete
-        while True:
-            run_status = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-            if run_status.status == "completed":
-                break
-            await asyncio.sleep(1)  # Esperar antes de volver a consultar el estado
+async def send_voice_reply(message, text, user_id, kind, deadline):
+    """Envía la respuesta en voz.
+
+    En modo por frases cada segmento sale como una nota de voz en cuanto está
+    sintetizado, así el primer audio no espera a la respuesta completa.
+    Devuelve los file_id de las notas enviadas, o None si algún segmento no se pudo sintetizar.
+    """
+    if TTS_PIPELINE:
+        segments = segment_text(text, TTS_SEGMENT_CHARS)
+    else:
+        segments = [text[:MAX_TTS_CHARS]]
 
-        # Obtener los mensajes de respuesta del asistente
-        messages = client.beta.threads.messages.list(thread_id=thread.id)
+    voice_ids = []
+    caption = "Aquí está la respuesta en voz."
+    try:
+        synthesize = partial(generate_voice, deadline=deadline)
+        async with aclosing(synthesize_segments(segments, synthesize, TTS_MAX_CONCURRENCY)) as audios:
+            async for audio in audios:
+                with metrics.timer("reply_send"):
+                    sent = await message.reply_voice(voice=audio, caption=caption)
+                voice_ids.append(sent.voice.file_id)
+                caption = None
+    finally:
+        # Los segmentos salen en orden: los enviados son los primeros
+        usage.record(user_id, kind, "tts", TTS_MODEL,
+                     characters=sum(len(segment) for segment in segments[:len(voice_ids)]))
+    return voice_ids if len(voice_ids) == len(segments) else None
+
+
+def remember_answer(context: CallbackContext, text):
+    """Guardar una respuesta para generar su voz bajo demanda y devolver su id."""
+    answers = context.bot_data.setdefault('voice_answers', OrderedDict())
+    stats = context.bot_data.setdefault('voice_stats', {'offered': 0, 'requested': 0, 'presses': 0})
+    stats['offered'] += 1
+    answer_id = stats['offered']
+    answers[answer_id] = {'text': text, 'voice_ids': None}
+    while len(answers) > VOICE_ANSWERS_MAX:
+        answers.popitem(last=False)
+    return answer_id
+
+
+def listen_button(answer_id):
+    """Teclado con el botón que pide la respuesta en voz."""
+    return InlineKeyboardMarkup([[InlineKeyboardButton("🔊 Escuchar", callback_data=(LISTEN_CALLBACK, answer_id))]])
+
+
+def is_listen_callback(data):
+    """Filtrar los callbacks del botón de voz, incluidos los que ya expiraron."""
+    return isinstance(data, InvalidCallbackData) or (isinstance(data, tuple) and data[0] == LISTEN_CALLBACK)
+
+
+@fair_share("voice", needs=("audio",))
+async def handle_listen_button(update: Update, context: CallbackContext, deadline: Deadline):
+    """Genera la respuesta en voz (o la reutiliza) cuando el usuario pulsa "🔊 Escuchar"."""
+    query = update.callback_query
+    await query.answer()
+
+    answer = None
+    if not isinstance(query.data, InvalidCallbackData):
+        _, answer_id = query.data
+        answer = context.bot_data.get('voice_answers', {}).get(answer_id)
+    if answer is None:
+        await query.message.reply_text("Esta respuesta ya no está disponible en voz.")
+        return
+
+    stats = context.bot_data['voice_stats']
+    stats['presses'] += 1
+    if answer['voice_ids'] is None:
+        if usage.over_budget(query.from_user.id):
+            await query.message.reply_text("Alcanzaste el límite de uso de hoy; la respuesta en voz vuelve mañana.")
+            return
+        stats['requested'] += 1
+        logger.info(
+            f"Voz solicitada en {stats['requested']} de {stats['offered']} respuestas "
+            f"({stats['requested'] / stats['offered']:.0%})"
+        )
+        voice_ids = await send_voice_reply(query.message, answer['text'], query.from_user.id, "listen", deadline)
+        if voice_ids is None:
+            # Sin guardar nada: la próxima pulsación vuelve a intentarlo
+            await query.message.reply_text(VOICE_UNAVAILABLE_REPLY)
+            return
+        answer['voice_ids'] = voice_ids
+    else:
+        # Reenviar las notas de voz ya subidas a Telegram, sin sintetizar de nuevo
+        for voice_id in answer['voice_ids']:
+            await query.message.reply_voice(voice=voice_id)
 
-        # Filtrar el último mensaje del asistente
-        for message in reversed(messages.data):  # Orden inverso: del más reciente al más antiguo
-            if message.role == "assistant":
-                return message.content[0].text.value  # Devuelve la respuesta en texto
 
-        return "El asistente no generó una respuesta."
+async def cache_download(file_unique_id, data):
+    """Guardar una descarga en la caché en segundo plano: la escritura y el fsync no retrasan la respuesta."""
+    try:
+        await media_cache.put(file_unique_id, data)
     except Exception as e:
-        console.print(f"Error obteniendo respuesta de OpenAI: {e}", style="bold red")
-        return "Error al obtener la respuesta del asistente."
+        logger.warning(f"No se pudo guardar {file_unique_id} en la caché de descargas: {e}")
 
 
-async def handle_text_message(update: Update, context: CallbackContext):
-    """Maneja mensajes de texto en Telegram."""
-    user_message = update.message.text
-    response_text = await get_assistant_response(user_message)
+@timed("handler_voice")
+@fair_share("voice", needs=("audio", "assistants"))
+async def handle_audio_message(update: Update, context: CallbackContext, deadline: Deadline):
+    """Maneja mensajes de voz en Telegram: los transcribe y responde en texto."""
+    voice = update.message.voice
 
-    # Enviar respuesta en texto y en voz
-    await update.message.reply_text(response_text)
+    # Reutilizar el audio si ya se descargó (por ejemplo, una nota reenviada)
+    audio_bytes = await media_cache.get(voice.file_unique_id)
+    if audio_bytes is None:
+        with metrics.timer("telegram_download"):
+            file = await guarded("telegram_download", "download", deadline, context.bot.get_file(voice.file_id))
 
-    audio_response = await generate_voice(response_text)
-    if audio_response:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_audio_file:
-            temp_audio_file.write(audio_response.content)
-            temp_audio_path = temp_audio_file.name
+            # Obtener la URL del archivo
+            file_url = file.file_path
 
-        # Enviar audio de respuesta
-        with open(temp_audio_path, "rb") as audio_file:
-            await update.message.reply_voice(voice=InputFile(audio_file), caption="Aquí está la respuesta en voz.")
+            # Descargar el archivo con el pool compartido, sin bloquear el bucle
+            async with breakers["telegram_download"]:
+                response = await deadline.run("download", http_client.get(file_url))
+                response.raise_for_status()
+            audio_bytes = response.content
+        context.application.create_task(cache_download(voice.file_unique_id, audio_bytes))
 
-        os.remove(temp_audio_path)
+        logger.debug(f"Audio descargado: {voice.file_unique_id}")
 
-async def start(update: Update, context: CallbackContext):
-    """Comando de inicio."""
-    await update.message.reply_text("¡Hola! Puedes enviarme texto o audios y responderé con voz.")
+    # Transcribir el audio
+    transcript = await transcribe_audio(audio_bytes, deadline)
+    usage.record(update.effective_user.id, "voice", "transcription", "whisper-1", audio_seconds=voice.duration)
 
-async def handle_message(update: Update, context: CallbackContext):
-    user_message = update.message.text if update.message.text else ""
-    thread_id = context.user_data.get('thread_id')
+    if transcript:
+        with metrics.timer("reply_send"):
+            await update.message.reply_text(f"Texto transcrito: {transcript}")
 
-    if not thread_id:
-        thread_id = await create_thread()
-        if thread_id:
-            context.user_data['thread_id'] = thread_id
-        else:
-            await update.message.reply_text('Error iniciando la conversación con el asistente.')
+        thread_id = await get_thread_id(update, context, deadline)
+        if not thread_id:
             return
 
-    image_url = None
+        # Obtener respuesta del asistente
+        response = await get_assistant_response(
+            thread_id, transcript, user_id=update.effective_user.id, kind="voice", deadline=deadline
+        )
+
+        # Enviar respuesta en texto
+        with metrics.timer("reply_send"):
+            for text in response:
+                await update.message.reply_text(text)
+    else:
+        await update.message.reply_text("No pude transcribir el audio.")
 
-    # Verificar si el mensaje incluye una imagen
-    if update.message.photo:
+
+async def download_photo(context: CallbackContext, photo, deadline):
+    """Descargar la foto de Telegram a memoria, o tomarla de la caché si ya se descargó."""
+    image_bytes = await media_cache.get(photo.file_unique_id)
+    if image_bytes is None:
+        with metrics.timer("telegram_download"):
+            file = await guarded("telegram_download", "download", deadline, context.bot.get_file(photo.file_id))
+            buffer = io.BytesIO()
+            await guarded("telegram_download", "download", deadline, file.download_to_memory(buffer))
+            image_bytes = buffer.getvalue()
+        context.application.create_task(cache_download(photo.file_unique_id, image_bytes))
+    return image_bytes
+
+
+async def stream_photo(context: CallbackContext, photo, deadline):
+    """Descargar la foto de Telegram como flujo de bytes, o tomarla de la caché.
+
+    El tope de la etapa "download" rige cada espera (el archivo, la respuesta y
+    cada trozo) y el plazo del mensaje, el total.
+    """
+    image_bytes = await media_cache.get(photo.file_unique_id)
+    if image_bytes is not None:
+        yield image_bytes
+        return
+
+    chunks = []
+    # Todo el flujo va por el circuito de Telegram: un corte de la descarga no es una caída del almacén
+    async with breakers["telegram_download"]:
+        file = await deadline.run("download", context.bot.get_file(photo.file_id))
+        request = http_client.build_request("GET", file.file_path)
+        response = await deadline.run("download", http_client.send(request, stream=True))
+        try:
+            response.raise_for_status()
+            body = response.aiter_bytes()
+            while True:
+                try:
+                    chunk = await deadline.run("download", anext(body))
+                except StopAsyncIteration:
+                    break
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            await response.aclose()
+    context.application.create_task(cache_download(photo.file_unique_id, b"".join(chunks)))
+
+
+async def upload_image_to_openai(image_bytes, filename, deadline):
+    """Subir la imagen a OpenAI para visión y devolver el id del archivo."""
+    with metrics.timer("openai_file_upload"):
+        uploaded = await call_openai("assistants", "upload", deadline, "files", lambda: openai_client(
+            deadline, "upload"
+        ).files.with_raw_response.create(
+            file=(filename, image_bytes, "image/jpeg"),
+            purpose="vision"
+        ), priority=BULK, lane=lanes["vision"])
+    return uploaded.id
+
+
+async def archive_image(file_unique_id, image_bytes):
+    """Archivar la imagen en MinIO en segundo plano; un fallo no afecta la respuesta.
+
+    Con el almacén caído la imagen no se archiva.
+    """
+    if not breakers["storage"].available:
+        logger.info(f"Almacén no disponible: no se archiva {file_unique_id}")
+        return
+    try:
+        async with lanes["storage"].slot():
+            with metrics.timer("storage_upload"):
+                # En segundo plano, sin el plazo del mensaje: solo el tope de la etapa
+                upload = archive.store(file_unique_id, image_bytes)
+                object_name = await guarded("storage", "upload", Deadline(stage_timeouts=STAGE_TIMEOUTS), upload)
+        logger.info(f"Imagen archivada: {object_name}")
+    except CircuitOpen:
+        logger.info(f"Almacén no disponible: no se archiva {file_unique_id}")
+    except Exception as e:
+        logger.error(f"Error archivando la imagen: {e}")
+
+
+def choose_photo(message, caption=None, cheap=False):
+    """Elegir el tamaño de la foto y el nivel de detalle según el pie de foto.
+
+    Con `cheap` (presupuesto agotado) siempre se usa el detalle "low".
+    """
+    caption = caption or message.caption
+    detail = choose_detail(caption) if VISION_DETAIL == "auto" else VISION_DETAIL
+    if cheap:
+        detail = "low"
+    photo = select_photo(message.photo, detail)
+    logger.info(f"Foto elegida: {photo.width}x{photo.height} con detail={detail}")
+    return photo, detail
+
+
+async def image_url_block(context: CallbackContext, photo, detail, deadline):
+    """Archivar la foto (si no lo estaba) y devolverla como URL firmada para que OpenAI la descargue."""
+    object_name = archive.lookup(photo.file_unique_id, photo.file_size)
+    if not object_name:
+        # Descarga de Telegram y subida al almacén en un solo flujo
+        async with lanes["storage"].slot():
+            with metrics.timer("telegram_download_storage_upload"):
+                upload = archive.store_stream(photo.file_unique_id, stream_photo(context, photo, deadline))
+                object_name = await guarded("storage", "upload", deadline, upload)
+    image_url = await archive.url(object_name)
+    logger.info(f"Imagen archivada: {object_name} (bytes ahorrados: {archive.stats['bytes_saved']})")
+    return {"type": "image_url", "image_url": {"url": image_url, "detail": detail}}
+
+
+async def prepare_image(context: CallbackContext, photo, detail, deadline):
+    """Descargar la foto y devolverla como bloque de contenido para el asistente.
+
+    Si la foto (mismo file_unique_id) ya se subió antes, se reutiliza sin descargarla.
+    Con el almacén caído, el transporte "url" cede a la subida del archivo a OpenAI.
+    """
+    if IMAGE_TRANSPORT == "url" and blob_store.supports_urls and breakers["storage"].available:
         try:
-            photo = update.message.photo[-1]  # Tomar la imagen con mejor resolución
-            file = await context.bot.get_file(photo.file_id)
-            local_file_path = f"downloads/{photo.file_id}.jpg"
+            return await image_url_block(context, photo, detail, deadline)
+        except CircuitOpen as e:
+            if e.name != "storage":
+                raise
+            logger.info("Almacén no disponible: la imagen se sube a OpenAI")
+
+    file_id = archive.lookup(photo.file_unique_id, photo.file_size, destination="openai")
+    if not file_id:
+        image_bytes = await download_photo(context, photo, deadline)
+        file_id = await upload_image_to_openai(image_bytes, f"{photo.file_unique_id}.jpg", deadline)
+        archive.remember(photo.file_unique_id, file_id, destination="openai")
+        if ARCHIVE_IMAGES:
+            context.application.create_task(archive_image(photo.file_unique_id, image_bytes))
+    vision_files[file_id] = time.monotonic()
+    vision_files.move_to_end(file_id)
+    logger.info(f"Imagen en OpenAI: {file_id} (bytes ahorrados: {archive.stats['bytes_saved']})")
+    return {"type": "image_file", "image_file": {"file_id": file_id, "detail": detail}}
+
+
+def estimate_run_tokens(user_message, images):
+    """Tokens que se reservan en la admisión para una ejecución; el consumo real llega al completarse."""
+    tokens = RUN_TOKENS_ESTIMATE + len(user_message or "") // 4
+    for image in images or []:
+        detail = image[image["type"]].get("detail")
+        tokens += IMAGE_TOKENS_ESTIMATE.get(detail, IMAGE_TOKENS_ESTIMATE["high"])
+    return tokens
+
+
+async def cancel_run(thread_id, run_id):
+    """Cancelar una ejecución que no se va a esperar, para que deje de consumir tokens y libere el hilo."""
+    try:
+        await admission.call("assistants", lambda: openai_client().beta.threads.runs.with_raw_response.cancel(
+            thread_id=thread_id,
+            run_id=run_id
+        ))
+        logger.info(f"Ejecución {run_id} cancelada")
+    except Exception as e:
+        logger.warning(f"No se pudo cancelar la ejecución {run_id}: {e}")
+
+
+async def get_assistant_response(thread_id, user_message=None, images=None, user_id=None, kind="text", deadline=None):
+    """Enviar un mensaje (texto + imágenes) al asistente de OpenAI y devolver la respuesta.
+
+    El consumo de tokens de la ejecución se anota a `user_id` con el tipo de respuesta `kind`.
+    Las preguntas de texto y voz tienen prioridad de admisión sobre las de imágenes
+    y corren en el carril "text"; las que llevan imágenes, en el carril "vision".
+    Si el plazo vence durante la ejecución, se cancela y se lanza DeadlineExceeded; con el
+    circuito de OpenAI abierto se lanza CircuitOpen.
+    """
+    deadline = deadline or Deadline(stage_timeouts=STAGE_TIMEOUTS)
+    priority = BULK if images else INTERACTIVE
+    lane = lanes["vision"] if images else lanes["text"]
+    try:
+        content = []
+
+        # Agregar el texto si el usuario lo proporciona
+        if user_message:
+            content.append({"type": "text", "text": user_message})
 
-            os.makedirs("downloads", exist_ok=True)
+        # Agregar las imágenes (bloques preparados por prepare_image)
+        if images:
+            content.extend(images)
 
-            # Descargar la imagen
-            await file.download_to_drive(local_file_path)
-            logger.info(f"Imagen guardada en {local_file_path}")
+        # Asegurarse de que hay contenido antes de enviar
+        if not content:
+            logger.error("No hay contenido para enviar al asistente.")
+            return ["No se detectó texto ni imagen para procesar."]
+
+        # Un solo turno a la vez por hilo: OpenAI rechaza mensajes mientras hay una ejecución activa
+        lock = thread_locks.setdefault(thread_id, asyncio.Lock())
+        with metrics.timer("thread_lock_wait"):
+            await lock.acquire()
+        try:
+            # El carril limita las ejecuciones simultáneas de cada tipo; se pide después del candado
+            # para no ocupar un lugar mientras se espera el turno del hilo
+            async with lane.slot():
+                # Enviar mensaje al asistente
+                with metrics.timer("message_create"):
+                    await call_openai("assistants", "request", deadline, "assistants", lambda: openai_client(
+                        deadline
+                    ).beta.threads.messages.with_raw_response.create(
+                        thread_id=thread_id,
+                        role="user",
+                        content=content
+                    ), priority=priority, lane=lane)
+
+                # Con el presupuesto diario agotado la ejecución usa un modelo más barato
+                overrides = {"model": BUDGET_MODEL} if BUDGET_MODEL and usage.over_budget(user_id) else {}
+
+                # Ejecutar el asistente con instrucciones para que solo responda la pregunta
+                with metrics.timer("run_create"):
+                    my_run = await call_openai("assistants", "request", deadline, "assistants", lambda: openai_client(
+                        deadline
+                    ).beta.threads.runs.with_raw_response.create(
+                        thread_id=thread_id,
+                        assistant_id=ASSISTANT_ID,
+                        instructions="Responde únicamente la pregunta presente en la imagen o en el texto, sin agregar información extra.",
+                        **overrides
+                    ), tokens=estimate_run_tokens(user_message, images), priority=priority, lane=lane)
+
+                # Esperar respuesta; el tiempo en cada estado se mide al observarlo en el sondeo
+                run_deadline = deadline.within("run")
+                status, status_since = my_run.status, time.perf_counter()
+                try:
+                    while True:
+                        run_status = await call_openai("assistants", "request", run_deadline, "assistants", lambda: openai_client(
+                            run_deadline
+                        ).beta.threads.runs.with_raw_response.retrieve(
+                            thread_id=thread_id,
+                            run_id=my_run.id
+                        ), priority=priority, lane=lane)
+                        if run_status.status != status:
+                            metrics.observe(f"run_{status}", time.perf_counter() - status_since, my_run.model)
+                            status, status_since = run_status.status, time.perf_counter()
+                        if run_status.status == "completed" or run_status.status in RUN_FAILED_STATUSES:
+                            break
+                        await run_deadline.run("run", asyncio.sleep(1))
+                except CircuitOpen:
+                    # OpenAI se dio por caído: cancelar ahora esperaría justo lo que el circuito evita,
+                    # con el lugar, el carril y el candado del hilo tomados. La ejecución vence sola.
+                    logger.warning(f"Ejecución {my_run.id} sin cancelar: OpenAI no está disponible")
+                    raise
+                except DeadlineExceeded:
+                    if breakers["assistants"].available:
+                        await cancel_run(thread_id, my_run.id)
+                    raise
+
+                run_usage = run_status.usage
+                usage.record(
+                    user_id, kind, "run", run_status.model,
+                    prompt_tokens=run_usage.prompt_tokens if run_usage else 0,
+                    completion_tokens=run_usage.completion_tokens if run_usage else 0
+                )
+
+                if run_status.status != "completed":
+                    metrics.increment("run_failed_total", "Ejecuciones del asistente que terminaron sin completarse.",
+                                      status=run_status.status)
+                    logger.error(f"La ejecución {my_run.id} terminó en {run_status.status}: {run_status.last_error}")
+                    if run_status.status == "requires_action":
+                        await cancel_run(thread_id, my_run.id)
+                    return [ASSISTANT_ERROR_REPLY]
+
+                # Obtener la respuesta: solo los mensajes de esta ejecución, en orden
+                # (`created_at` es en segundos y no distingue respuestas anteriores del mismo hilo)
+                with metrics.timer("messages_list", my_run.model):
+                    run_messages = await call_openai("assistants", "request", deadline, "assistants", lambda: openai_client(
+                        deadline
+                    ).beta.threads.messages.with_raw_response.list(
+                        thread_id=thread_id,
+                        run_id=my_run.id,
+                        order="asc"
+                    ), priority=priority, lane=lane)
+                responses = []
+
+                for message in run_messages.data:
+                    if message.role == 'assistant':
+                        for content_block in message.content:
+                            if content_block.type == "text":
+                                responses.append(content_block.text.value)
+                if not responses:
+                    logger.error(f"La ejecución {my_run.id} se completó sin mensajes de texto")
+                    return [ASSISTANT_ERROR_REPLY]
+
+                return responses
+        finally:
+            lock.release()
+    except (DeadlineExceeded, CircuitOpen):
+        raise
+    except Exception as e:
+        logger.error(f"Failed to get response: {e}")
+        return [ASSISTANT_ERROR_REPLY]
 
-            # Subir a MinIO
-            minio_object_name = f"images/{photo.file_id}.jpg"
-            minio_client.fput_object(BUCKET_NAME, minio_object_name, local_file_path)
 
-            # Generar URL firmada para acceso
-            image_url = minio_client.presigned_get_object(BUCKET_NAME, minio_object_name, expires=timedelta(days=7))
-            logger.info(f"Imagen subida a MinIO: {image_url}")
+@timed("handler_text")
+@fair_share("text", needs=("assistants",))
+async def handle_text_message(update: Update, context: CallbackContext, deadline: Deadline):
+    """Maneja mensajes de texto en Telegram."""
+    thread_id = await get_thread_id(update, context, deadline)
+    if not thread_id:
+        return
+
+    user_id = update.effective_user.id
+    response = await get_assistant_response(thread_id, update.message.text, user_id=user_id, deadline=deadline)
+    answer_text = "\n".join(response)
+    if response != [ASSISTANT_ERROR_REPLY]:
+        remember_text_answer(context, update.message.text, response)
+
+    if usage.over_budget(user_id) or not breakers["audio"].available:
+        # Presupuesto agotado o voz caída: solo texto, sin ofrecer la voz
+        with metrics.timer("reply_send"):
+            for text in response:
+                await update.message.reply_text(text)
+        return
+
+    if VOICE_REPLY_MODE == "button":
+        # Enviar la respuesta en texto; la voz solo se genera si el usuario la pide
+        markup = listen_button(remember_answer(context, answer_text))
+        with metrics.timer("reply_send"):
+            for index, text in enumerate(response):
+                await update.message.reply_text(text, reply_markup=markup if index == len(response) - 1 else None)
+        return
 
-        except Exception as e:
-            logger.error(f"Error al manejar la imagen: {e}")
-            await update.message.reply_text("Hubo un error al procesar la imagen.")
+    # Enviar respuesta en texto y en voz
+    with metrics.timer("reply_send"):
+        for text in response:
+            await update.message.reply_text(text)
 
-    # Enviar texto e imagen (si está disponible) al asistente
-    response = await get_assistant_response(thread_id, user_message, image_url)
+    await send_voice_reply(update.message, answer_text, user_id, "text", deadline)
 
-    for text in response:
-        await update.message.reply_text(text)
 
 async def start(update: Update, context: CallbackContext):
     """Comando /start del bot"""
@@ -292,75 +1035,432 @@ async def handle_photo(update: Update, context: CallbackContext):
     """Manejar imágenes y enviarlas al asistente de OpenAI para responder preguntas dentro de ellas."""
     logger.info("Recibí una imagen del usuario.")
 
+    if update.message.media_group_id:
+        buffer_album_photo(update, context)
+        return
+
+    await answer_photos(update, context, [update.message])
+
+
+def buffer_album_photo(update: Update, context: CallbackContext):
+    """Acumular las fotos de un álbum; se responden juntas cuando deja de llegar otra."""
+    albums = context.bot_data.setdefault('albums', {})
+    group_id = update.message.media_group_id
+    album = albums.setdefault(group_id, {'updates': [], 'job': None})
+    if album['job']:
+        album['job'].schedule_removal()
+    album['updates'].append(update)
+    album['job'] = context.job_queue.run_once(
+        flush_album,
+        MEDIA_GROUP_WINDOW,
+        data=group_id,
+        chat_id=update.effective_chat.id,
+        user_id=update.effective_user.id,
+        name=f"album-{group_id}"
+    )
+
+
+async def flush_album(context: CallbackContext):
+    """Enviar todas las fotos del álbum en un solo mensaje y una sola ejecución."""
+    album = context.bot_data['albums'].pop(context.job.data)
+    updates = sorted(album['updates'], key=lambda album_update: album_update.message.message_id)
+    logger.info(f"Álbum {context.job.data} con {len(updates)} fotos.")
+    await answer_photos(updates[0], context, [album_update.message for album_update in updates])
+
+
+@timed("handler_photo")
+@fair_share("photo", count=lambda update, context, messages: len(messages), needs=("assistants",))
+async def answer_photos(update: Update, context: CallbackContext, messages, deadline: Deadline):
+    """Enviar una o varias fotos al asistente y responder al usuario."""
     try:
-        photo = update.message.photo[-1]  # Tomar la imagen con mejor resolución
-        file = await context.bot.get_file(photo.file_id)
-        local_file_path = f"downloads/{photo.file_id}.jpg"
-
-        os.makedirs("downloads", exist_ok=True)
+        # El pie de foto de un álbum viene en uno solo de sus mensajes
+        caption = "\n".join(message.caption for message in messages if message.caption) or None
 
-        # Descargar la imagen
-        await file.download_to_drive(local_file_path)
-        logger.info(f"Imagen guardada en {local_file_path}")
-
-        # Subir a MinIO
-        minio_object_name = f"images/{photo.file_id}.jpg"
-        minio_client.fput_object(BUCKET_NAME, minio_object_name, local_file_path)
-
-        # Generar URL pública para la imagen
-        image_url = minio_client.presigned_get_object(BUCKET_NAME, minio_object_name, expires=timedelta(days=7))
-        logger.info(f"Imagen subida a MinIO y accesible en: {image_url}")
+        # Preparar todas las imágenes en paralelo
+        cheap = usage.over_budget(update.effective_user.id)
+        choices = [choose_photo(message, caption, cheap) for message in messages]
+        images = await asyncio.gather(*(prepare_image(context, photo, detail, deadline) for photo, detail in choices))
 
         # Obtener el thread_id del usuario
-        thread_id = context.user_data.get('thread_id')
+        thread_id = await get_thread_id(update, context, deadline)
         if not thread_id:
-            thread_id = await create_thread()
-            if thread_id:
-                context.user_data['thread_id'] = thread_id
-            else:
-                await update.message.reply_text('Error iniciando la conversación con el asistente.')
-                return
+            return
 
-        # Enviar solo la imagen al asistente sin texto adicional
-        response = await get_assistant_response(thread_id, image_url=image_url)
+        # Enviar las imágenes al asistente, con el pie de foto si la pregunta viene en él
+        response = await get_assistant_response(
+            thread_id, caption, list(images), user_id=update.effective_user.id, kind="photo", deadline=deadline
+        )
 
         # Enviar la respuesta al usuario
-        for text in response:
-            await update.message.reply_text(text)
+        with metrics.timer("reply_send"):
+            for text in response:
+                await update.message.reply_text(text)
 
+    except (DeadlineExceeded, CircuitOpen):
+        raise
     except Exception as e:
         logger.error(f"Error al manejar la imagen: {e}")
         await update.message.reply_text("Hubo un error al procesar la imagen.")
 
 
+async def delete_vision_file(file_id):
+    """Borrar de OpenAI una imagen subida para visión y devolver si ya no está."""
+    try:
+        await call_openai("assistants", "request", Deadline(stage_timeouts=STAGE_TIMEOUTS), "files", lambda: openai_client(
+        ).files.with_raw_response.delete(file_id), priority=BACKGROUND)
+    except CircuitOpen:
+        return False
+    except Exception as e:
+        if getattr(e, "status_code", None) != 404:
+            logger.warning(f"No se pudo borrar el archivo {file_id} de OpenAI: {e}")
+            return False
+    return True
+
+
+async def delete_vision_files(max_idle):
+    """Borrar de OpenAI las imágenes sin usar hace más de `max_idle` segundos y devolver cuántas se borraron.
+
+    Primero se olvidan, para que ninguna foto nueva las reutilice mientras se borran; las que
+    fallan quedan para el próximo barrido.
+    """
+    cutoff = time.monotonic() - max_idle
+    idle = [file_id for file_id, used in vision_files.items() if used <= cutoff]
+    if not idle:
+        return 0
+    archive.forget(idle)
+    results = await asyncio.gather(*(delete_vision_file(file_id) for file_id in idle))
+    deleted = [file_id for file_id, done in zip(idle, results) if done]
+    for file_id in deleted:
+        vision_files.pop(file_id, None)
+    return len(deleted)
+
+
+async def sweep_vision_files(context: CallbackContext):
+    """Tarea periódica: borrar de OpenAI las imágenes que ya no se reutilizan."""
+    deleted = await delete_vision_files(VISION_FILE_TTL_SECONDS)
+    if deleted:
+        logger.info(f"Imágenes de visión: {deleted} archivos borrados de OpenAI, {len(vision_files)} en uso")
+
+
+async def sweep_media_cache(context: CallbackContext):
+    """Tarea periódica: mantener la caché de descargas dentro de su presupuesto."""
+    evicted = await media_cache.sweep()
+    if evicted:
+        logger.info(
+            f"Caché de descargas: {evicted} archivos expulsados, "
+            f"{media_cache.total_bytes / 1024 / 1024:.1f} MB en uso"
+        )
 
-def main():
 
-    """Ejecuta el bot de Telegram."""
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def sweep_archive(context: CallbackContext):
+    """Tarea periódica: borrar un lote de imágenes archivadas que superan la retención."""
+    try:
+        deleted = await lifecycle.sweep()
+    except Exception as e:
+        logger.error(f"Error barriendo el archivo de imágenes: {e}")
+        return
+    if deleted:
+        logger.info(f"Archivo de imágenes: {deleted} objetos expirados borrados")
 
-    # Agregar manejadores
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
-    application.add_handler(MessageHandler(filters.VOICE, handle_audio_message))
 
-    """Función principal para ejecutar el bot"""
-    TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def flush_traffic(context: CallbackContext):
+    """Tarea periódica: agregar a la grabación los updates recibidos."""
+    try:
+        await traffic_recorder.flush()
+    except Exception as e:
+        logger.error(f"Error guardando la grabación de tráfico: {e}")
+
+
+async def flush_usage(context: CallbackContext):
+    """Tarea periódica: escribir en SQLite el consumo acumulado."""
+    try:
+        await usage.flush()
+    except Exception as e:
+        logger.error(f"Error guardando el consumo: {e}")
+
+
+async def usage_report(update: Update, context: CallbackContext):
+    """Comando /uso (solo administradores): quién y qué tipo de respuesta concentra el gasto."""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    days = int(context.args[0]) if context.args and context.args[0].isdigit() else 1
+    lines = [f"Consumo de los últimos {days} días", "", "Usuarios:"]
+    for user_id, spent, answers in await usage.top_users(days):
+        lines.append(f"  {user_id}: US${spent:.4f} en {answers} respuestas")
+    lines += ["", "Por tipo de respuesta:"]
+    for kind, answers, spent, per_answer in await usage.cost_by_kind(days):
+        lines.append(f"  {kind}: US${spent:.4f} ({answers} respuestas, US${per_answer:.5f} c/u)")
+    lines += ["", "Por etapa y modelo:"]
+    for stage, model, prompt, completion, seconds, characters, spent in await usage.usage_by_model(days):
+        lines.append(
+            f"  {stage} {model}: {prompt}+{completion} tokens, {seconds:.0f} s de audio, "
+            f"{characters} caracteres, US${spent:.4f}"
+        )
+    await update.message.reply_text("\n".join(lines))
+
+
+async def run_profile(seconds):
+    """Perfilar el proceso durante `seconds` segundos en un hilo aparte y devolver el archivo y su resumen."""
+    stacks = await asyncio.to_thread(profiler.profile, seconds)
+    path = os.path.join(PROFILE_DIR, f"perfil-{datetime.now():%Y%m%d-%H%M%S}.folded")
+    await asyncio.to_thread(profiler.write, stacks, path)
+    summary = "\n".join(f"{share:6.1%}  {frame}" for frame, share in top_functions(stacks, limit=8))
+    logger.info(f"Perfil de {seconds} s guardado en {path}; funciones con más muestras:\n{summary}")
+    return path, summary
+
+
+async def send_profile(bot, chat_id, seconds):
+    """Perfilar en segundo plano y enviar el archivo colapsado al administrador."""
+    try:
+        path, summary = await run_profile(seconds)
+        with open(path, "rb") as folded:
+            data = folded.read()
+        await bot.send_document(chat_id, document=data, filename=os.path.basename(path),
+                                caption=f"Perfil de {seconds} s\n{summary}"[:1024])
+    except Exception as e:
+        logger.error(f"Error generando el perfil: {e}")
+        await bot.send_message(chat_id, f"No se pudo generar el perfil: {e}")
+
+
+async def profile_command(update: Update, context: CallbackContext):
+    """Comando /perfil [segundos] (solo administradores): perfilar el bot sin detenerlo."""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    if profiler.running:
+        await update.message.reply_text("Ya hay un perfil en curso.")
+        return
+    seconds = int(context.args[0]) if context.args and context.args[0].isdigit() else PROFILE_SECONDS
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    await update.message.reply_text(f"Perfilando {seconds} s a {PROFILE_HZ} muestras por segundo…")
+    # En segundo plano: el handler termina ya y el bot sigue atendiendo mientras tanto
+    context.application.create_task(send_profile(context.bot, update.effective_chat.id, seconds))
+
+
+def install_profile_signal(application: Application):
+    """SIGUSR1 perfila PROFILE_SECONDS y deja el archivo en PROFILE_DIR."""
+    def on_signal():
+        if profiler.running:
+            logger.warning("SIGUSR1 ignorado: ya hay un perfil en curso")
+            return
+        application.create_task(run_profile(PROFILE_SECONDS))
+
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, on_signal)
+    except (AttributeError, NotImplementedError, RuntimeError):
+        # Windows no tiene SIGUSR1
+        logger.info("Perfilado por señal no disponible en esta plataforma")
+
+
+async def setup_lifecycle(application: Application):
+    """Delegar la expiración al servidor si se puede; si no, programar el barrido por lotes."""
+    try:
+        if await lifecycle.install_rule():
+            logger.info(f"Regla de ciclo de vida instalada: images/ expira a los {IMAGE_RETENTION_DAYS} días")
+            return
+    except Exception as e:
+        logger.warning(f"No se pudo instalar la regla de ciclo de vida, se usará el barrido: {e}")
+    application.job_queue.run_repeating(sweep_archive, interval=LIFECYCLE_SWEEP_SECONDS, first=60)
+
+
+async def check_openai():
+    """Verificar que OpenAI responde y que el asistente configurado existe."""
+    await admission.call("assistants", lambda: openai_client().beta.assistants.with_raw_response.retrieve(
+        ASSISTANT_ID
+    ), priority=BACKGROUND)
+
+
+async def check_dependency(name, awaitable):
+    """Ejecutar una verificación de arranque con tiempo límite; un fallo no detiene el bot."""
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(awaitable, STARTUP_CHECK_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"{name}: falló la verificación de arranque ({e!r}); se reintentará al usarlo")
+        return False
+    logger.info(f"{name}: listo en {time.perf_counter() - started:.2f}s")
+    return True
+
+
+def connection_probes(application: Application):
+    """Petición ligera por cada pool de conexiones que usa el bot."""
+    return {
+        "OpenAI": lambda: admission.call("assistants", lambda: openai_client().beta.assistants.with_raw_response.retrieve(
+            ASSISTANT_ID
+        ), priority=BACKGROUND),
+        "Bot API": application.bot.get_me,
+        # Las descargas de archivos de Telegram van por el pool compartido
+        "Descargas de Telegram": lambda: http_client.head(TELEGRAM_BASE_URL or "https://api.telegram.org"),
+        "Almacén de imágenes": blob_store.ping,
+    }
+
+
+async def warm_pool(name, probe, connections):
+    """Abrir `connections` conexiones keep-alive en el pool de una dependencia.
+
+    Las peticiones van a la vez para que el pool no reutilice una sola
+    conexión: así los primeros usuarios no pagan el handshake TLS.
+    """
+    started = time.perf_counter()
+    results = await asyncio.gather(*(probe() for _ in range(connections)), return_exceptions=True)
+    failures = [result for result in results if isinstance(result, Exception)]
+    if failures:
+        logger.warning(f"{name}: {len(failures)} de {connections} conexiones fallaron ({failures[0]!r})")
+    return time.perf_counter() - started
+
+
+async def warm_connections(application: Application):
+    """Calentar en paralelo los pools de OpenAI, Telegram y el almacenamiento."""
+    probes = connection_probes(application)
+    timings = await asyncio.gather(*(warm_pool(name, probe, WARM_CONNECTIONS) for name, probe in probes.items()))
+    logger.info("Conexiones calientes: " + ", ".join(
+        f"{name} {seconds:.2f}s" for name, seconds in zip(probes, timings)
+    ))
+
+
+async def keep_connections_alive(context: CallbackContext):
+    """Tarea periódica: reutilizar las conexiones antes de que el pool o el servidor las cierren.
+
+    Basta una petición por pool, con el mismo tiempo límite que las verificaciones de arranque.
+    El ping a OpenAI se omite mientras su admisión está en pausa o con cola: gastaría cupo
+    que necesitan los usuarios y se quedaría esperando.
+    """
+    probes = connection_probes(context.application)
+    if admission.busy("assistants"):
+        del probes["OpenAI"]
+    results = await asyncio.gather(
+        *(asyncio.wait_for(probe(), STARTUP_CHECK_TIMEOUT) for probe in probes.values()), return_exceptions=True
+    )
+    for name, result in zip(probes, results):
+        if isinstance(result, Exception):
+            logger.warning(f"{name}: falló el ping que mantiene las conexiones ({result!r})")
+
+
+async def start_metrics_server(application: Application):
+    """Servir las latencias por etapa en http://METRICS_HOST:METRICS_PORT/metrics."""
+    application.bot_data['metrics_server'] = await serve_metrics(metrics, METRICS_HOST, METRICS_PORT)
+
+
+def start_loop_watchdog(application: Application):
+    """Vigilar el bucle de eventos y publicar su retraso como la etapa event_loop_lag."""
+    watchdog = LoopWatchdog(asyncio.get_running_loop(), threshold=LOOP_WATCHDOG_MS / 1000)
+    metrics.histograms[("event_loop_lag", "")] = watchdog.lag
+    watchdog.start()
+    application.bot_data['loop_watchdog'] = watchdog
+    return watchdog
+
+
+async def post_init(application: Application):
+    """Verificar las dependencias y calentar las conexiones en paralelo, y programar las tareas periódicas."""
+    if LOOP_WATCHDOG_MS:
+        start_loop_watchdog(application)
+    install_profile_signal(application)
+    checks = [
+        check_dependency("Almacén de imágenes", blob_store.ensure_ready()),
+        check_dependency("OpenAI", check_openai()),
+        check_dependency("Caché de descargas", media_cache.load()),
+        check_dependency("Contabilidad de consumo", usage.load()),
+    ]
+    if WARM_CONNECTIONS:
+        checks.append(check_dependency("Conexiones", warm_connections(application)))
+        application.job_queue.run_repeating(
+            keep_connections_alive,
+            interval=KEEPALIVE_PING_SECONDS,
+            first=KEEPALIVE_PING_SECONDS
+        )
+    await asyncio.gather(*checks)
+    application.job_queue.run_repeating(flush_usage, interval=USAGE_FLUSH_SECONDS, first=USAGE_FLUSH_SECONDS)
+    if traffic_recorder:
+        application.job_queue.run_repeating(flush_traffic, interval=TRAFFIC_FLUSH_SECONDS, first=TRAFFIC_FLUSH_SECONDS)
+    application.job_queue.run_repeating(
+        sweep_vision_files,
+        interval=VISION_FILE_SWEEP_SECONDS,
+        first=VISION_FILE_SWEEP_SECONDS
+    )
+    application.job_queue.run_repeating(
+        sweep_media_cache,
+        interval=MEDIA_CACHE_SWEEP_SECONDS,
+        first=MEDIA_CACHE_SWEEP_SECONDS
+    )
+    await check_dependency("Ciclo de vida del archivo", setup_lifecycle(application))
+    if METRICS_PORT:
+        await check_dependency("Métricas", start_metrics_server(application))
+
+
+async def post_shutdown(application: Application):
+    """Cerrar el endpoint de métricas, el almacén, el pool de conexiones HTTP y los carriles al detener el bot.
+
+    Las imágenes de visión que quedan en OpenAI se borran: tras reiniciar nadie las recuerda.
+    """
+    watchdog = application.bot_data.get('loop_watchdog')
+    if watchdog:
+        watchdog.stop()
+        logger.info(watchdog.report())
+    try:
+        deleted = await asyncio.wait_for(delete_vision_files(0), STARTUP_CHECK_TIMEOUT)
+        logger.info(f"Imágenes de visión: {deleted} archivos borrados de OpenAI al detener el bot")
+    except Exception as e:
+        logger.warning(f"No se pudieron borrar las imágenes de visión de OpenAI ({e!r}); quedan {len(vision_files)}")
+    if traffic_recorder:
+        await traffic_recorder.flush()
+    try:
+        await usage.flush()
+    except Exception as e:
+        logger.error(f"Error guardando el consumo: {e}")
+    metrics_server = application.bot_data.get('metrics_server')
+    if metrics_server:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    await blob_store.aclose()
+    await http_client.aclose()
+    for lane in lanes.values():
+        lane.shutdown()
+
+
+def build_application():
+    """Construir la aplicación con sus handlers."""
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        # Mismo tamaño de pool que el predeterminado, pero conservando las conexiones inactivas
+        .request(HTTPXRequest(
+            connection_pool_size=256,
+            httpx_kwargs={"limits": httpx.Limits(max_connections=256, keepalive_expiry=KEEPALIVE_EXPIRY)}
+        ))
+        .arbitrary_callback_data(True)
+        # Los updates se atienden a la vez; `scheduler` decide quién ocupa los WORKER_SLOTS
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if traffic_recorder:
+        builder = builder.update_queue(RecordingQueue(traffic_recorder))
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(f"{TELEGRAM_BASE_URL}/bot").base_file_url(f"{TELEGRAM_BASE_URL}/file/bot")
+    application = builder.build()
 
     # Agregar handlers para comandos y mensajes
     application.add_handler(CommandHandler("start", start))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(CommandHandler("uso", usage_report))
+    application.add_handler(CommandHandler("perfil", profile_command))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
+    application.add_handler(MessageHandler(filters.VOICE, handle_audio_message))
     application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    application.add_handler(CallbackQueryHandler(handle_listen_button, pattern=is_listen_callback))
+    return application
 
 
+def main():
+    """Función principal para ejecutar el bot"""
+    listener = setup_logging(LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_SAMPLE_BURST, LOG_SAMPLE_WINDOW)
+    application = build_application()
+
     # Iniciar bot
-    application.run_polling()
+    try:
+        application.run_polling()
+    finally:
+        # Escribir lo que quede en la cola antes de salir
+        listener.stop()
 
-logging.basicConfig(
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    level=logging.DEBUG
-)
 
 logger = logging.getLogger(__name__)
 
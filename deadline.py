@@ -0,0 +1,86 @@
+import asyncio
+import math
+import time
+
+
+def parse_timeouts(spec):
+    """`"download=30,run=120"` -> {etapa: segundos}."""
+    timeouts = {}
+    for item in (spec or "").split(","):
+        stage, _, seconds = item.strip().partition("=")
+        if stage and seconds:
+            timeouts[stage] = float(seconds)
+    return timeouts
+
+
+class DeadlineExceeded(Exception):
+    """Se acabó el tiempo de una etapa o del mensaje completo.
+
+    `stage_limit` es True si cortó el tope propio de la etapa (la dependencia
+    no respondió a tiempo) y no lo que quedaba del plazo del mensaje.
+    """
+
+    def __init__(self, stage, stage_limit=False):
+        super().__init__(f"Plazo vencido en la etapa {stage}")
+        self.stage = stage
+        self.stage_limit = stage_limit
+
+
+class Deadline:
+    """Plazo de un mensaje, creado al recibirlo y pasado a cada etapa que lo atiende.
+
+    El tiempo de cada etapa es lo que quede del plazo, con el tope de esa
+    etapa en `stage_timeouts`; sin plazo (`expires_at=None`) solo rigen los
+    topes. `run` corta la etapa al vencer: la tarea se cancela y con ella la
+    petición HTTP asíncrona en curso. Para llamadas en hilos (OpenAI) el
+    tiempo se pasa como `timeout` de la petición.
+    """
+
+    def __init__(self, expires_at=None, stage_timeouts=None):
+        self.expires_at = expires_at
+        self.stage_timeouts = stage_timeouts or {}
+
+    @classmethod
+    def from_message(cls, message, budget, stage_timeouts=None):
+        """Plazo de `budget` segundos desde la hora (`date`) en que se envió el mensaje."""
+        if not budget:
+            return cls(None, stage_timeouts)
+        remaining = message.date.timestamp() + budget - time.time()
+        return cls(time.monotonic() + remaining, stage_timeouts)
+
+    @classmethod
+    def after(cls, seconds, stage_timeouts=None):
+        return cls(time.monotonic() + seconds if seconds else None, stage_timeouts)
+
+    def remaining(self):
+        return math.inf if self.expires_at is None else self.expires_at - time.monotonic()
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, stage):
+        """Segundos para la etapa `stage` (None = sin límite); DeadlineExceeded si ya no queda."""
+        seconds = min(self.remaining(), self.stage_timeouts.get(stage, math.inf))
+        if seconds <= 0:
+            raise DeadlineExceeded(stage)
+        return None if seconds == math.inf else seconds
+
+    def within(self, stage):
+        """Plazo hijo para una etapa con varias peticiones (p. ej. toda la ejecución del asistente)."""
+        seconds = self.timeout(stage)
+        return Deadline(self.expires_at if seconds is None else time.monotonic() + seconds, self.stage_timeouts)
+
+    async def run(self, stage, awaitable):
+        """Esperar `awaitable` como mucho `timeout(stage)` segundos."""
+        try:
+            seconds = self.timeout(stage)
+        except DeadlineExceeded:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise
+        stage_limit = seconds is not None and seconds == self.stage_timeouts.get(stage)
+        try:
+            return await asyncio.wait_for(awaitable, seconds)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(stage, stage_limit) from None
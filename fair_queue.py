@@ -0,0 +1,120 @@
+import asyncio
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+
+
+def parse_costs(spec):
+    """`"text=1,voice=2,photo=4"` -> {tipo: costo}."""
+    costs = {}
+    for item in (spec or "").split(","):
+        kind, _, cost = item.strip().partition("=")
+        if kind and cost:
+            costs[kind] = float(cost)
+    return costs
+
+
+class FairScheduler:
+    """Reparte `slots` lugares de trabajo entre usuarios con deficit round-robin.
+
+    Cada usuario tiene su propia cola. En cada vuelta de la ronda el usuario
+    suma `quantum` a su crédito y se le atiende la petición de adelante si el
+    crédito alcanza para su costo (texto < voz < imagen), así que un usuario
+    con decenas de fotos avanza al mismo ritmo de costo que uno con preguntas
+    de texto en vez de ocupar todos los lugares. Además nadie tiene más de
+    `per_user` peticiones en curso a la vez.
+    """
+
+    def __init__(self, slots, per_user=1, quantum=1.0, metrics=None):
+        self.slots = slots
+        self.per_user = per_user
+        self.quantum = quantum
+        self.metrics = metrics
+        self.active = 0
+        self.running = Counter()
+        # user_id -> deque de (future, costo); la ronda es el orden de visita
+        self.queues = {}
+        self.deficit = {}
+        self.ring = deque()
+
+    def queued(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def _grant(self, user_id):
+        self.active += 1
+        self.running[user_id] += 1
+
+    def _release(self, user_id):
+        self.active -= 1
+        self.running[user_id] -= 1
+        if not self.running[user_id]:
+            del self.running[user_id]
+        self._dispatch()
+
+    def _drop_user(self, user_id):
+        del self.queues[user_id]
+        del self.deficit[user_id]
+        self.ring.remove(user_id)
+
+    def _dispatch(self):
+        # Usuarios seguidos que no pueden avanzar por su límite de concurrencia
+        blocked = 0
+        while self.active < self.slots and self.ring and blocked < len(self.ring):
+            user_id = self.ring[0]
+            queue = self.queues[user_id]
+            future, cost = queue[0]
+            if future.done():
+                # Se canceló mientras esperaba
+                queue.popleft()
+                if not queue:
+                    self._drop_user(user_id)
+                continue
+            if self.running[user_id] >= self.per_user:
+                self.ring.rotate(-1)
+                blocked += 1
+                continue
+            if self.deficit[user_id] < cost:
+                self.deficit[user_id] += self.quantum
+                self.ring.rotate(-1)
+                blocked = 0
+                continue
+            queue.popleft()
+            self.deficit[user_id] -= cost
+            self._grant(user_id)
+            future.set_result(None)
+            blocked = 0
+            if not queue:
+                self._drop_user(user_id)
+
+    async def _acquire(self, user_id, cost):
+        if not self.ring and self.active < self.slots and self.running[user_id] < self.per_user:
+            self._grant(user_id)
+            return
+        future = asyncio.get_running_loop().create_future()
+        if user_id not in self.queues:
+            self.queues[user_id] = deque()
+            self.deficit[user_id] = 0.0
+            self.ring.append(user_id)
+        self.queues[user_id].append((future, cost))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # El lugar llegó justo al cancelar: devolverlo
+                self._release(user_id)
+            else:
+                self._dispatch()
+            raise
+
+    @asynccontextmanager
+    async def slot(self, user_id, cost=1.0, kind=""):
+        """Esperar turno para `user_id` y ocupar un lugar mientras dura el bloque `async with`."""
+        started = time.perf_counter()
+        await self._acquire(user_id, cost)
+        if self.metrics:
+            self.metrics.observe(f"queue_wait_{kind or 'other'}", time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            self._release(user_id)
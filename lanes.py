@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+
+def parse_sizes(spec):
+    """`"text=8,vision=4"` -> {carril: entero}."""
+    sizes = {}
+    for item in (spec or "").split(","):
+        name, _, size = item.strip().partition("=")
+        if name and size:
+            sizes[name] = int(size)
+    return sizes
+
+
+class _LaneExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor que cuenta las funciones en espera de un hilo y en ejecución."""
+
+    def __init__(self, lane, workers):
+        super().__init__(max_workers=workers, thread_name_prefix=f"lane-{lane}")
+        self._counts_lock = threading.Lock()
+        self.queued = 0
+        self.busy = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        def task():
+            with self._counts_lock:
+                self.queued -= 1
+                self.busy += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._counts_lock:
+                    self.busy -= 1
+
+        with self._counts_lock:
+            self.queued += 1
+        try:
+            return super().submit(task)
+        except Exception:
+            with self._counts_lock:
+                self.queued -= 1
+            raise
+
+
+class Lane:
+    """Compartimento estanco para un tipo de trabajo: hilos propios y cupo propio.
+
+    `executor` es un pool acotado a `workers` hilos para las llamadas
+    bloqueantes del carril y `slot()` un semáforo de `concurrency` para la
+    etapa completa (p. ej. una ejecución del asistente, que casi todo el
+    tiempo espera sin ocupar un hilo). Un carril saturado hace esperar solo
+    a su propio trabajo.
+    """
+
+    def __init__(self, name, workers, concurrency=None, metrics=None):
+        self.name = name
+        self.workers = workers
+        self.concurrency = concurrency or workers
+        self.executor = _LaneExecutor(name, workers)
+        self.metrics = metrics
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.waiting = 0
+        self.active = 0
+        if metrics:
+            metrics.gauge("lane_queue_depth", "Trabajos esperando un lugar o un hilo en cada carril.",
+                          lambda: self.queue_depth, lane=name)
+            metrics.gauge("lane_saturation", "Fracción ocupada del carril (lugares o hilos, la mayor).",
+                          lambda: self.saturation, lane=name)
+
+    @property
+    def queue_depth(self):
+        return self.waiting + self.executor.queued
+
+    @property
+    def saturation(self):
+        return max(self.active / self.concurrency, self.executor.busy / self.workers)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Ocupar un lugar del carril mientras dura el bloque `async with`."""
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        if self.metrics:
+            self.metrics.observe(f"lane_wait_{self.name}", time.perf_counter() - started)
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    async def run(self, func, *args):
+        """Ejecutar `func(*args)` en un hilo del carril."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,123 @@
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Atributos propios de LogRecord; el resto llega por `extra=` y va como campo del JSON
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def parse_levels(spec):
+    """`"httpx=WARNING,telegram=INFO"` -> {logger: nivel}."""
+    levels = {}
+    for item in (spec or "").split(","):
+        name, _, level = item.strip().partition("=")
+        if name and level:
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por línea: hora, nivel, logger, mensaje y los campos de `extra=`."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """Deja pasar a lo sumo `burst` registros por línea de código cada `window` segundos.
+
+    Solo afecta a los niveles hasta `level` (DEBUG): los avisos y errores
+    siempre pasan. Lo descartado se cuenta y el siguiente registro que pasa
+    de esa línea lo informa en el campo `suppressed`.
+    """
+
+    def __init__(self, burst=10, window=60.0, level=logging.DEBUG):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self._lock = threading.Lock()
+        # (logger, archivo, línea) -> [inicio de la ventana, emitidos, descartados]
+        self._sites = {}
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno > self.level or not self.burst:
+            return True
+        now = time.monotonic()
+        key = (record.name, record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                dropped = site[2] if site else 0
+                site = self._sites[key] = [now, 0, 0]
+                if dropped:
+                    record.suppressed = dropped
+            if site[1] >= self.burst:
+                site[2] += 1
+                self.suppressed += 1
+                return False
+            site[1] += 1
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    """Formatea el mensaje en el hilo que registra (los argumentos pueden cambiar después)
+    pero deja la traza de la excepción aparte para que el JSON la tenga en su propio campo."""
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level="INFO", levels=None, fmt="json", burst=10, window=60.0, stream=None):
+    """Reemplazar los handlers del logger raíz por una cola atendida por un hilo aparte.
+
+    Quien registra solo aplica el filtro de muestreo y encola; el formateo y
+    la escritura a `stream` (stderr) ocurren en el hilo del QueueListener, así
+    que un stderr lento no frena al bucle de eventos. Devuelve el listener
+    para detenerlo (y vaciar la cola) al salir.
+    """
+    if fmt == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(formatter)
+
+    handler = _QueueHandler(queue.SimpleQueue())
+    handler.addFilter(SampleFilter(burst, window))
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    for name, logger_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,116 @@
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    """Hilo que mide el retraso del bucle de eventos y muestrea qué lo bloquea.
+
+    Cada `interval` segundos programa un latido en el bucle con
+    `call_soon_threadsafe` y mide cuánto tarda en ejecutarse. Si pasa de
+    `threshold`, toma la pila del hilo del bucle con `sys._current_frames`
+    cada `sample_interval` mientras siga bloqueado y cuenta el punto del
+    código propio (fuera de site-packages) desde el que se hizo la llamada.
+    """
+
+    def __init__(self, loop, threshold=0.1, interval=0.1, sample_interval=0.01, root=None):
+        self.loop = loop
+        self.threshold = threshold
+        self.interval = interval
+        self.sample_interval = sample_interval
+        self.root = os.path.abspath(root or os.path.dirname(__file__))
+        self.thread_id = None
+        self.lag = Histogram()
+        self.max_lag = 0.0
+        self.stalls = 0
+        # (llamada en código propio, función de biblioteca que bloqueaba) -> muestras
+        self.samples = Counter()
+        # Mayor bloqueo visto por sitio, en segundos
+        self.worst = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Empezar a vigilar; se llama desde el hilo del bucle."""
+        self.thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _is_own(self, filename):
+        filename = os.path.abspath(filename)
+        return filename.startswith(self.root) and "site-packages" not in filename
+
+    def _call_site(self):
+        """(sitio propio, sitio más interno) de la pila actual del hilo del bucle."""
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return None
+        stack = traceback.extract_stack(frame)
+        own = [entry for entry in stack if self._is_own(entry.filename) and entry.filename != __file__]
+        site = own[-1] if own else stack[-1]
+        leaf = stack[-1]
+        return (
+            f"{os.path.relpath(site.filename, self.root)}:{site.lineno} en {site.name}",
+            f"{os.path.basename(leaf.filename)}:{leaf.lineno} en {leaf.name}",
+        )
+
+    def _watch(self):
+        while not self._stop.is_set():
+            beat = threading.Event()
+            sent = time.perf_counter()
+            try:
+                self.loop.call_soon_threadsafe(beat.set)
+            except RuntimeError:
+                # El bucle ya se cerró
+                return
+            sites = Counter()
+            timeout = self.threshold
+            while not beat.wait(timeout):
+                if self._stop.is_set():
+                    return
+                site = self._call_site()
+                if site:
+                    sites[site] += 1
+                timeout = self.sample_interval
+            lag = time.perf_counter() - sent
+            self.lag.record(lag * 1_000_000)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self._stall(lag, sites)
+            self._stop.wait(self.interval)
+
+    def _stall(self, lag, sites):
+        self.stalls += 1
+        self.samples.update(sites)
+        if not sites:
+            logger.warning(f"Bucle de eventos bloqueado {lag * 1000:.0f} ms")
+            return
+        (site, leaf), _ = sites.most_common(1)[0]
+        self.worst[(site, leaf)] = max(self.worst.get((site, leaf), 0.0), lag)
+        logger.warning(f"Bucle de eventos bloqueado {lag * 1000:.0f} ms en {site} ({leaf})")
+
+    def report(self, limit=10):
+        """Resumen de los sitios que más tiempo bloquearon el bucle."""
+        lines = [
+            f"Retraso del bucle: p50 {self.lag.percentile(0.5) / 1000:.1f} ms, "
+            f"p99 {self.lag.percentile(0.99) / 1000:.1f} ms, máximo {self.max_lag * 1000:.0f} ms, "
+            f"{self.stalls} bloqueos de más de {self.threshold * 1000:.0f} ms"
+        ]
+        for (site, leaf), count in self.samples.most_common(limit):
+            lines.append(
+                f"  {count:>5} muestras  peor {self.worst.get((site, leaf), 0) * 1000:>6.0f} ms  {site} ({leaf})"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+from storage import atomic_write
+
+INDEX_FILE = "index.json"
+
+
+class MediaCache:
+    """Caché en disco de archivos descargados de Telegram, con presupuesto de bytes.
+
+    Los archivos se guardan por `file_unique_id` en subdirectorios repartidos
+    por hash (`ab/<file_unique_id>`). Un índice pequeño en `index.json` guarda
+    el orden LRU; el barrido periódico (`sweep`) expulsa los menos usados
+    hasta volver al presupuesto y persiste el índice.
+    """
+
+    def __init__(self, root, max_bytes, executor):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.executor = executor
+        # file_unique_id -> tamaño en bytes, del menos al más usado
+        self._entries = OrderedDict()
+        self.total_bytes = 0
+        self._dirty = False
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'evicted_bytes': 0}
+
+    async def _run(self, func):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func)
+
+    def path(self, file_unique_id):
+        shard = hashlib.sha1(file_unique_id.encode()).hexdigest()[:2]
+        return os.path.join(self.root, shard, file_unique_id)
+
+    def _scan(self):
+        """Leer el índice y conciliarlo con los archivos que hay en disco."""
+        try:
+            with open(os.path.join(self.root, INDEX_FILE)) as index_file:
+                indexed = json.load(index_file)
+        except (FileNotFoundError, ValueError):
+            indexed = []
+
+        on_disk = {}
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if filename.startswith(".tmp-"):
+                    # Escritura interrumpida
+                    os.remove(path)
+                elif directory != self.root:
+                    stat = os.stat(path)
+                    on_disk[filename] = (stat.st_size, stat.st_mtime)
+
+        entries = OrderedDict()
+        # Los archivos que no están en el índice se consideran los menos usados
+        known = set(indexed)
+        for file_unique_id, (size, _) in sorted(on_disk.items(), key=lambda item: item[1][1]):
+            if file_unique_id not in known:
+                entries[file_unique_id] = size
+        for file_unique_id in indexed:
+            if file_unique_id in on_disk:
+                entries[file_unique_id] = on_disk[file_unique_id][0]
+        return entries
+
+    async def load(self):
+        """Cargar el índice al arrancar."""
+        self._entries = await self._run(self._scan)
+        self.total_bytes = sum(self._entries.values())
+
+    async def get(self, file_unique_id):
+        """Bytes guardados para este `file_unique_id`, o None si no están en caché."""
+        if file_unique_id not in self._entries:
+            self.stats['misses'] += 1
+            return None
+
+        def read():
+            with open(self.path(file_unique_id), "rb") as cached:
+                return cached.read()
+
+        try:
+            data = await self._run(read)
+        except FileNotFoundError:
+            self._forget(file_unique_id)
+            self.stats['misses'] += 1
+            return None
+        self._entries.move_to_end(file_unique_id)
+        self._dirty = True
+        self.stats['hits'] += 1
+        return data
+
+    async def put(self, file_unique_id, data):
+        """Guardar los bytes descargados."""
+        await self._run(lambda: atomic_write(self.path(file_unique_id), [data]))
+        self._forget(file_unique_id)
+        self._entries[file_unique_id] = len(data)
+        self.total_bytes += len(data)
+        self._dirty = True
+
+    def _forget(self, file_unique_id):
+        size = self._entries.pop(file_unique_id, None)
+        if size is not None:
+            self.total_bytes -= size
+            self._dirty = True
+
+    async def sweep(self):
+        """Expulsar los archivos menos usados hasta volver al presupuesto y guardar el índice."""
+        evicted = []
+        while self.total_bytes > self.max_bytes and self._entries:
+            file_unique_id, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.stats['evictions'] += 1
+            self.stats['evicted_bytes'] += size
+            evicted.append(file_unique_id)
+        if not evicted and not self._dirty:
+            return 0
+
+        self._dirty = False
+        index = json.dumps(list(self._entries)).encode()
+
+        def write():
+            for file_unique_id in evicted:
+                try:
+                    os.remove(self.path(file_unique_id))
+                except FileNotFoundError:
+                    pass
+            atomic_write(os.path.join(self.root, INDEX_FILE), [index])
+
+        await self._run(write)
+        return len(evicted)
@@ -0,0 +1,156 @@
+import asyncio
+import time
+from contextlib import contextmanager
+
+# Sub-buckets por potencia de dos: error relativo de cada bucket < 1/64 (~1.6 %)
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_HALF = 1 << (SUB_BUCKET_BITS - 1)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _bucket_index(value):
+    """Índice log-lineal (estilo HDR) de un valor entero no negativo."""
+    shift = max(0, value.bit_length() - SUB_BUCKET_BITS)
+    return shift * SUB_BUCKET_HALF + (value >> shift)
+
+
+def _bucket_upper(index):
+    """Mayor valor que cae en el bucket `index`."""
+    shift = max(0, index // SUB_BUCKET_HALF - 1)
+    return ((index - shift * SUB_BUCKET_HALF + 1) << shift) - 1
+
+
+class Histogram:
+    """Histograma de latencias con buckets log-lineales, en microsegundos.
+
+    Registrar un valor es una operación entera y un incremento en un dict;
+    los percentiles se calculan solo al leerlos.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, micros):
+        micros = max(0, int(micros))
+        index = _bucket_index(micros)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += micros
+        self.max = max(self.max, micros)
+        self.min = micros if self.min is None else min(self.min, micros)
+
+    def percentile(self, quantile):
+        """Valor (µs) por debajo del cual queda la fracción `quantile` de las muestras."""
+        if not self.count:
+            return 0
+        target = max(1, round(quantile * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(_bucket_upper(index), self.max)
+        return self.max
+
+
+class Metrics:
+    """Latencias por etapa y modelo, con salida en formato de texto de Prometheus.
+
+    También expone valores instantáneos (`gauge`) que se leen al renderizar
+    y contadores (`increment`).
+    """
+
+    def __init__(self, prefix="retiebot"):
+        self.prefix = prefix
+        # (etapa, modelo) -> Histogram
+        self.histograms = {}
+        # nombre -> (ayuda, {etiquetas ordenadas: función que devuelve el valor})
+        self.gauges = {}
+        # nombre -> (ayuda, {etiquetas ordenadas: cuenta})
+        self.counters = {}
+
+    def increment(self, name, help_text, amount=1, **labels):
+        """Sumar `amount` al contador `{prefix}_{name}` con esas etiquetas."""
+        _, series = self.counters.setdefault(name, (help_text, {}))
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + amount
+
+    def gauge(self, name, help_text, read, **labels):
+        """Registrar `read()` como el valor actual de `{prefix}_{name}` con esas etiquetas."""
+        _, series = self.gauges.setdefault(name, (help_text, {}))
+        series[tuple(sorted(labels.items()))] = read
+
+    def observe(self, stage, seconds, model=""):
+        key = (stage, model)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.record(seconds * 1_000_000)
+
+    @contextmanager
+    def timer(self, stage, model=""):
+        """Medir con reloj monótono el bloque como una etapa; también si falla."""
+        started = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter_ns() - started) / 1e9, model)
+
+    def render(self):
+        """Percentiles p50/p95/p99, suma y cantidad de cada etapa como un `summary` de Prometheus,
+        más los gauges y contadores."""
+        name = f"{self.prefix}_stage_latency_seconds"
+        lines = [
+            f"# HELP {name} Latencia de cada etapa del procesamiento de un mensaje.",
+            f"# TYPE {name} summary",
+        ]
+        for (stage, model), histogram in sorted(self.histograms.items()):
+            labels = f'stage="{_escape(stage)}",model="{_escape(model)}"'
+            for quantile in QUANTILES:
+                value = histogram.percentile(quantile) / 1e6
+                lines.append(f'{name}{{{labels},quantile="{quantile}"}} {value:.6f}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.total / 1e6:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        for kind, families in (("gauge", self.gauges), ("counter", self.counters)):
+            for family, (help_text, series) in sorted(families.items()):
+                name = f"{self.prefix}_{family}"
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                for labels, value in sorted(series.items()):
+                    rendered = ",".join(f'{key}="{_escape(label)}"' for key, label in labels)
+                    value = value() if callable(value) else value
+                    lines.append(f"{name}{{{rendered}}} {float(value):.6g}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+async def serve_metrics(metrics, host, port):
+    """Servir `metrics.render()` en /metrics con un servidor HTTP mínimo sobre asyncio."""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Descartar las cabeceras
+            while (await reader.readline()).strip():
+                pass
+            parts = request_line.decode(errors="replace").split()
+            if len(parts) >= 2 and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", metrics.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
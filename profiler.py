@@ -0,0 +1,96 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+# Marcos donde un hilo espera sin usar CPU; no cuentan en el resumen
+IDLE_FRAMES = ("select_(selectors.py", "wait_(threading.py", "_worker_(thread.py", "get_(queue.py",
+               "serve_forever_(socketserver.py")
+
+
+def _frame_label(code):
+    # El formato colapsado separa los marcos con ";" y la cuenta con un espacio
+    label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label.replace(";", ":").replace(" ", "_")
+
+
+class SamplingProfiler:
+    """Perfilador estadístico: muestrea las pilas de todos los hilos a `hz` por segundo.
+
+    No usa `sys.setprofile` ni un depurador: un hilo aparte recorre las pilas
+    de `sys._current_frames` en cada muestra, así que el bot sigue funcionando
+    y el costo es proporcional a la frecuencia de muestreo. El resultado se
+    escribe en formato colapsado (`hilo;marco;marco cuenta`), el que leen
+    flamegraph.pl, speedscope e inferno.
+    """
+
+    def __init__(self, hz=100, max_depth=128):
+        self.hz = hz
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self.running = False
+
+    def _sample(self, stacks, own_thread):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            labels = []
+            while frame is not None and len(labels) < self.max_depth:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, f"hilo-{thread_id}").replace(" ", "_").replace(";", ":"))
+            stacks[";".join(reversed(labels))] += 1
+
+    def profile(self, seconds):
+        """Muestrear durante `seconds` segundos y devolver {pila colapsada: muestras}.
+
+        Bloquea el hilo que lo llama; solo puede haber un perfil a la vez.
+        """
+        with self._lock:
+            if self.running:
+                raise RuntimeError("Ya hay un perfil en curso")
+            self.running = True
+        stacks = Counter()
+        own_thread = threading.get_ident()
+        interval = 1 / self.hz
+        try:
+            deadline = time.perf_counter() + seconds
+            next_sample = time.perf_counter()
+            while next_sample < deadline:
+                self._sample(stacks, own_thread)
+                next_sample += interval
+                delay = next_sample - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # Si el muestreo se atrasa, no intentar recuperar las muestras perdidas
+                    next_sample = time.perf_counter()
+        finally:
+            with self._lock:
+                self.running = False
+        return stacks
+
+    @staticmethod
+    def write(stacks, path):
+        """Guardar las pilas en formato colapsado, de la más frecuente a la menos."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as output:
+            for stack, count in stacks.most_common():
+                output.write(f"{stack} {count}\n")
+        return path
+
+
+def top_functions(stacks, limit=10):
+    """Funciones donde más muestras activas terminaron (tiempo propio): [(marco, fracción)]."""
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaf = stack.rsplit(";", 1)[-1]
+        if not leaf.startswith(IDLE_FRAMES):
+            leaves[leaf] += count
+    total = sum(leaves.values())
+    return [(frame, count / total) for frame, count in leaves.most_common(limit)] if total else []
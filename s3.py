@@ -0,0 +1,311 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+import httpx
+
+# Hash SHA-256 del cuerpo vacío, usado en GET/HEAD/DELETE
+EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+# S3 exige partes de al menos 5 MiB (salvo la última)
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class ObjectStorageError(Exception):
+    """Error devuelto por el almacenamiento de objetos."""
+
+    def __init__(self, status_code, code, message=""):
+        super().__init__(f"{status_code} {code}: {message}")
+        self.status_code = status_code
+        self.code = code
+
+
+def _strip_namespace(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find_text(root, name):
+    for element in root.iter():
+        if _strip_namespace(element.tag) == name:
+            return element.text
+    return None
+
+
+def _content_md5(body):
+    return base64.b64encode(hashlib.md5(body).digest()).decode()
+
+
+def _hmac(key, message):
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+def _quote(value, safe="-_.~"):
+    return quote(value, safe=safe)
+
+
+class S3Client:
+    """Cliente S3 asíncrono (compatible con MinIO) sobre un pool de httpx.
+
+    Las firmas SigV4 y las URLs prefirmadas se calculan localmente; solo las
+    operaciones sobre objetos van a la red.
+    """
+
+    def __init__(self, endpoint_url, access_key, secret_key, bucket, region="us-east-1",
+                 http_client=None, part_size=8 * 1024 * 1024, max_concurrency=4):
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.host = httpx.URL(self.endpoint_url).netloc.decode()
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.bucket = bucket
+        self.region = region
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_concurrency = max_concurrency
+        # El pool solo se cierra aquí si el cliente lo creó
+        self._owns_http = http_client is None
+        self.http = http_client or httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            timeout=httpx.Timeout(30.0, connect=5.0),
+        )
+
+    # Firma SigV4
+
+    def _path(self, key=None):
+        path = f"/{self.bucket}"
+        if key:
+            path += "/" + _quote(key, safe="-_.~/")
+        return path
+
+    @staticmethod
+    def _canonical_query(params):
+        return "&".join(f"{_quote(k)}={_quote(str(v))}" for k, v in sorted(params.items()))
+
+    def _scope(self, now):
+        return f"{now:%Y%m%d}/{self.region}/s3/aws4_request"
+
+    def _signature(self, now, canonical_request):
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            f"{now:%Y%m%dT%H%M%SZ}",
+            self._scope(now),
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        key = _hmac(f"AWS4{self.secret_key}".encode(), f"{now:%Y%m%d}")
+        for part in (self.region, "s3", "aws4_request"):
+            key = _hmac(key, part)
+        return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    def _sign(self, method, path, params, headers, payload_hash, now=None):
+        """Agregar a `headers` las cabeceras de autenticación SigV4."""
+        now = now or datetime.now(timezone.utc)
+        headers["host"] = self.host
+        headers["x-amz-date"] = f"{now:%Y%m%dT%H%M%SZ}"
+        headers["x-amz-content-sha256"] = payload_hash
+        signed = sorted(name.lower() for name in headers)
+        lowered = {name.lower(): " ".join(str(value).split()) for name, value in headers.items()}
+        canonical_request = "\n".join([
+            method,
+            path,
+            self._canonical_query(params),
+            "".join(f"{name}:{lowered[name]}\n" for name in signed),
+            ";".join(signed),
+            payload_hash,
+        ])
+        headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{self._scope(now)}, "
+            f"SignedHeaders={';'.join(signed)}, Signature={self._signature(now, canonical_request)}"
+        )
+        return headers
+
+    def presigned_get_object(self, key, expires=timedelta(days=7), now=None):
+        """URL prefirmada para descargar el objeto, calculada sin ir a la red."""
+        now = now or datetime.now(timezone.utc)
+        path = self._path(key)
+        params = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{self._scope(now)}",
+            "X-Amz-Date": f"{now:%Y%m%dT%H%M%SZ}",
+            "X-Amz-Expires": str(int(expires.total_seconds())),
+            "X-Amz-SignedHeaders": "host",
+        }
+        canonical_request = "\n".join([
+            "GET", path, self._canonical_query(params), f"host:{self.host}\n", "host", "UNSIGNED-PAYLOAD",
+        ])
+        params["X-Amz-Signature"] = self._signature(now, canonical_request)
+        return f"{self.endpoint_url}{path}?{self._canonical_query(params)}"
+
+    # Peticiones
+
+    async def _request(self, method, key=None, params=None, body=b"", headers=None, ok=(200,)):
+        params = params or {}
+        path = self._path(key)
+        payload_hash = hashlib.sha256(body).hexdigest() if body else EMPTY_SHA256
+        headers = self._sign(method, path, params, dict(headers or {}), payload_hash)
+        url = self.endpoint_url + path
+        if params:
+            url += "?" + self._canonical_query(params)
+        response = await self.http.request(method, url, content=body or None, headers=headers)
+        if response.status_code not in ok:
+            code, message = "HTTP" + str(response.status_code), ""
+            if response.content:
+                try:
+                    root = ET.fromstring(response.content)
+                    code = _find_text(root, "Code") or code
+                    message = _find_text(root, "Message") or ""
+                except ET.ParseError:
+                    pass
+            raise ObjectStorageError(response.status_code, code, message)
+        return response
+
+    async def bucket_exists(self):
+        try:
+            await self._request("HEAD")
+            return True
+        except ObjectStorageError as e:
+            if e.status_code == 404:
+                return False
+            raise
+
+    async def make_bucket(self):
+        await self._request("PUT")
+
+    async def stat_object(self, key):
+        """Cabeceras del objeto, o None si no existe."""
+        try:
+            response = await self._request("HEAD", key)
+        except ObjectStorageError as e:
+            if e.status_code == 404:
+                return None
+            raise
+        return response.headers
+
+    async def get_object(self, key):
+        response = await self._request("GET", key)
+        return response.content
+
+    async def put_object(self, key, data, content_type="application/octet-stream"):
+        response = await self._request("PUT", key, body=data, headers={"content-type": content_type})
+        return response.headers.get("etag")
+
+    async def copy_object(self, source_key, key):
+        await self._request("PUT", key, headers={"x-amz-copy-source": self._path(source_key)})
+
+    async def delete_object(self, key):
+        await self._request("DELETE", key, ok=(200, 204))
+
+    async def list_objects(self, prefix="", start_after=None, max_keys=1000):
+        """Listar hasta `max_keys` objetos en orden de clave: [(clave, última modificación)]."""
+        params = {"list-type": "2", "prefix": prefix, "max-keys": max_keys}
+        if start_after:
+            params["start-after"] = start_after
+        response = await self._request("GET", params=params)
+        objects = []
+        for element in ET.fromstring(response.content).iter():
+            if _strip_namespace(element.tag) == "Contents":
+                key = _find_text(element, "Key")
+                modified = datetime.strptime(_find_text(element, "LastModified")[:19], "%Y-%m-%dT%H:%M:%S")
+                objects.append((key, modified.replace(tzinfo=timezone.utc)))
+        return objects
+
+    async def delete_objects(self, keys):
+        """Borrar hasta 1000 objetos en una sola petición y devolver las claves que fallaron."""
+        body = ("<Delete><Quiet>true</Quiet>" + "".join(
+            f"<Object><Key>{escape(key)}</Key></Object>" for key in keys
+        ) + "</Delete>").encode()
+        response = await self._request("POST", params={"delete": ""}, body=body,
+                                       headers={"content-md5": _content_md5(body)})
+        root = ET.fromstring(response.content)
+        return [_find_text(error, "Key") for error in root.iter() if _strip_namespace(error.tag) == "Error"]
+
+    async def put_expiration_rule(self, prefix, days, rule_id="expire-images"):
+        """Instalar una regla de ciclo de vida que expira los objetos de `prefix` tras `days` días."""
+        body = (
+            "<LifecycleConfiguration><Rule>"
+            f"<ID>{escape(rule_id)}</ID><Filter><Prefix>{escape(prefix)}</Prefix></Filter>"
+            f"<Status>Enabled</Status><Expiration><Days>{int(days)}</Days></Expiration>"
+            "<AbortIncompleteMultipartUpload><DaysAfterInitiation>1</DaysAfterInitiation></AbortIncompleteMultipartUpload>"
+            "</Rule></LifecycleConfiguration>"
+        ).encode()
+        await self._request("PUT", params={"lifecycle": ""}, body=body, headers={"content-md5": _content_md5(body)})
+
+    # Subida multiparte
+
+    async def _create_multipart_upload(self, key, content_type):
+        response = await self._request("POST", key, params={"uploads": ""}, headers={"content-type": content_type})
+        return _find_text(ET.fromstring(response.content), "UploadId")
+
+    async def _upload_part(self, key, upload_id, number, data):
+        response = await self._request("PUT", key, params={"partNumber": number, "uploadId": upload_id}, body=data)
+        return number, response.headers["etag"]
+
+    async def _complete_multipart_upload(self, key, upload_id, parts):
+        body = "<CompleteMultipartUpload>" + "".join(
+            f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in sorted(parts)
+        ) + "</CompleteMultipartUpload>"
+        await self._request("POST", key, params={"uploadId": upload_id}, body=body.encode())
+
+    async def upload_stream(self, key, chunks, content_type="application/octet-stream"):
+        """Subir un flujo asíncrono de bytes sin archivo intermedio y devolver su tamaño.
+
+        Si el flujo cabe en una parte se sube con un solo PUT; si no, se usa
+        subida multiparte con hasta `max_concurrency` partes en vuelo mientras
+        se sigue leyendo el flujo.
+        """
+        buffer = bytearray()
+        size = 0
+        upload_id = None
+        number = 0
+        pending = set()
+        parts = []
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def send_part(part_number, data):
+            try:
+                return await self._upload_part(key, upload_id, part_number, data)
+            finally:
+                semaphore.release()
+
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                size += len(chunk)
+                while len(buffer) >= self.part_size:
+                    if upload_id is None:
+                        upload_id = await self._create_multipart_upload(key, content_type)
+                    data = bytes(buffer[:self.part_size])
+                    del buffer[:self.part_size]
+                    number += 1
+                    await semaphore.acquire()
+                    pending.add(asyncio.ensure_future(send_part(number, data)))
+                    done = {task for task in pending if task.done()}
+                    pending -= done
+                    parts.extend(task.result() for task in done)
+
+            if upload_id is None:
+                await self.put_object(key, bytes(buffer), content_type)
+                return size
+
+            if buffer:
+                number += 1
+                await semaphore.acquire()
+                pending.add(asyncio.ensure_future(send_part(number, bytes(buffer))))
+            parts.extend(await asyncio.gather(*pending))
+            pending = set()
+            await self._complete_multipart_upload(key, upload_id, parts)
+            return size
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            if upload_id is not None:
+                try:
+                    await self._request("DELETE", key, params={"uploadId": upload_id}, ok=(200, 204))
+                except Exception:
+                    pass
+            raise
+
+    async def aclose(self):
+        if self._owns_http:
+            await self.http.aclose()
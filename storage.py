@@ -0,0 +1,539 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote, unquote
+
+from s3 import MIN_PART_SIZE
+
+
+def atomic_write(path, chunks):
+    """Escribir el archivo de forma atómica: temporal en el mismo directorio y renombrado."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            for chunk in chunks:
+                temp_file.write(chunk)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class BlobStore:
+    """Interfaz común de los almacenes de objetos (blobs) del bot.
+
+    `url` devuelve None cuando el backend no puede dar una URL pública
+    (disco local o memoria); en ese caso las imágenes se envían a OpenAI
+    como archivo.
+    """
+
+    # Tamaño hasta el que un flujo se sube de una vez en lugar de por partes
+    part_size = MIN_PART_SIZE
+    supports_urls = False
+
+    async def ensure_ready(self):
+        """Preparar el backend (por ejemplo, crear el bucket)."""
+
+    async def ping(self):
+        """Petición mínima que mantiene abierta la conexión con el backend; local no la necesita."""
+
+    async def exists(self, key):
+        return await self.modified(key) is not None
+
+    async def modified(self, key):
+        """Última modificación del objeto (UTC), o None si no existe."""
+        raise NotImplementedError
+
+    async def get(self, key):
+        raise NotImplementedError
+
+    async def put(self, key, data, content_type="application/octet-stream"):
+        raise NotImplementedError
+
+    async def put_stream(self, key, chunks, content_type="application/octet-stream"):
+        """Guardar un flujo asíncrono de bytes y devolver su tamaño."""
+        data = bytearray()
+        async for chunk in chunks:
+            data += chunk
+        await self.put(key, bytes(data), content_type)
+        return len(data)
+
+    async def copy(self, source_key, key):
+        await self.put(key, await self.get(source_key))
+
+    async def delete(self, key):
+        raise NotImplementedError
+
+    async def delete_many(self, keys):
+        """Borrar varios objetos; los backends remotos lo hacen en una sola petición."""
+        for key in keys:
+            await self.delete(key)
+
+    async def list_objects(self, prefix="", start_after=None, limit=1000):
+        """Hasta `limit` objetos con el prefijo, en orden de clave: [(clave, última modificación)]."""
+        raise NotImplementedError
+
+    async def set_expiration(self, prefix, days):
+        """Instalar en el servidor una regla que expira los objetos; False si no se soporta."""
+        return False
+
+    async def url(self, key, expires):
+        return None
+
+    async def aclose(self):
+        """Liberar conexiones o recursos del backend."""
+
+
+class S3BlobStore(BlobStore):
+    """Backend S3/MinIO asíncrono sobre `s3.S3Client`."""
+
+    supports_urls = True
+
+    def __init__(self, s3_client):
+        self.s3 = s3_client
+        self.part_size = s3_client.part_size
+
+    async def ensure_ready(self):
+        if not await self.s3.bucket_exists():
+            await self.s3.make_bucket()
+
+    async def ping(self):
+        await self.s3.bucket_exists()
+
+    async def modified(self, key):
+        headers = await self.s3.stat_object(key)
+        return None if headers is None else parsedate_to_datetime(headers["last-modified"])
+
+    async def get(self, key):
+        return await self.s3.get_object(key)
+
+    async def put(self, key, data, content_type="application/octet-stream"):
+        await self.s3.put_object(key, data, content_type)
+
+    async def put_stream(self, key, chunks, content_type="application/octet-stream"):
+        return await self.s3.upload_stream(key, chunks, content_type)
+
+    async def copy(self, source_key, key):
+        await self.s3.copy_object(source_key, key)
+
+    async def delete(self, key):
+        await self.s3.delete_object(key)
+
+    async def delete_many(self, keys):
+        for start in range(0, len(keys), 1000):
+            failed = await self.s3.delete_objects(keys[start:start + 1000])
+            if failed:
+                raise RuntimeError(f"No se pudieron borrar {len(failed)} objetos, por ejemplo {failed[0]}")
+
+    async def list_objects(self, prefix="", start_after=None, limit=1000):
+        return await self.s3.list_objects(prefix, start_after, limit)
+
+    async def set_expiration(self, prefix, days):
+        await self.s3.put_expiration_rule(prefix, days)
+        return True
+
+    async def url(self, key, expires):
+        return self.s3.presigned_get_object(key, expires=expires)
+
+    async def aclose(self):
+        await self.s3.aclose()
+
+
+class MinioBlobStore(BlobStore):
+    """Backend con el cliente síncrono de `minio`, ejecutado en el executor."""
+
+    supports_urls = True
+
+    def __init__(self, minio_client, bucket, executor):
+        self.minio_client = minio_client
+        self.bucket = bucket
+        self.executor = executor
+
+    async def _run(self, func):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func)
+
+    async def ensure_ready(self):
+        if not await self._run(lambda: self.minio_client.bucket_exists(self.bucket)):
+            await self._run(lambda: self.minio_client.make_bucket(self.bucket))
+
+    async def ping(self):
+        await self._run(lambda: self.minio_client.bucket_exists(self.bucket))
+
+    async def modified(self, key):
+        from minio.error import S3Error
+
+        try:
+            return (await self._run(lambda: self.minio_client.stat_object(self.bucket, key))).last_modified
+        except S3Error as e:
+            if e.code in ("NoSuchKey", "NoSuchObject", "ResourceNotFound"):
+                return None
+            raise
+
+    async def get(self, key):
+        def read():
+            response = self.minio_client.get_object(self.bucket, key)
+            try:
+                return response.read()
+            finally:
+                response.close()
+                response.release_conn()
+        return await self._run(read)
+
+    async def put(self, key, data, content_type="application/octet-stream"):
+        await self._run(lambda: self.minio_client.put_object(
+            self.bucket, key, io.BytesIO(data), len(data), content_type=content_type
+        ))
+
+    async def copy(self, source_key, key):
+        from minio.commonconfig import CopySource
+
+        await self._run(lambda: self.minio_client.copy_object(self.bucket, key, CopySource(self.bucket, source_key)))
+
+    async def delete(self, key):
+        await self._run(lambda: self.minio_client.remove_object(self.bucket, key))
+
+    async def delete_many(self, keys):
+        from minio.deleteobjects import DeleteObject
+
+        def remove():
+            # remove_objects es perezoso: hay que consumir los errores para que borre
+            return list(self.minio_client.remove_objects(self.bucket, [DeleteObject(key) for key in keys]))
+
+        failed = await self._run(remove)
+        if failed:
+            raise RuntimeError(f"No se pudieron borrar {len(failed)} objetos, por ejemplo {failed[0].name}")
+
+    async def list_objects(self, prefix="", start_after=None, limit=1000):
+        def list_page():
+            objects = []
+            for item in self.minio_client.list_objects(self.bucket, prefix=prefix, recursive=True,
+                                                       start_after=start_after):
+                objects.append((item.object_name, item.last_modified))
+                if len(objects) >= limit:
+                    break
+            return objects
+        return await self._run(list_page)
+
+    async def set_expiration(self, prefix, days):
+        from minio.commonconfig import ENABLED, Filter
+        from minio.lifecycleconfig import Expiration, LifecycleConfig, Rule
+
+        config = LifecycleConfig([Rule(
+            ENABLED,
+            rule_filter=Filter(prefix=prefix),
+            rule_id="expire-images",
+            expiration=Expiration(days=days),
+        )])
+        await self._run(lambda: self.minio_client.set_bucket_lifecycle(self.bucket, config))
+        return True
+
+    async def url(self, key, expires):
+        return await self._run(lambda: self.minio_client.presigned_get_object(self.bucket, key, expires=expires))
+
+
+class LocalBlobStore(BlobStore):
+    """Backend en disco local para despliegues de un solo nodo.
+
+    Los objetos se reparten en subdirectorios según el hash de su clave
+    (`ab/cd/<clave>`) y cada escritura es atómica: se escribe en un archivo
+    temporal del mismo directorio y se renombra.
+    """
+
+    def __init__(self, root, executor):
+        self.root = root
+        self.executor = executor
+
+    async def _run(self, func):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func)
+
+    def path(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], quote(key, safe=""))
+
+    async def modified(self, key):
+        def stat():
+            try:
+                return datetime.fromtimestamp(os.stat(self.path(key)).st_mtime, timezone.utc)
+            except FileNotFoundError:
+                return None
+        return await self._run(stat)
+
+    async def get(self, key):
+        def read():
+            with open(self.path(key), "rb") as blob:
+                return blob.read()
+        return await self._run(read)
+
+    async def put(self, key, data, content_type="application/octet-stream"):
+        await self._run(lambda: atomic_write(self.path(key), [data]))
+
+    async def delete(self, key):
+        def remove():
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+        await self._run(remove)
+
+    async def list_objects(self, prefix="", start_after=None, limit=1000):
+        def list_page():
+            objects = []
+            for directory, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    key = unquote(filename)
+                    if filename.startswith(".tmp-") or not key.startswith(prefix):
+                        continue
+                    if start_after is not None and key <= start_after:
+                        continue
+                    modified = os.stat(os.path.join(directory, filename)).st_mtime
+                    objects.append((key, datetime.fromtimestamp(modified, timezone.utc)))
+            objects.sort()
+            return objects[:limit]
+        return await self._run(list_page)
+
+
+class MemoryBlobStore(BlobStore):
+    """Backend en memoria, para pruebas y mediciones sin costo de almacenamiento."""
+
+    def __init__(self):
+        self.blobs = {}
+        self.modified_at = {}
+
+    async def modified(self, key):
+        return self.modified_at.get(key)
+
+    async def get(self, key):
+        return self.blobs[key]
+
+    async def put(self, key, data, content_type="application/octet-stream"):
+        self.blobs[key] = bytes(data)
+        self.modified_at[key] = datetime.now(timezone.utc)
+
+    async def delete(self, key):
+        self.blobs.pop(key, None)
+        self.modified_at.pop(key, None)
+
+    async def list_objects(self, prefix="", start_after=None, limit=1000):
+        keys = sorted(key for key in self.blobs
+                      if key.startswith(prefix) and (start_after is None or key > start_after))
+        return [(key, self.modified_at[key]) for key in keys[:limit]]
+
+
+class ImageArchive:
+    """Archivo de imágenes direccionado por contenido (SHA-256) sobre un `BlobStore`.
+
+    Una imagen reenviada o repetida se guarda una sola vez, y las URLs
+    firmadas se reutilizan hasta poco antes de que expiren.
+
+    Con `retention` (la edad a la que la regla del bucket o el barrido borran
+    las imágenes) un objeto se reutiliza solo hasta `url_margin` antes de
+    cumplirla. La edad se cuenta desde su última modificación en el almacén,
+    también para lo escrito antes de un reinicio; uno que ya está por
+    cumplirla se vuelve a escribir y la cuenta empieza de nuevo.
+    """
+
+    def __init__(self, blobs, url_expiry=timedelta(days=7), url_margin=timedelta(hours=1), max_entries=10000,
+                 retention=None):
+        self.blobs = blobs
+        self.url_expiry = url_expiry
+        self.url_margin = url_margin
+        self.max_entries = max_entries
+        self.retention = retention
+        # (destino, file_unique_id de Telegram) -> objeto archivado o archivo subido a OpenAI
+        self._uploads = OrderedDict()
+        # objetos que ya sabemos que están en el bucket -> instante monotónico en que se escribieron
+        self._stored = OrderedDict()
+        # nombre del objeto -> (URL firmada, instante monotónico en que deja de reutilizarse)
+        self._urls = OrderedDict()
+        self.stats = {'bytes_saved': 0, 'uploads_skipped': 0, 'downloads_skipped': 0, 'urls_reused': 0}
+
+    @staticmethod
+    def object_name(image_bytes):
+        """Nombre del objeto a partir del SHA-256 del contenido."""
+        return f"images/sha256/{hashlib.sha256(image_bytes).hexdigest()}.jpg"
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.max_entries:
+            cache.popitem(last=False)
+
+    def _expires_at(self, object_name):
+        """Instante monotónico en que el objeto deja de reutilizarse (None = sin límite conocido)."""
+        stored_at = self._stored.get(object_name)
+        if stored_at is None or self.retention is None:
+            return None
+        return stored_at + (self.retention - self.url_margin).total_seconds()
+
+    def _fresh(self, object_name):
+        """Si el objeto está en el bucket y la retención no lo va a borrar pronto."""
+        if object_name not in self._stored:
+            return False
+        expires_at = self._expires_at(object_name)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.forget([object_name])
+            return False
+        return True
+
+    def lookup(self, file_unique_id, file_size=0, destination="minio"):
+        """Objeto (o archivo de OpenAI) ya subido para esta foto, para no volver a descargarla."""
+        uploaded = self._uploads.get((destination, file_unique_id))
+        if uploaded and destination == "minio" and not self._fresh(uploaded):
+            # Archivado hace demasiado: la retención lo borra o ya lo borró
+            self._uploads.pop((destination, file_unique_id), None)
+            uploaded = None
+        if uploaded:
+            self._uploads.move_to_end((destination, file_unique_id))
+            self.stats['downloads_skipped'] += 1
+            self.stats['bytes_saved'] += file_size or 0
+        return uploaded
+
+    def remember(self, file_unique_id, uploaded, destination="minio"):
+        """Recordar dónde quedó subida la foto con este file_unique_id."""
+        self._remember(self._uploads, (destination, file_unique_id), uploaded)
+
+    async def exists(self, object_name):
+        """Comprobar si el objeto ya está en el bucket y se puede reutilizar.
+
+        Un objeto que no escribió este proceso se reutiliza según la edad que
+        tiene en el almacén: si está por cumplir `retention`, no.
+        """
+        if self._fresh(object_name):
+            return True
+        modified = await self.blobs.modified(object_name)
+        if modified is None:
+            return False
+        age = (datetime.now(timezone.utc) - modified).total_seconds()
+        self._remember(self._stored, object_name, time.monotonic() - max(age, 0.0))
+        return self._fresh(object_name)
+
+    async def store(self, file_unique_id, image_bytes):
+        """Archivar la imagen si su contenido aún no está en el bucket y devolver su nombre."""
+        object_name = self.object_name(image_bytes)
+        if await self.exists(object_name):
+            self.stats['uploads_skipped'] += 1
+            self.stats['bytes_saved'] += len(image_bytes)
+            self._stored.move_to_end(object_name)
+        else:
+            await self.blobs.put(object_name, image_bytes, "image/jpeg")
+            self._remember(self._stored, object_name, time.monotonic())
+        self.remember(file_unique_id, object_name)
+        return object_name
+
+    async def store_stream(self, file_unique_id, chunks):
+        """Archivar un flujo de bytes sin archivo intermedio y devolver el nombre del objeto.
+
+        Si el contenido cabe en una parte se guarda con `store`. Si no, se sube
+        por partes a una clave temporal calculando el hash en el camino, y al
+        final se copia a su nombre definitivo o se descarta si ya existía.
+        """
+        chunks = chunks.__aiter__()
+        head = bytearray()
+        async for chunk in chunks:
+            head += chunk
+            if len(head) >= self.blobs.part_size:
+                break
+        else:
+            return await self.store(file_unique_id, bytes(head))
+
+        digest = hashlib.sha256(head)
+
+        async def hashed():
+            yield bytes(head)
+            async for chunk in chunks:
+                digest.update(chunk)
+                yield chunk
+
+        # Bajo images/: si el proceso muere antes de borrarla, la regla de ciclo de vida o el barrido la borran
+        staging_name = f"images/uploads/{uuid.uuid4().hex}"
+        size = await self.blobs.put_stream(staging_name, hashed(), "image/jpeg")
+        try:
+            object_name = f"images/sha256/{digest.hexdigest()}.jpg"
+            if await self.exists(object_name):
+                self.stats['uploads_skipped'] += 1
+                self.stats['bytes_saved'] += size
+                self._stored.move_to_end(object_name)
+            else:
+                # Copiar encima de un objeto que ya estaba también reinicia su edad
+                await self.blobs.copy(staging_name, object_name)
+                self._remember(self._stored, object_name, time.monotonic())
+        finally:
+            await self.blobs.delete(staging_name)
+        self.remember(file_unique_id, object_name)
+        return object_name
+
+    def forget(self, object_names):
+        """Olvidar objetos borrados del almacén para no volver a ofrecerlos."""
+        object_names = set(object_names)
+        for object_name in object_names:
+            self._stored.pop(object_name, None)
+            self._urls.pop(object_name, None)
+        for key in [key for key, uploaded in self._uploads.items() if uploaded in object_names]:
+            del self._uploads[key]
+
+    async def url(self, object_name):
+        """URL firmada del objeto, reutilizada hasta `url_margin` antes de expirar.
+
+        Devuelve None si el almacén no da URLs (disco local o memoria).
+        """
+        cached = self._urls.get(object_name)
+        if cached and cached[1] > time.monotonic():
+            self.stats['urls_reused'] += 1
+            return cached[0]
+        url = await self.blobs.url(object_name, self.url_expiry)
+        if url is None:
+            return None
+        reuse_until = time.monotonic() + (self.url_expiry - self.url_margin).total_seconds()
+        expires_at = self._expires_at(object_name)
+        if expires_at is not None:
+            reuse_until = min(reuse_until, expires_at)
+        self._remember(self._urls, object_name, (url, reuse_until))
+        return url
+
+
+class LifecycleSweeper:
+    """Borra por lotes los objetos de `prefix` más antiguos que `max_age`.
+
+    Cada pasada lista un lote a partir del cursor de la pasada anterior, así el
+    costo de listar es constante; al llegar al final el cursor vuelve al inicio.
+    """
+
+    def __init__(self, blobs, prefix, max_age, batch_size=1000, on_delete=None):
+        self.blobs = blobs
+        self.prefix = prefix
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.on_delete = on_delete
+        self.cursor = None
+        self.stats = {'passes': 0, 'listed': 0, 'deleted': 0}
+
+    async def install_rule(self):
+        """Delegar la expiración al servidor si el backend lo soporta."""
+        return await self.blobs.set_expiration(self.prefix, max(1, self.max_age.days))
+
+    async def sweep(self):
+        """Procesar un lote y devolver cuántos objetos se borraron."""
+        objects = await self.blobs.list_objects(self.prefix, start_after=self.cursor, limit=self.batch_size)
+        cutoff = datetime.now(timezone.utc) - self.max_age
+        expired = [key for key, modified in objects if modified < cutoff]
+        if expired:
+            await self.blobs.delete_many(expired)
+            if self.on_delete:
+                self.on_delete(expired)
+        self.cursor = objects[-1][0] if len(objects) == self.batch_size else None
+        self.stats['passes'] += 1
+        self.stats['listed'] += len(objects)
+        self.stats['deleted'] += len(expired)
+        return len(expired)
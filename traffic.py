@@ -0,0 +1,179 @@
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import re
+import time
+
+from telegram import Update
+
+# Datos personales que se eliminan del registro
+_DROPPED_KEYS = {"last_name", "username", "phone_number", "bio", "location", "contact", "venue", "vcard"}
+# Identificadores que se reemplazan por seudónimos estables dentro de una grabación
+_PSEUDONYM_KEYS = {"file_id", "file_unique_id", "media_group_id"}
+# Nombres y firmas que se reemplazan por uno genérico (también los de mensajes reenviados)
+_GENERIC_NAMES = {
+    "first_name": "Usuario",
+    "title": "Grupo",
+    "forward_sender_name": "Usuario",
+    "sender_user_name": "Usuario",
+    "author_signature": "Autor",
+    "forward_signature": "Autor",
+}
+# Reemplazo de las URLs (enlaces de texto, vistas previas, botones)
+_MASKED_URL = "https://example.com/"
+_WORD = re.compile(r"\w")
+
+
+def _pseudonym(salt, value):
+    return hmac.new(salt, str(value).encode(), hashlib.sha256).hexdigest()
+
+
+def _pseudonymous_id(salt, value):
+    """Entero seudónimo con el mismo signo (los chats de grupo son negativos)."""
+    number = int(_pseudonym(salt, value)[:12], 16)
+    return -number if value < 0 else number
+
+
+def _mask_text(text):
+    """Ocultar el texto conservando su longitud (y las entidades) y el comando inicial."""
+    command = ""
+    if text.startswith("/"):
+        command, _, text = text.partition(" ")
+        command += " " if text else ""
+    return command + _WORD.sub("x", text)
+
+
+def anonymize(data, salt):
+    """Copia anonimizada del JSON de un Update.
+
+    Los ids de usuarios y chats se cambian por seudónimos estables (un mismo
+    usuario conserva su id en toda la grabación); los de archivos también, para
+    que el reenvío de una misma foto siga deduplicándose. Los nombres y firmas
+    (también los de reenvíos) quedan genéricos, las URLs se reemplazan y el
+    texto se enmascara sin cambiar su longitud.
+    """
+    if isinstance(data, list):
+        return [anonymize(item, salt) for item in data]
+    if not isinstance(data, dict):
+        return data
+    anonymous = {}
+    for key, value in data.items():
+        if key in _DROPPED_KEYS:
+            continue
+        if key == "id" and isinstance(value, int) and not isinstance(value, bool):
+            anonymous[key] = _pseudonymous_id(salt, value)
+        elif key in _PSEUDONYM_KEYS and isinstance(value, str):
+            anonymous[key] = f"{key[0]}{_pseudonym(salt, value)[:24]}"
+        elif key in ("text", "caption") and isinstance(value, str):
+            anonymous[key] = _mask_text(value)
+        elif key in _GENERIC_NAMES and isinstance(value, str):
+            anonymous[key] = _GENERIC_NAMES[key]
+        elif key == "url" and isinstance(value, str):
+            anonymous[key] = _MASKED_URL
+        else:
+            anonymous[key] = anonymize(value, salt)
+    return anonymous
+
+
+class TrafficRecorder:
+    """Grabar los updates entrantes, anonimizados, en un JSONL comprimido con gzip.
+
+    Cada línea es `{"t": <segundos desde la época>, "update": {...}}`. Las líneas
+    se acumulan en memoria y `flush` las agrega al archivo en el executor, como
+    un miembro gzip más (los lectores de gzip leen los miembros concatenados).
+    """
+
+    def __init__(self, path, executor, salt=None):
+        self.path = path
+        self.executor = executor
+        # Sal aleatoria por grabación: los seudónimos no se pueden cruzar entre grabaciones
+        self.salt = salt or os.urandom(16)
+        self._pending = []
+        self.stats = {'recorded': 0, 'flushes': 0}
+
+    def record(self, update):
+        self._pending.append(json.dumps(
+            {"t": time.time(), "update": anonymize(update.to_dict(), self.salt)}, ensure_ascii=False, default=str
+        ))
+        self.stats['recorded'] += 1
+
+    def _append(self, lines):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with gzip.open(self.path, "at", encoding="utf-8") as recording:
+            recording.write("\n".join(lines) + "\n")
+
+    async def flush(self):
+        """Agregar al archivo lo grabado desde el último flush y devolver cuántas líneas fueron."""
+        lines, self._pending = self._pending, []
+        if not lines:
+            return 0
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._append, lines)
+        self.stats['flushes'] += 1
+        return len(lines)
+
+
+class RecordingQueue(asyncio.Queue):
+    """Cola de updates que graba cada update en el momento en que llega."""
+
+    def __init__(self, recorder, maxsize=0):
+        super().__init__(maxsize)
+        self.recorder = recorder
+
+    def put_nowait(self, item):
+        super().put_nowait(item)
+        # PTB también encola marcadores internos, por ejemplo al detenerse
+        if not isinstance(item, Update):
+            return
+        try:
+            self.recorder.record(item)
+        except Exception:
+            # Grabar nunca debe impedir que el update se procese
+            pass
+
+
+def _shift_dates(data, delta):
+    """Mover las fechas del update `delta` segundos, como si acabara de llegar."""
+    if isinstance(data, list):
+        return [_shift_dates(item, delta) for item in data]
+    if not isinstance(data, dict):
+        return data
+    return {
+        key: value + delta if key in ("date", "edit_date") and isinstance(value, int) else _shift_dates(value, delta)
+        for key, value in data.items()
+    }
+
+
+def read_recording(path):
+    """Leer una grabación: [(segundos desde la época, JSON del update)] en orden de llegada."""
+    with gzip.open(path, "rt", encoding="utf-8") as recording:
+        records = [json.loads(line) for line in recording if line.strip()]
+    return sorted(((record["t"], record["update"]) for record in records), key=lambda record: record[0])
+
+
+async def replay(application, records, speed=1.0):
+    """Encolar los updates grabados en `application.update_queue` respetando su ritmo.
+
+    `speed` multiplica la velocidad (10 = diez veces más rápido); 0 los
+    encola todos sin esperas. Las fechas de los mensajes se corren al momento
+    de encolarlos. Devuelve la cantidad de updates encolados.
+    """
+    if not records:
+        return 0
+    first = records[0][0]
+    started = time.monotonic()
+    for offset, (arrived, data) in enumerate(records):
+        if speed:
+            delay = (arrived - first) / speed - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        data = _shift_dates(data, round(time.time() - arrived))
+        # Ids consecutivos: el orden de llegada es el de la grabación
+        update = Update.de_json(dict(data, update_id=offset + 1), application.bot)
+        await application.update_queue.put(update)
+    return len(records)
@@ -0,0 +1,92 @@
+import asyncio
+import re
+
+# Límite de caracteres que acepta la API de voz de OpenAI por solicitud
+MAX_TTS_CHARS = 4096
+
+# Fin de frase: puntuación seguida de espacio, o salto de línea (listas y tablas)
+_SENTENCE_END = re.compile(r'(?<=[.!?;])\s+|\s*\n+\s*')
+
+# Abreviaturas frecuentes en textos del RETIE que no terminan una frase
+_ABBREVIATIONS = {"art", "arts", "num", "núm", "no", "nro", "sr", "sra", "dr", "ing", "etc", "ej", "pág", "cap", "min", "máx", "aprox"}
+
+
+def split_sentences(text):
+    """Divide el texto en frases sin cortar en abreviaturas como 'Art.' o 'Núm.'"""
+    sentences = []
+    pending = ""
+    for piece in _SENTENCE_END.split(text):
+        piece = piece.strip()
+        if not piece:
+            continue
+        pending = f"{pending} {piece}" if pending else piece
+        last_word = pending.rsplit(" ", 1)[-1].rstrip(".").lower()
+        if pending.endswith(".") and last_word in _ABBREVIATIONS:
+            continue
+        sentences.append(pending)
+        pending = ""
+    if pending:
+        sentences.append(pending)
+    return sentences
+
+
+def _split_long(sentence, max_chars):
+    """Corta por palabras una frase que no cabe en un solo segmento."""
+    parts = []
+    current = ""
+    for word in sentence.split():
+        if current and len(current) + 1 + len(word) > max_chars:
+            parts.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        parts.append(current)
+    return [part[:MAX_TTS_CHARS] for part in parts]
+
+
+def segment_text(text, max_chars=400):
+    """Agrupa frases en segmentos de hasta `max_chars` caracteres.
+
+    El primer segmento es solo la primera frase, para que el primer audio
+    dependa de ella y no de toda la respuesta.
+    """
+    max_chars = min(max_chars, MAX_TTS_CHARS)
+    segments = []
+    current = ""
+    for sentence in split_sentences(text):
+        for part in _split_long(sentence, max_chars):
+            if not segments and not current:
+                segments.append(part)
+            elif current and len(current) + 1 + len(part) > max_chars:
+                segments.append(current)
+                current = part
+            else:
+                current = f"{current} {part}" if current else part
+    if current:
+        segments.append(current)
+    return segments
+
+
+async def synthesize_segments(segments, synthesize, max_concurrency=3):
+    """Sintetiza los segmentos en paralelo acotado y los entrega en orden.
+
+    Cada audio se entrega apenas está listo su segmento y todos los anteriores.
+    Si un segmento falla se detiene la entrega y se cancelan los pendientes.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(segment):
+        async with semaphore:
+            return await synthesize(segment)
+
+    tasks = [asyncio.ensure_future(run(segment)) for segment in segments]
+    try:
+        for task in tasks:
+            audio = await task
+            if audio is None:
+                return
+            yield audio
+    finally:
+        for task in tasks:
+            task.cancel()
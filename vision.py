@@ -0,0 +1,53 @@
+import re
+
+# Resolución efectiva del modelo de visión según el nivel de detalle:
+# con "low" la imagen se reduce a 512x512; con "high" se ajusta a 2048x2048
+# y luego su lado corto se reduce a 768
+LOW_DETAIL_SIDE = 512
+HIGH_DETAIL_LONG_SIDE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+
+# Preguntas que exigen leer detalles finos de la imagen (texto, tablas, placas, planos)
+_FINE_DETAIL = re.compile(
+    r"\b(le[eé]|texto|escrit|tabla|placa|etiqueta|rótulo|rotulo|valor|n[uú]mero|dato|"
+    r"diagrama|plano|esquema|unifilar|calibre|medida|secci[oó]n|awg|mm|kv|amperios|voltaje|"
+    r"opci[oó]n|respuesta|pregunta|ejercicio|f[oó]rmula|c[aá]lculo)",
+    re.IGNORECASE,
+)
+
+
+def choose_detail(caption):
+    """Elegir `detail` para la imagen a partir del pie de foto.
+
+    Sin pie de foto la pregunta está escrita en la imagen y hay que leerla,
+    así que se usa "high". Si el pie pide leer datos finos también. Si la
+    pregunta está en el pie y la imagen solo da contexto basta con "low".
+    """
+    if not caption or _FINE_DETAIL.search(caption):
+        return "high"
+    return "low"
+
+
+def effective_size(width, height, detail):
+    """Tamaño al que el modelo reduce una imagen de `width`x`height`."""
+    if detail == "low":
+        scale = min(1, LOW_DETAIL_SIDE / max(width, height))
+    else:
+        scale = min(1, HIGH_DETAIL_LONG_SIDE / max(width, height), HIGH_DETAIL_SHORT_SIDE / min(width, height))
+    return width * scale, height * scale
+
+
+def select_photo(photos, detail):
+    """Elegir el PhotoSize más pequeño que no pierde resolución para `detail`.
+
+    Solo usa el ancho y alto que Telegram ya envía: la meta es la resolución
+    efectiva de la foto más grande, y cualquier tamaño que la alcance da el
+    mismo resultado en el modelo con menos descarga y subida.
+    """
+    ordered = sorted(photos, key=lambda photo: photo.width * photo.height)
+    largest = ordered[-1]
+    target_width, target_height = effective_size(largest.width, largest.height, detail)
+    for photo in ordered:
+        if photo.width >= target_width and photo.height >= target_height:
+            return photo
+    return largest